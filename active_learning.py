@@ -0,0 +1,219 @@
+"""
+Active-learning capture: uncertainty of every saved prediction
+Every image is stored, but nothing said which ones the model struggled with, and
+finding them meant re-running the model over the whole images/ folder. The image
+writer thread now appends one fixed-size record per saved image to a binary index
+(images/uncertainty.bin, 75 bytes per image):
+
+    message_id   uint64       LINE message id
+    received_at  float64      unix time
+    sha256       32 bytes     image hash (the blob in image_store.py)
+    classes      3 x uint16   top-3 class indices
+    probs        3 x float32  top-3 probabilities
+    entropy      float32      entropy in nats (see below)
+    margin       float32      top-1 minus top-2 probability
+    selected     uint8        set once the image has been handed out for relabelling
+
+predict_pil returns the top 3 only, so the entropy is computed over those three
+probabilities plus the remaining mass as one bucket. That is a lower bound on the
+full entropy, and ranks images the same way in practice; the margin is exact.
+
+The index is read with numpy in one call, so selecting the most uncertain images
+is a sort over the recorded scores, never a model run. Selection is incremental:
+handed-out images are flagged and skipped next time, and an image sent several
+times is handed out once.
+
+    python active_learning.py stats
+    python active_learning.py select --top 50 --by margin --copy-to relabel/
+
+Configuration (environment variables):
+    ACTIVE_LEARNING=1       # set to 0 to stop recording (the index is kept)
+    IMAGE_STORE_DIR=images  # the index lives next to the image store
+"""
+
+import argparse
+import csv
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+import metrics
+
+TOP_K = 3
+INDEX_NAME = "uncertainty.bin"
+
+RECORD = np.dtype([
+    ("message_id", "<u8"),
+    ("received_at", "<f8"),
+    ("sha256", "V32"),
+    ("classes", "<u2", (TOP_K,)),
+    ("probs", "<f4", (TOP_K,)),
+    ("entropy", "<f4"),
+    ("margin", "<f4"),
+    ("selected", "u1"),
+])
+
+
+def uncertainty(probs):
+    """(entropy, margin) for the top-k probabilities of one prediction, highest first."""
+    probs = [max(0.0, float(p)) for p in probs]
+    rest = max(0.0, 1.0 - sum(probs))
+    entropy = -sum(p * np.log(p) for p in probs + [rest] if p > 0)
+    margin = probs[0] - probs[1] if len(probs) > 1 else probs[0]
+    return float(entropy), float(margin)
+
+
+class UncertaintyIndex:
+    """Append-only file of RECORD entries; class names are kept in a sidecar text file."""
+
+    def __init__(self, path, class_names=None):
+        self.path = path
+        self.classes_path = f"{path}.classes"
+        self._lock = threading.Lock()
+        if class_names is not None:
+            self.class_names = list(class_names)
+            if not os.path.exists(self.classes_path):
+                with open(self.classes_path, "w", encoding="utf-8") as f:
+                    f.write("\n".join(self.class_names) + "\n")
+        elif os.path.exists(self.classes_path):
+            with open(self.classes_path, encoding="utf-8") as f:
+                self.class_names = f.read().split()
+        else:
+            self.class_names = []
+        self._class_index = {name: index for index, name in enumerate(self.class_names)}
+
+    def append(self, message_id, sha256, predictions, received_at=None):
+        """Record one prediction ([(breed_name, confidence), ...]) for a stored image."""
+        record = np.zeros(1, dtype=RECORD)
+        message_id = str(message_id)
+        record["message_id"] = int(message_id) if message_id.isdigit() else 0
+        record["received_at"] = received_at or time.time()
+        record["sha256"] = bytes.fromhex(sha256)
+        predictions = list(predictions)[:TOP_K]
+        for slot, (name, confidence) in enumerate(predictions):
+            record["classes"][0, slot] = self._class_index.get(name, 0)
+            record["probs"][0, slot] = confidence
+        entropy, margin = uncertainty([confidence for _, confidence in predictions])
+        record["entropy"] = entropy
+        record["margin"] = margin
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(record.tobytes())
+        metrics.ACTIVE_LEARNING_RECORDS.inc()
+
+    def load(self):
+        """All records as a numpy structured array (empty if nothing was recorded)."""
+        if not os.path.exists(self.path):
+            return np.zeros(0, dtype=RECORD)
+        return np.fromfile(self.path, dtype=RECORD, count=os.path.getsize(self.path) // RECORD.itemsize)
+
+    def select(self, top=50, by="entropy", mark=True):
+        """
+        Most uncertain images not handed out before, one per unique image.
+
+        Args:
+            top: number of images to return
+            by: "entropy" (highest first) or "margin" (smallest first)
+            mark: flag the returned images so the next call skips them
+
+        Returns:
+            numpy array of RECORD, most uncertain first
+        """
+        if by not in ("entropy", "margin"):
+            raise ValueError(f"by must be entropy or margin, got '{by}'")
+        records = self.load()
+        candidates = np.flatnonzero(records["selected"] == 0)
+        if not len(candidates):
+            return records[:0]
+
+        score = -records["entropy"][candidates] if by == "entropy" else records["margin"][candidates]
+        order = candidates[np.argsort(score, kind="stable")]
+        # Same photo sent many times: its most uncertain record stands for all of them
+        _, first = np.unique(records["sha256"][order], return_index=True)
+        chosen = order[np.sort(first)][:top]
+
+        if mark and len(chosen):
+            hashes = records["sha256"][chosen]
+            with self._lock:
+                flags = np.memmap(self.path, dtype=RECORD, mode="r+", shape=(len(records),))
+                flags["selected"][np.isin(flags["sha256"], hashes)] = 1
+                flags.flush()
+                del flags
+        return records[chosen]
+
+    def stats(self):
+        records = self.load()
+        if not len(records):
+            return {"records": 0}
+        return {
+            "records": len(records),
+            "unique_images": len(np.unique(records["sha256"])),
+            "selected": int(np.count_nonzero(records["selected"])),
+            "median_entropy": round(float(np.median(records["entropy"])), 3),
+            "median_margin": round(float(np.median(records["margin"])), 3),
+            "below_60pct": int(np.count_nonzero(records["probs"][:, 0] < 0.6)),
+        }
+
+    def describe(self, record):
+        """Readable summary of one record: top-3 as 'breed 45%, ...'."""
+        names = []
+        for index, prob in zip(record["classes"], record["probs"]):
+            name = self.class_names[index] if index < len(self.class_names) else str(index)
+            names.append(f"{name} {prob:.0%}")
+        return ", ".join(names)
+
+
+def create_uncertainty_index_from_env(store, class_names):
+    """Index next to the image store, or None when ACTIVE_LEARNING=0."""
+    if os.getenv("ACTIVE_LEARNING", "1") != "1":
+        return None
+    return UncertaintyIndex(os.path.join(store.root, INDEX_NAME), class_names)
+
+
+def main():
+    from image_store import ImageStore
+
+    parser = argparse.ArgumentParser(description="Select uncertain images for relabelling")
+    parser.add_argument("command", choices=["stats", "select"])
+    parser.add_argument("--dir", default=os.getenv("IMAGE_STORE_DIR", "images"))
+    parser.add_argument("--top", type=int, default=50)
+    parser.add_argument("--by", choices=["entropy", "margin"], default="entropy")
+    parser.add_argument("--copy-to", help="copy the selected images here, with a manifest.csv")
+    parser.add_argument("--dry-run", action="store_true", help="do not flag the images as selected")
+    args = parser.parse_args()
+
+    index = UncertaintyIndex(os.path.join(args.dir, INDEX_NAME))
+    if args.command == "stats":
+        print(index.stats())
+        return
+
+    store = ImageStore(args.dir)
+    chosen = index.select(args.top, by=args.by, mark=not args.dry_run)
+    if args.copy_to:
+        os.makedirs(args.copy_to, exist_ok=True)
+    rows = []
+    for rank, record in enumerate(chosen, 1):
+        sha256 = record["sha256"].tobytes().hex()
+        path = store.path_for_hash(sha256)
+        summary = index.describe(record)
+        print(f"{rank:>4}  H={record['entropy']:.3f}  margin={record['margin']:.3f}  "
+              f"{sha256[:12]}  {summary}" + ("" if path else "  (image swept)"))
+        if args.copy_to and path:
+            target = f"{rank:04d}_{sha256[:12]}{os.path.splitext(path)[1]}"
+            shutil.copyfile(path, os.path.join(args.copy_to, target))
+            rows.append([target, sha256, record["message_id"], f"{record['entropy']:.4f}",
+                         f"{record['margin']:.4f}", summary])
+    if args.copy_to:
+        with open(os.path.join(args.copy_to, "manifest.csv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["file", "sha256", "message_id", "entropy", "margin", "top3"])
+            writer.writerows(rows)
+        print(f"Copied {len(rows)} images to {args.copy_to}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Admission control and load shedding for the image pipeline
+Each stage (pipeline, download, inference, llm) has a maximum number of requests in flight
+and a bounded wait queue in front of it. When a stage is full and its queue is full too
+(or the wait exceeds the queue timeout) the work is shed instead of piling up, so the
+requests that are admitted still answer before their reply token expires.
+
+Usage in a handler:
+    try:
+        with admission.stage("download"):
+            ...                                   # raises Shed when the stage is saturated
+    except Shed:
+        ...                                       # fast "busy" reply
+
+    with admission.try_stage("llm") as admitted:
+        if admitted:
+            ...                                   # optional work; skipped under load
+
+asyncio handlers (main_async.py) use `async with admission.stage_async(...)` and
+try_stage_async(...). They share each stage's counters, queue and metrics with the
+threaded handlers, but wait on an asyncio future (with asyncio.wait_for(queue_timeout)),
+so a queued coroutine holds neither an executor thread nor the event loop.
+
+Configuration (environment variables, 0 = unlimited):
+    ADMISSION_CONTROL=1            # set to 0 to disable every limit
+    ADMISSION_PIPELINE_MAX=32      # images being processed at once; beyond this reply "busy" immediately
+    ADMISSION_DOWNLOAD_MAX=8       # concurrent LINE content downloads
+    ADMISSION_INFERENCE_MAX=2      # concurrent predict_pil calls (default: INFERENCE_PROCESSES or 2)
+    ADMISSION_LLM_MAX=8            # concurrent breed-info LLM calls; beyond this reply with the prediction only
+    ADMISSION_QUEUE_MAX=16         # requests allowed to wait for each stage
+    ADMISSION_QUEUE_TIMEOUT=10     # seconds a request may wait for a stage
+"""
+
+import asyncio
+import os
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+import metrics
+
+
+class Shed(Exception):
+    """Raised when a stage rejects work because it is saturated."""
+
+    def __init__(self, stage):
+        super().__init__(f"stage '{stage}' is saturated")
+        self.stage = stage
+
+
+class StageLimiter:
+    """At most `max_in_flight` holders, at most `max_queue` waiters, each waiting up to `queue_timeout`."""
+
+    def __init__(self, stage, max_in_flight, max_queue, queue_timeout):
+        self.stage = stage
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.shed = 0
+        self._cond = threading.Condition()
+        # Futures of queued coroutines (acquire_async), served before threads on release
+        self._async_waiters = deque()
+        metrics.QUEUE_DEPTH.set_function(lambda: self.in_flight + self.waiting, queue=f"admission_{stage}")
+
+    def _has_room(self):
+        return self.max_in_flight <= 0 or self.in_flight < self.max_in_flight
+
+    def acquire(self):
+        """Return True when admitted, False when the work should be shed."""
+        with self._cond:
+            if self._has_room():
+                self.in_flight += 1
+                return True
+            if self.waiting >= self.max_queue or self.queue_timeout <= 0:
+                return self._shed()
+
+            self.waiting += 1
+            try:
+                admitted = self._cond.wait_for(self._has_room, timeout=self.queue_timeout)
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                return self._shed()
+            self.in_flight += 1
+            return True
+
+    async def acquire_async(self):
+        """acquire() for coroutines: waits on an asyncio future, never in a thread."""
+        with self._cond:
+            if self._has_room():
+                self.in_flight += 1
+                return True
+            if self.waiting >= self.max_queue or self.queue_timeout <= 0:
+                return self._shed()
+            self.waiting += 1
+            waiter = asyncio.get_running_loop().create_future()
+            self._async_waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+            return True
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._cond:
+                queued = waiter in self._async_waiters
+                if queued:
+                    self._async_waiters.remove(waiter)
+                    self.waiting -= 1
+                    if isinstance(e, asyncio.TimeoutError):
+                        return self._shed()
+            if isinstance(e, asyncio.CancelledError):
+                if not queued:
+                    # release() handed this coroutine a place just before it was cancelled
+                    self.release()
+                raise
+            # Timed out just as release() handed over a place: take it
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            while self._async_waiters:
+                # Hand the place straight to the first queued coroutine
+                waiter = self._async_waiters.popleft()
+                self.waiting -= 1
+                self.in_flight += 1
+                try:
+                    waiter.get_loop().call_soon_threadsafe(_grant, waiter)
+                    return
+                except RuntimeError:
+                    # Its event loop is closed
+                    self.in_flight -= 1
+            self._cond.notify()
+
+    def _shed(self):
+        # Called with the condition held
+        self.shed += 1
+        metrics.SHED.inc(stage=self.stage)
+        print(f"⚠️  Shed {self.stage}: {self.in_flight} in flight, {self.waiting} waiting "
+              f"(total shed: {self.shed})")
+        return False
+
+
+def _grant(waiter):
+    # On the waiter's event loop; a waiter that already timed out takes the place anyway
+    if not waiter.done():
+        waiter.set_result(True)
+
+
+class AdmissionController:
+    """A StageLimiter per pipeline stage."""
+
+    def __init__(self, limits, max_queue=16, queue_timeout=10.0):
+        self.limiters = {
+            stage: StageLimiter(stage, max_in_flight, max_queue, queue_timeout)
+            for stage, max_in_flight in limits.items()
+        }
+
+    @contextmanager
+    def stage(self, name):
+        """Hold a place in the stage, or raise Shed."""
+        limiter = self.limiters.get(name)
+        if limiter is None:
+            yield
+            return
+        if not limiter.acquire():
+            raise Shed(name)
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    @contextmanager
+    def try_stage(self, name):
+        """Like stage(), but yields False instead of raising when the work is shed."""
+        limiter = self.limiters.get(name)
+        if limiter is None:
+            yield True
+            return
+        admitted = limiter.acquire()
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                limiter.release()
+
+    @asynccontextmanager
+    async def stage_async(self, name):
+        """stage() for coroutines."""
+        limiter = self.limiters.get(name)
+        if limiter is None:
+            yield
+            return
+        if not await limiter.acquire_async():
+            raise Shed(name)
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    @asynccontextmanager
+    async def try_stage_async(self, name):
+        """try_stage() for coroutines."""
+        limiter = self.limiters.get(name)
+        if limiter is None:
+            yield True
+            return
+        admitted = await limiter.acquire_async()
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                limiter.release()
+
+    def shed_counts(self):
+        return {stage: limiter.shed for stage, limiter in self.limiters.items()}
+
+
+def create_admission_from_env():
+    """Build the AdmissionController from ADMISSION_* environment variables."""
+    if os.getenv("ADMISSION_CONTROL", "1") == "0":
+        return AdmissionController({})
+
+    default_inference = int(os.getenv("INFERENCE_PROCESSES", "0")) or 2
+    limits = {
+        "pipeline": int(os.getenv("ADMISSION_PIPELINE_MAX", "32")),
+        "download": int(os.getenv("ADMISSION_DOWNLOAD_MAX", "8")),
+        "inference": int(os.getenv("ADMISSION_INFERENCE_MAX", str(default_inference))),
+        "llm": int(os.getenv("ADMISSION_LLM_MAX", "8")),
+    }
+    controller = AdmissionController(
+        limits,
+        max_queue=int(os.getenv("ADMISSION_QUEUE_MAX", "16")),
+        queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10")),
+    )
+    # The pipeline limit is checked on arrival: no waiting, reply "busy" straight away
+    controller.limiters["pipeline"].queue_timeout = 0
+    return controller
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Offline batch classification of image directories
+Runs the dog breed model over a folder of photos (e.g. the images/ archive) without
+going through LINE, for example to re-score the archive after a model update.
+
+- images are listed lazily (os.scandir, recursive), so huge directories start at once
+- decoding + preprocessing (the same dog_model.preprocess_image as predict_pil) runs in
+  a pool of worker processes, one batch per task; at most --prefetch batches are in
+  flight, so memory stays bounded however large the directory is
+- the model runs in this process on whole batches, overlapping with decoding
+- predictions are written as CSV or JSONL (by --output extension or --format) while
+  the run progresses, with a throughput line every --progress images
+
+Usage:
+    python batch_classify.py images/ --output predictions.csv
+    python batch_classify.py images/ --backend onnx --batch-size 64 --output scores.jsonl
+    python batch_classify.py photos/ --decode-workers 6 --threads 2 --top-k 5
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import dog_model
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp")
+
+
+def iter_images(root, extensions=IMAGE_EXTENSIONS):
+    """Yield image paths under root, depth first, without listing the whole tree up front."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"⚠️  Cannot list {directory}: {e}", file=sys.stderr)
+            continue
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif entry.name.lower().endswith(extensions):
+                yield entry.path
+        stack.extend(reversed(subdirectories))
+
+
+def iter_chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def decode_batch(paths):
+    """
+    Worker process: decode and preprocess one batch of files.
+
+    Returns:
+        tuple: (decoded paths, (N, 3, 224, 224) float32 array or None, [(path, error), ...])
+    """
+    start = time.perf_counter()
+    decoded, arrays, failures = [], [], []
+    for path in paths:
+        try:
+            with Image.open(path) as image:
+                arrays.append(dog_model.preprocess_image(image.convert("RGB")))
+            decoded.append(path)
+        except Exception as e:
+            failures.append((path, f"{type(e).__name__}: {e}"))
+    batch = np.concatenate(arrays) if arrays else None
+    return decoded, batch, failures, time.perf_counter() - start
+
+
+class PredictionWriter:
+    """Streams prediction rows to a CSV or JSONL file."""
+
+    def __init__(self, path, output_format, top_k):
+        self.format = output_format
+        self.top_k = top_k
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        if output_format == "csv":
+            self._csv = csv.writer(self._file)
+            header = ["path"]
+            for rank in range(1, top_k + 1):
+                header += [f"breed_{rank}", f"confidence_{rank}"]
+            self._csv.writerow(header + ["error"])
+
+    def write(self, path, predictions=None, error=None):
+        if self.format == "jsonl":
+            row = {"path": path}
+            if predictions is not None:
+                row["predictions"] = [{"breed": breed, "confidence": round(confidence, 6)}
+                                      for breed, confidence in predictions]
+            if error is not None:
+                row["error"] = error
+            self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+            return
+        row = [path]
+        for breed, confidence in predictions or []:
+            row += [breed, f"{confidence:.6f}"]
+        row += [""] * (1 + 2 * self.top_k - len(row))
+        self._csv.writerow(row + [error or ""])
+
+    def close(self):
+        self._file.close()
+
+
+def classify_directory(root, forward, writer, batch_size=32, decode_workers=2, prefetch=None,
+                       top_k=3, progress=500):
+    """
+    Classify every image under root and stream the results to writer.
+
+    Returns:
+        dict: counts, wall time and throughput
+    """
+    prefetch = prefetch or 2 * decode_workers
+    totals = {"images": 0, "failed": 0, "decode_seconds": 0.0, "inference_seconds": 0.0}
+    start = time.perf_counter()
+    next_report = progress
+
+    with ProcessPoolExecutor(max_workers=decode_workers) as pool:
+        chunks = iter_chunks(iter_images(root), batch_size)
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.submit(decode_batch, chunk))
+            if len(in_flight) >= prefetch:
+                break
+
+        while in_flight:
+            decoded, batch, failures, decode_seconds = in_flight.popleft().result()
+            # Keep the pool busy while this batch goes through the model
+            chunk = next(chunks, None)
+            if chunk is not None:
+                in_flight.append(pool.submit(decode_batch, chunk))
+
+            totals["decode_seconds"] += decode_seconds
+            for path, error in failures:
+                writer.write(path, error=error)
+            totals["failed"] += len(failures)
+
+            if batch is not None:
+                inference_start = time.perf_counter()
+                probs = dog_model.softmax(forward(batch))
+                totals["inference_seconds"] += time.perf_counter() - inference_start
+                for path, row in zip(decoded, probs):
+                    writer.write(path, dog_model.top_k(row, top_k))
+                totals["images"] += len(decoded)
+
+            if progress and totals["images"] >= next_report:
+                elapsed = time.perf_counter() - start
+                print(f"{totals['images']:>8} images  {totals['images'] / elapsed:7.1f} img/s  "
+                      f"{totals['failed']} failed")
+                next_report += progress
+
+    totals["seconds"] = time.perf_counter() - start
+    totals["images_per_sec"] = totals["images"] / totals["seconds"] if totals["seconds"] else 0.0
+    return totals
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Classify every image in a directory")
+    parser.add_argument("directory", nargs="?", default="images")
+    parser.add_argument("--output", default="predictions.csv")
+    parser.add_argument("--format", choices=["csv", "jsonl"],
+                        help="output format (default: from the --output extension)")
+    parser.add_argument("--backend", choices=["torch", "onnx"], default="torch")
+    parser.add_argument("--model", help="model file (default: resnet18_best.pth / dog_breed_model.onnx)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--decode-workers", type=int, default=max(1, cpus // 2),
+                        help="processes decoding and preprocessing images")
+    parser.add_argument("--threads", type=int, default=max(1, cpus - max(1, cpus // 2)),
+                        help="intra-op threads for the model")
+    parser.add_argument("--prefetch", type=int, help="batches decoded ahead (default 2 per decode worker)")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--progress", type=int, default=500, help="print throughput every N images (0 = off)")
+    args = parser.parse_args()
+
+    output_format = args.format or ("jsonl" if args.output.endswith((".jsonl", ".json")) else "csv")
+
+    load_start = time.perf_counter()
+    forward = dog_model.load_forward(args.backend, args.model, num_threads=args.threads)
+    print(f"Model loaded ({args.backend}, {args.threads} threads) in {time.perf_counter() - load_start:.1f}s; "
+          f"decoding with {args.decode_workers} processes, batch {args.batch_size}")
+
+    writer = PredictionWriter(args.output, output_format, args.top_k)
+    try:
+        totals = classify_directory(args.directory, forward, writer,
+                                    batch_size=args.batch_size,
+                                    decode_workers=args.decode_workers,
+                                    prefetch=args.prefetch,
+                                    top_k=args.top_k,
+                                    progress=args.progress)
+    finally:
+        writer.close()
+
+    images = totals["images"] or 1
+    print(f"\n✅ {totals['images']} images classified, {totals['failed']} failed, "
+          f"in {totals['seconds']:.1f}s ({totals['images_per_sec']:.1f} img/s)")
+    print(f"   decode {totals['decode_seconds'] / images * 1000:.1f} ms/img (across workers), "
+          f"inference {totals['inference_seconds'] / images * 1000:.1f} ms/img")
+    print(f"   {output_format.upper()} written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
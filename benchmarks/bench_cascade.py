@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Cascade benchmark: latency saved vs. accuracy lost (see cascade.py)
+Runs the fast model (int8 ONNX) and the full model on every image of a held-out set
+drawn from images/, timing each at batch size 1. Every threshold is then evaluated
+offline from the same runs, so one pass gives the whole trade-off curve:
+
+- escalated:  share of images the fast model was unsure about
+- mean / p99 latency of the cascade vs. the full model alone
+- top-1 agreement with the full model (the reference when photos are unlabelled)
+- accuracy of both, when photos live in folders named after their breed
+  (e.g. heldout/golden_retriever/*.jpg)
+
+Usage:
+    python benchmarks/bench_cascade.py
+    python benchmarks/bench_cascade.py --image-dir heldout/ --limit 1000 --full-backend onnx
+    python benchmarks/bench_cascade.py --thresholds 0.6 0.7 0.8 0.9 --output bench_cascade.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import numpy as np
+from PIL import Image
+
+import dog_model
+from batch_classify import iter_images
+from cascade import load_fast_forward
+from stats import latency_summary
+
+DEFAULT_THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95]
+
+
+def held_out_set(image_dir, limit, seed=0):
+    """Random sample of image paths, with a label when the parent folder is a breed name."""
+    paths = list(iter_images(image_dir))
+    random.Random(seed).shuffle(paths)
+    labels = {name: index for index, name in enumerate(dog_model.class_names)}
+    return [(path, labels.get(os.path.basename(os.path.dirname(path)))) for path in paths[:limit]]
+
+
+def timed(forward, batch):
+    start = time.perf_counter()
+    logits = forward(batch)
+    return dog_model.softmax(logits)[0], time.perf_counter() - start
+
+
+def run_models(samples, fast_forward, full_forward, warmup=3):
+    """Both models on every image: probabilities and per-image latency of each."""
+    rows = []
+    for index, (path, label) in enumerate(samples):
+        try:
+            with Image.open(path) as image:
+                batch = dog_model.preprocess_image(image.convert("RGB"))
+        except Exception as e:
+            print(f"⚠️  Skipping {path}: {e}")
+            continue
+        if index < warmup:
+            fast_forward(batch)
+            full_forward(batch)
+        fast_probs, fast_seconds = timed(fast_forward, batch)
+        full_probs, full_seconds = timed(full_forward, batch)
+        rows.append({"label": label, "fast": fast_probs, "full": full_probs,
+                     "fast_seconds": fast_seconds, "full_seconds": full_seconds})
+    return rows
+
+
+def evaluate(rows, threshold, min_margin=0.0):
+    """Cascade outcome for one confidence threshold, computed from the recorded runs."""
+    latencies, agree, correct_cascade, correct_full, labelled, escalated = [], 0, 0, 0, 0, 0
+    for row in rows:
+        top2 = np.sort(row["fast"])[-2:][::-1]
+        unsure = bool(top2[0] < threshold or top2[0] - top2[1] < min_margin)
+        prediction = int(np.argmax(row["full"] if unsure else row["fast"]))
+        full_prediction = int(np.argmax(row["full"]))
+        escalated += unsure
+        latencies.append(row["fast_seconds"] + (row["full_seconds"] if unsure else 0.0))
+        agree += prediction == full_prediction
+        if row["label"] is not None:
+            labelled += 1
+            correct_cascade += prediction == row["label"]
+            correct_full += full_prediction == row["label"]
+
+    summary = latency_summary(latencies)
+    result = {
+        "threshold": threshold,
+        "escalated": escalated / len(rows),
+        "mean_ms": summary["mean_ms"],
+        "p99_ms": summary["p99_ms"],
+        "agreement_with_full": agree / len(rows),
+        "labelled": labelled,
+    }
+    if labelled:
+        result["accuracy"] = correct_cascade / labelled
+        result["full_accuracy"] = correct_full / labelled
+        result["accuracy_loss"] = result["full_accuracy"] - result["accuracy"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fast-model-first cascade")
+    parser.add_argument("--image-dir", default=os.path.join(PROJECT_ROOT, "images"))
+    parser.add_argument("--limit", type=int, default=500, help="images in the held-out sample")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--full-backend", choices=["torch", "onnx"], default="torch")
+    parser.add_argument("--full-model", help="default: resnet18_best.pth / dog_breed_model.onnx")
+    parser.add_argument("--calibration-dir", default=os.path.join(PROJECT_ROOT, "images"),
+                        help="photos for int8 calibration when the fast model is (re)built from the full model")
+    parser.add_argument("--fast-model", default=os.path.join(PROJECT_ROOT, "dog_breed_model.int8.onnx"))
+    parser.add_argument("--threads", type=int, default=1, help="intra-op threads for both models")
+    parser.add_argument("--thresholds", nargs="+", type=float, default=DEFAULT_THRESHOLDS)
+    parser.add_argument("--min-margin", type=float, default=0.0)
+    parser.add_argument("--output", default="bench_cascade.json", help="JSON report path")
+    args = parser.parse_args()
+
+    samples = held_out_set(args.image_dir, args.limit, args.seed)
+    if not samples:
+        sys.exit(f"No images found under {args.image_dir}")
+
+    full_model = args.full_model or os.path.join(
+        PROJECT_ROOT, dog_model.MODEL_PATH if args.full_backend == "torch" else dog_model.ONNX_MODEL_PATH)
+    fast_forward = load_fast_forward(args.fast_model, source_path=full_model, num_threads=args.threads,
+                                     calibration_dir=args.calibration_dir)
+    full_forward = dog_model.load_forward(args.full_backend, full_model, num_threads=args.threads)
+    print(f"Running both models on {len(samples)} images...")
+    rows = run_models(samples, fast_forward, full_forward)
+
+    full_only = latency_summary([row["full_seconds"] for row in rows])
+    fast_only = latency_summary([row["fast_seconds"] for row in rows])
+    results = [evaluate(rows, threshold, args.min_margin) for threshold in args.thresholds]
+
+    labelled = results[0]["labelled"]
+    print(f"\nfull model alone: {full_only['mean_ms']:.1f} ms mean, {full_only['p99_ms']:.1f} ms p99; "
+          f"fast model alone: {fast_only['mean_ms']:.1f} ms mean")
+    print(f"{'thresh':>6s} {'escal.':>7s} {'mean ms':>8s} {'p99 ms':>8s} {'speedup':>8s} {'agree':>7s}"
+          + (f" {'acc':>7s} {'loss':>7s}" if labelled else ""))
+    print("-" * (50 + (16 if labelled else 0)))
+    for result in results:
+        line = (f"{result['threshold']:6.2f} {result['escalated']:7.1%} {result['mean_ms']:8.1f} "
+                f"{result['p99_ms']:8.1f} {full_only['mean_ms'] / result['mean_ms']:7.2f}x "
+                f"{result['agreement_with_full']:7.1%}")
+        if labelled:
+            line += f" {result['accuracy']:7.1%} {result['accuracy_loss']:+7.1%}"
+        print(line)
+    if not labelled:
+        print("\n(no breed-named folders: agreement with the full model stands in for accuracy)")
+
+    report = {
+        "images": len(rows),
+        "labelled": labelled,
+        "full_backend": args.full_backend,
+        "threads": args.threads,
+        "full_model": {key: full_only[key] for key in ("mean_ms", "p50_ms", "p99_ms")},
+        "fast_model": {key: fast_only[key] for key in ("mean_ms", "p50_ms", "p99_ms")},
+        "thresholds": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
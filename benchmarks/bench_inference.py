@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Inference microbenchmark for the dog breed model
+Runs the classifier across backends (PyTorch / ONNX Runtime), precisions (fp32 / int8),
+thread counts and batch sizes, and writes a machine-readable JSON report with latency
+percentiles, images/sec and peak RSS so the deployment configuration can be chosen per host.
+
+Every (backend, precision, threads) combination runs in a fresh process, so thread
+settings apply cleanly and peak RSS is measured per configuration.
+
+Usage:
+    python benchmarks/bench_inference.py
+    python benchmarks/bench_inference.py --backends onnx --threads 1 2 4 --batch-sizes 1 8 32
+    python benchmarks/bench_inference.py --precisions fp32 --output bench_inference.json
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from queue import Empty
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import numpy as np
+
+import dog_model
+from stats import latency_summary
+
+DEFAULT_BATCH_SIZES = [1, 2, 4, 8, 16, 32]
+
+
+def default_thread_counts():
+    """1, 2, 4, ... up to the number of CPUs."""
+    cpus = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cpus:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cpus:
+        counts.append(cpus)
+    return counts
+
+
+def calibration_batches(image_dir, count=16, batch_size=8):
+    """Calibration data for int8: real photos from images/ if available, random noise otherwise."""
+    batches = dog_model.calibration_batches(image_dir, count, batch_size)
+    if not batches:
+        rng = np.random.default_rng(0)
+        return [rng.standard_normal((batch_size, 3, 224, 224), dtype=np.float32) for _ in range(2)]
+    return batches
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_config(config, result_queue):
+    """Child process: load one backend/precision/thread configuration and time every batch size."""
+    try:
+        load_start = time.perf_counter()
+        threads = config["threads"]
+
+        if config["backend"] == "torch":
+            torch = dog_model.configure_torch(threads, mkldnn=config["mkldnn"])
+            model = dog_model.build_torch_model(config["model_path"])
+            if config["precision"] == "int8":
+                model = dog_model.quantize_torch_model(model, calibration_batches(config["image_dir"]))
+
+            def infer(batch):
+                with torch.no_grad():
+                    return model(torch.from_numpy(batch)).numpy()
+        else:
+            session = dog_model.load_onnx_session(config["onnx_path"], num_threads=threads)
+            input_name = session.get_inputs()[0].name
+
+            def infer(batch):
+                return session.run(None, {input_name: batch})[0]
+
+        load_seconds = time.perf_counter() - load_start
+        rng = np.random.default_rng(0)
+        rows = []
+        for batch_size in config["batch_sizes"]:
+            batch = rng.standard_normal((batch_size, 3, 224, 224), dtype=np.float32)
+            for _ in range(config["warmup"]):
+                infer(batch)
+
+            latencies = []
+            deadline = time.perf_counter() + config["min_time"]
+            while len(latencies) < config["iterations"] or time.perf_counter() < deadline:
+                start = time.perf_counter()
+                infer(batch)
+                latencies.append(time.perf_counter() - start)
+
+            summary = latency_summary(latencies)
+            rows.append({
+                "backend": config["backend"],
+                "precision": config["precision"],
+                "threads": threads,
+                "batch_size": batch_size,
+                "iterations": len(latencies),
+                "latency_ms": {key: summary[key] for key in ("mean_ms", "p50_ms", "p90_ms", "p99_ms")},
+                "per_image_ms": summary["p50_ms"] / batch_size,
+                "images_per_sec": batch_size * len(latencies) / sum(latencies),
+            })
+
+        rss = peak_rss_mb()
+        for row in rows:
+            row["peak_rss_mb"] = rss
+            row["load_seconds"] = load_seconds
+        result_queue.put({"rows": rows})
+    except Exception as e:
+        result_queue.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def host_info():
+    info = {
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+    for module in ("torch", "onnxruntime"):
+        try:
+            info[module] = __import__(module).__version__
+        except ImportError:
+            info[module] = None
+    return info
+
+
+def print_table(rows):
+    print(f"\n{'backend':8s} {'prec':5s} {'thr':>3s} {'batch':>5s} {'p50 ms':>9s} {'p99 ms':>9s} "
+          f"{'ms/img':>8s} {'img/s':>8s} {'RSS MB':>7s}")
+    print("-" * 72)
+    for row in rows:
+        latency = row["latency_ms"]
+        print(f"{row['backend']:8s} {row['precision']:5s} {row['threads']:3d} {row['batch_size']:5d} "
+              f"{latency['p50_ms']:9.2f} {latency['p99_ms']:9.2f} {row['per_image_ms']:8.2f} "
+              f"{row['images_per_sec']:8.1f} {row['peak_rss_mb']:7.0f}")
+
+
+def recommend(rows):
+    """Pick the best single-image latency and best throughput configurations."""
+    if not rows:
+        return {}
+    single = [row for row in rows if row["batch_size"] == 1] or rows
+    best_latency = min(single, key=lambda row: row["latency_ms"]["p99_ms"])
+    best_throughput = max(rows, key=lambda row: row["images_per_sec"])
+    return {"lowest_p99_single_image": best_latency, "highest_throughput": best_throughput}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dog breed inference configurations")
+    parser.add_argument("--backends", nargs="+", choices=["torch", "onnx"], default=["torch", "onnx"])
+    parser.add_argument("--precisions", nargs="+", choices=["fp32", "int8"], default=["fp32", "int8"])
+    parser.add_argument("--threads", nargs="+", type=int, default=default_thread_counts())
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=DEFAULT_BATCH_SIZES)
+    parser.add_argument("--iterations", type=int, default=20, help="Minimum timed calls per batch size")
+    parser.add_argument("--min-time", type=float, default=1.0, help="Minimum seconds timed per batch size")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed calls per batch size")
+    parser.add_argument("--model", default=os.path.join(PROJECT_ROOT, dog_model.MODEL_PATH))
+    parser.add_argument("--onnx-model", default=os.path.join(PROJECT_ROOT, dog_model.ONNX_MODEL_PATH))
+    parser.add_argument("--image-dir", default=os.path.join(PROJECT_ROOT, "images"),
+                        help="Photos used to calibrate int8 quantization")
+    parser.add_argument("--mkldnn", action="store_true", help="Enable MKL-DNN for torch (disabled in the bot)")
+    parser.add_argument("--output", default="bench_inference.json", help="JSON report path")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="whatdog-bench-")
+    onnx_paths = {"fp32": args.onnx_model}
+    if "onnx" in args.backends and "int8" in args.precisions:
+        try:
+            onnx_paths["int8"] = dog_model.quantize_onnx_model(
+                args.onnx_model, os.path.join(workdir, "dog_breed_model.int8.onnx"),
+                calibration_batches(args.image_dir))
+        except Exception as e:
+            print(f"⚠️  Skipping ONNX int8: {e}")
+
+    context = multiprocessing.get_context("spawn")
+    rows, errors = [], []
+    try:
+        for backend, precision, threads in itertools.product(args.backends, args.precisions, args.threads):
+            if backend == "onnx" and precision not in onnx_paths:
+                continue
+            config = {
+                "backend": backend, "precision": precision, "threads": threads,
+                "batch_sizes": args.batch_sizes, "iterations": args.iterations,
+                "min_time": args.min_time, "warmup": args.warmup,
+                "model_path": args.model, "onnx_path": onnx_paths.get(precision),
+                "image_dir": args.image_dir, "mkldnn": args.mkldnn,
+            }
+            print(f"▶️  {backend} {precision} threads={threads} ...", flush=True)
+            queue = context.Queue()
+            process = context.Process(target=run_config, args=(config, queue))
+            process.start()
+            result = None
+            while result is None:
+                try:
+                    result = queue.get(timeout=1)
+                except Empty:
+                    if not process.is_alive():
+                        result = {"error": f"worker exited with code {process.exitcode}"}
+            process.join()
+
+            if "error" in result:
+                print(f"   ❌ {result['error']}")
+                errors.append({"backend": backend, "precision": precision, "threads": threads,
+                               "error": result["error"]})
+            else:
+                rows.extend(result["rows"])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(rows)
+    report = {
+        "host": host_info(),
+        "settings": {key: value for key, value in vars(args).items()},
+        "results": rows,
+        "errors": errors,
+        "recommendation": recommend(rows),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    best = report["recommendation"]
+    if best:
+        single, throughput = best["lowest_p99_single_image"], best["highest_throughput"]
+        print(f"\n🏁 Lowest single-image p99: {single['backend']} {single['precision']} "
+              f"threads={single['threads']} ({single['latency_ms']['p99_ms']:.2f} ms)")
+        print(f"🏁 Highest throughput:      {throughput['backend']} {throughput['precision']} "
+              f"threads={throughput['threads']} batch={throughput['batch_size']} "
+              f"({throughput['images_per_sec']:.1f} img/s)")
+    print(f"\n💾 Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Local stand-in for the LINE Messaging API
+Serves message content downloads and accepts reply_message calls so the bot can be
+benchmarked without touching api.line.me / api-data.line.me.
+
+Usage (standalone):
+    python benchmarks/fake_line_api.py --port 8090 --image dog.jpg
+
+Then start the bot with:
+    LINE_API_ENDPOINT=http://127.0.0.1:8090 LINE_API_DATA_ENDPOINT=http://127.0.0.1:8090
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+CONTENT_PATH = re.compile(r"^/v2/bot/message/([^/]+)/content$")
+
+
+def make_test_image(width=640, height=480):
+    """Create an in-memory JPEG to serve as message content."""
+    from PIL import Image
+
+    image = Image.new("RGB", (width, height), color=(181, 140, 92))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+class FakeLineAPI(ThreadingHTTPServer):
+    """HTTP server emulating the LINE content and reply endpoints."""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, image_bytes=None,
+                 content_latency=0.0, reply_latency=0.0):
+        super().__init__((host, port), _Handler)
+        self.image_bytes = image_bytes if image_bytes is not None else make_test_image()
+        self.content_latency = content_latency
+        self.reply_latency = reply_latency
+        self.lock = threading.Lock()
+        self.counts = {"content": 0, "reply": 0, "other": 0}
+        self.replies = []
+        self.keep_replies = 100
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, kind, payload=None):
+        with self.lock:
+            self.counts[kind] += 1
+            if payload is not None and len(self.replies) < self.keep_replies:
+                self.replies.append(payload)
+
+    def start(self):
+        """Serve in a daemon thread and return self."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if CONTENT_PATH.match(self.path):
+            if self.server.content_latency:
+                time.sleep(self.server.content_latency)
+            self.server.count("content")
+            self._send(200, self.server.image_bytes, "image/jpeg")
+        else:
+            self.server.count("other")
+            self._send(404, b'{"message":"Not found"}')
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b""
+        if self.path == "/v2/bot/message/reply":
+            if self.server.reply_latency:
+                time.sleep(self.server.reply_latency)
+            try:
+                payload = json.loads(raw or b"{}")
+            except ValueError:
+                payload = None
+            self.server.count("reply", payload)
+            self._send(200, b"{}")
+        else:
+            self.server.count("other")
+            self._send(404, b'{"message":"Not found"}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the LINE Messaging API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--image", help="JPEG file to serve as message content (default: generated)")
+    parser.add_argument("--content-latency", type=float, default=0.0, help="Seconds to wait before serving content")
+    parser.add_argument("--reply-latency", type=float, default=0.0, help="Seconds to wait before acknowledging a reply")
+    args = parser.parse_args()
+
+    image_bytes = None
+    if args.image:
+        with open(args.image, "rb") as f:
+            image_bytes = f.read()
+
+    server = FakeLineAPI(args.host, args.port, image_bytes, args.content_latency, args.reply_latency)
+    print(f"Fake LINE API listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
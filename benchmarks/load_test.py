@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test for the LINE chatbot
+Replays signed LINE webhook payloads (text and image events) against each main_*.py
+variant running under Waitress (or aiohttp for main_async.py), with local stand-ins for the LINE Messaging API and
+the LLM, then reports requests/sec, latency percentiles and a per-stage breakdown
+taken from the app's /metrics endpoint.
+
+Usage:
+    python benchmarks/load_test.py                                  # all variants
+    python benchmarks/load_test.py main_enhanced --concurrency 16 --requests 400
+    python benchmarks/load_test.py main main_enhanced --image-ratio 1.0 --json results.json
+"""
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_line_api import FakeLineAPI
+import mock_llm_server
+from mock_llm_server import MockLLMServer
+from stats import latency_summary
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# variant name -> (app spec, directory containing the module, server)
+VARIANTS = {
+    "main": ("main:app", PROJECT_ROOT, "waitress"),
+    "main_with_ollama": ("main_with_ollama:app", PROJECT_ROOT, "waitress"),
+    "main_with_thaillm": ("main_with_thaillm:app", PROJECT_ROOT, "waitress"),
+    "main_enhanced": ("main_enhanced:app", PROJECT_ROOT, "waitress"),
+    "main_pythonanywhere": ("main_pythonanywhere:app", os.path.join(PROJECT_ROOT, "pythonanywhere"), "waitress"),
+    "main_async": ("main_async:init_app", PROJECT_ROOT, "aiohttp"),
+}
+
+MODEL_FILES = ["resnet18_best.pth", "dog_breed_model.onnx"]
+
+TEST_QUESTIONS = [
+    "สุนัขพันธุ์ไหนเลี้ยงง่ายที่สุด",
+    "ชิวาวากินอะไรได้บ้าง",
+    "ควรพาน้องหมาไปฉีดวัคซีนตอนกี่เดือน",
+    "โกลเด้นรีทรีฟเวอร์ขนร่วงเยอะไหม",
+]
+
+CHANNEL_SECRET = "benchmark-channel-secret"
+CHANNEL_ACCESS_TOKEN = "benchmark-access-token"
+
+METRIC_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?\s+(\S+)$')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# ============================================================
+# Webhook payloads
+# ============================================================
+def build_event(kind, index, user_count=50):
+    """Build one LINE message event of the given kind ('text' or 'image')."""
+    message_id = str(10**15 + index)
+    if kind == "image":
+        message = {"type": "image", "id": message_id, "contentProvider": {"type": "line"}}
+    else:
+        message = {"type": "text", "id": message_id, "text": TEST_QUESTIONS[index % len(TEST_QUESTIONS)]}
+
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": f"Ubench{index % user_count:027d}"},
+        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": uuid.uuid4().hex,
+        "message": message,
+    }
+
+
+def sign(body, secret):
+    """Compute the X-Line-Signature header for a request body."""
+    digest = hmac.new(secret.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("utf-8")
+
+
+def build_webhook(kind, index):
+    body = json.dumps({"destination": "Ubenchmark", "events": [build_event(kind, index)]}, ensure_ascii=False)
+    return body, sign(body, CHANNEL_SECRET)
+
+
+# ============================================================
+# /metrics scraping
+# ============================================================
+def scrape_metrics(base_url):
+    """Return {(name, labels): value} parsed from the app's /metrics endpoint."""
+    try:
+        text = requests.get(f"{base_url}/metrics", timeout=5).text
+    except requests.RequestException:
+        return {}
+
+    samples = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            samples[(name, labels or "")] = float(value)
+    return samples
+
+
+def stage_breakdown(before, after):
+    """Mean latency per stage/LLM backend between two /metrics scrapes."""
+    breakdown = {}
+    for (name, labels), total in after.items():
+        for metric, prefix in (("whatdog_stage_duration_seconds_sum", "stage"),
+                               ("whatdog_llm_duration_seconds_sum", "llm")):
+            if name != metric:
+                continue
+            count_key = (metric.replace("_sum", "_count"), labels)
+            count = after.get(count_key, 0) - before.get(count_key, 0)
+            if count <= 0:
+                continue
+            label_value = labels.split('"')[1] if '"' in labels else "all"
+            seconds = total - before.get((name, labels), 0)
+            breakdown[f"{prefix}:{label_value}"] = {"count": int(count), "mean_ms": seconds / count * 1000}
+    return breakdown
+
+
+# ============================================================
+# App process management
+# ============================================================
+def prepare_workdir():
+    """Temporary working directory so logs/ and images/ don't pollute the project."""
+    workdir = tempfile.mkdtemp(prefix="whatdog-bench-")
+    for name in MODEL_FILES:
+        source = os.path.join(PROJECT_ROOT, name)
+        if os.path.exists(source):
+            os.symlink(source, os.path.join(workdir, name))
+    return workdir
+
+
+def start_app(variant, port, workdir, env_overrides, threads):
+    app_spec, module_dir, server = VARIANTS[variant]
+    env = dict(os.environ)
+    env.update(env_overrides)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [module_dir, PROJECT_ROOT, env.get("PYTHONPATH")]))
+    env["PYTHONUNBUFFERED"] = "1"
+
+    log_path = os.path.join(workdir, f"{variant}.log")
+    log_file = open(log_path, "w")
+    if server == "aiohttp":
+        command = [sys.executable, "-m", "aiohttp.web", "-H", "127.0.0.1", "-P", str(port), app_spec]
+    else:
+        command = [sys.executable, "-m", "waitress", f"--listen=127.0.0.1:{port}", f"--threads={threads}", app_spec]
+    process = subprocess.Popen(
+        command,
+        cwd=workdir, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+    )
+    log_file.close()
+    return process, log_path
+
+
+def wait_until_ready(base_url, process, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            # 200 only after model warm-up, so cold-start latency stays out of the results
+            if requests.get(f"{base_url}/ready", timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+# ============================================================
+# Load generation
+# ============================================================
+def run_load(base_url, total, concurrency, image_ratio, seed, start_index=0):
+    """Send `total` webhooks with `concurrency` parallel clients. Returns per-request results."""
+    rng = random.Random(seed)
+    kinds = ["image" if rng.random() < image_ratio else "text" for _ in range(total)]
+    local = threading.local()
+
+    def send(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        body, signature = build_webhook(kinds[i], start_index + i)
+        start = time.perf_counter()
+        try:
+            response = session.post(
+                base_url + "/",
+                data=body.encode("utf-8"),
+                headers={"Content-Type": "application/json", "X-Line-Signature": signature},
+                timeout=120,
+            )
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return kinds[i], time.perf_counter() - start, ok
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, range(total)))
+    return results, time.perf_counter() - wall_start
+
+
+def benchmark_variant(variant, args, line_api, llm_server):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    workdir = prepare_workdir()
+    env = {
+        "CHANNEL_SECRET": CHANNEL_SECRET,
+        "CHANNEL_ACCESS_TOKEN": CHANNEL_ACCESS_TOKEN,
+        "LINE_API_ENDPOINT": line_api.url,
+        "LINE_API_DATA_ENDPOINT": line_api.url,
+        "THAI_LLM_URL": f"{llm_server.url}/v1/chat/completions",
+        "OLLAMA_URL": llm_server.url,
+        # A few synthetic users send every request: per-user rate limits would shed the load
+        "USER_IMAGE_RATE_PER_MIN": "0",
+        "USER_TEXT_RATE_PER_MIN": "0",
+    }
+
+    print(f"\n▶️  {variant}: starting on {base_url} (workdir {workdir})")
+    process, log_path = start_app(variant, port, workdir, env, args.threads)
+    try:
+        if not wait_until_ready(base_url, process, args.startup_timeout):
+            print(f"   ❌ {variant} did not become ready, see {log_path}")
+            return None
+
+        if args.warmup:
+            run_load(base_url, args.warmup, min(args.concurrency, args.warmup), args.image_ratio, args.seed + 1,
+                     start_index=10**6)
+
+        replies_before = line_api.counts["reply"]
+        before = scrape_metrics(base_url)
+        results, wall_time = run_load(base_url, args.requests, args.concurrency, args.image_ratio, args.seed)
+        after = scrape_metrics(base_url)
+
+        latencies = [latency for _, latency, _ in results]
+        report = {
+            "variant": variant,
+            "concurrency": args.concurrency,
+            "requests": len(results),
+            "errors": sum(1 for _, _, ok in results if not ok),
+            "replies_received": line_api.counts["reply"] - replies_before,
+            "wall_time_s": wall_time,
+            "requests_per_sec": len(results) / wall_time if wall_time else 0.0,
+            "latency": latency_summary(latencies),
+            "by_kind": {
+                kind: latency_summary([latency for k, latency, _ in results if k == kind])
+                for kind in ("text", "image")
+                if any(k == kind for k, _, _ in results)
+            },
+            "stages": stage_breakdown(before, after),
+        }
+        print_report(report)
+        return report
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_report(report):
+    latency = report["latency"]
+    print(f"   📊 {report['requests']} requests in {report['wall_time_s']:.2f}s "
+          f"→ {report['requests_per_sec']:.1f} req/s "
+          f"(errors: {report['errors']}, replies: {report['replies_received']})")
+    print(f"   ⏱️  p50 {latency['p50_ms']:.1f}ms | p90 {latency['p90_ms']:.1f}ms | "
+          f"p99 {latency['p99_ms']:.1f}ms | max {latency['max_ms']:.1f}ms")
+    for kind, summary in report["by_kind"].items():
+        print(f"   - {kind:5s}: n={summary['count']:4d} p50 {summary['p50_ms']:.1f}ms p99 {summary['p99_ms']:.1f}ms")
+    if report["stages"]:
+        print("   🔍 Per-stage mean (from /metrics):")
+        for stage, values in sorted(report["stages"].items()):
+            print(f"      {stage:22s} {values['mean_ms']:9.2f}ms  (n={values['count']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test for the LINE chatbot variants")
+    parser.add_argument("variants", nargs="*", help=f"Variants to benchmark: {', '.join(VARIANTS)} (default: all)")
+    parser.add_argument("--requests", type=int, default=200, help="Webhooks to send per variant")
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel clients")
+    parser.add_argument("--threads", type=int, default=8, help="Waitress worker threads (ignored for main_async)")
+    parser.add_argument("--image-ratio", type=float, default=0.5, help="Fraction of image events (0..1)")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests sent first")
+    parser.add_argument("--content-latency", type=float, default=0.02, help="Fake LINE content delay in seconds")
+    parser.add_argument("--reply-latency", type=float, default=0.02, help="Fake LINE reply delay in seconds")
+    parser.add_argument("--startup-timeout", type=float, default=180, help="Seconds to wait for model loading")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="Write the full report to this file")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep temp dirs (logs, images, server output)")
+    mock_llm_server.add_arguments(parser.add_argument_group("mock LLM behaviour"), prefix="llm-")
+    parser.set_defaults(llm_latency=0.5)
+    args = parser.parse_args()
+
+    variants = args.variants or list(VARIANTS)
+    unknown = [v for v in variants if v not in VARIANTS]
+    if unknown:
+        parser.error(f"unknown variant(s): {', '.join(unknown)}")
+
+    line_api = FakeLineAPI(content_latency=args.content_latency, reply_latency=args.reply_latency).start()
+    llm_server = MockLLMServer(seed=args.seed, **mock_llm_server.server_kwargs(args, prefix="llm-")).start()
+    print(f"Fake LINE API: {line_api.url} | Mock LLM: {llm_server.url}")
+
+    reports = []
+    try:
+        for variant in variants:
+            report = benchmark_variant(variant, args, line_api, llm_server)
+            if report:
+                reports.append(report)
+    finally:
+        line_api.stop()
+        llm_server.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": reports}, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
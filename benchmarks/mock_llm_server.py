@@ -0,0 +1,326 @@
+"""
+Local mock LLM server for deterministic latency testing
+Speaks both the OpenAI-style /chat/completions schema (Thai LLM) and Ollama's
+/api/generate, streaming and non-streaming, so LLM-path changes can be benchmarked
+offline and reproducibly.
+
+Simulated behaviour (all optional):
+- Time to first token drawn from a latency distribution (fixed/uniform/normal/lognormal/exponential)
+- Output "tokens" emitted at a fixed token rate (also applied to non-streaming replies)
+- <think>...</think> blocks prepended to a fraction of answers
+- Error injection: HTTP 500s, hung requests (client timeouts) and malformed bodies
+
+Usage (standalone):
+    python benchmarks/mock_llm_server.py --port 8091 --latency 0.8 --dist lognormal --jitter 0.5 \\
+        --tokens-per-sec 40 --think-ratio 0.5 --error-rate 0.02 --hang-rate 0.01
+
+Then start the bot with:
+    THAI_LLM_URL=http://127.0.0.1:8091/v1/chat/completions OLLAMA_URL=http://127.0.0.1:8091
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLIES = [
+    "สุนัขพันธุ์นี้เป็นมิตร ฉลาด และเลี้ยงง่ายครับ ควรพาออกกำลังกายทุกวันและแปรงขนสัปดาห์ละ 2-3 ครั้ง",
+    "น้องหมาพันธุ์นี้ขนาดกลาง ร่าเริง ชอบเล่นกับเด็ก ต้องการพื้นที่วิ่งเล่นพอสมควรครับ",
+    "ควรให้อาหารที่เหมาะกับช่วงวัย ฉีดวัคซีนตามกำหนด และตรวจสุขภาพปีละครั้งครับ",
+]
+DEFAULT_THINK = "ผู้ใช้ถามเกี่ยวกับสุนัข ควรตอบสั้น กระชับ และเป็นภาษาไทย"
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+
+class LatencyModel:
+    """Seeded latency sampler. `mean` and `jitter` are in seconds."""
+
+    def __init__(self, dist="fixed", mean=0.0, jitter=0.0, seed=42):
+        if dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{dist}', choose from {LATENCY_DISTRIBUTIONS}")
+        self.dist = dist
+        self.mean = mean
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        with self._lock:
+            if self.dist == "fixed" or self.mean <= 0:
+                value = self.mean
+            elif self.dist == "uniform":
+                value = self._rng.uniform(self.mean - self.jitter, self.mean + self.jitter)
+            elif self.dist == "normal":
+                value = self._rng.gauss(self.mean, self.jitter)
+            elif self.dist == "lognormal":
+                # jitter is the sigma of the underlying normal; median == mean
+                value = self._rng.lognormvariate(math.log(self.mean), self.jitter)
+            else:
+                value = self._rng.expovariate(1.0 / self.mean)
+        return max(0.0, value)
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """HTTP server emulating the Thai LLM and Ollama APIs."""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, dist="fixed", jitter=0.0,
+                 tokens_per_sec=0.0, think_ratio=0.0, error_rate=0.0, hang_rate=0.0,
+                 hang_seconds=60.0, malformed_rate=0.0, replies=None, seed=42):
+        super().__init__((host, port), _Handler)
+        self.latency_model = LatencyModel(dist, latency, jitter, seed)
+        self.tokens_per_sec = tokens_per_sec
+        self.think_ratio = think_ratio
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.malformed_rate = malformed_rate
+        self.replies = replies or DEFAULT_REPLIES
+        self._rng = random.Random(seed + 1)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, kind):
+        with self.lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def decide(self):
+        """Pick this request's fate: 'ok', 'error', 'hang' or 'malformed'."""
+        with self.lock:
+            roll = self._rng.random()
+            think = self._rng.random() < self.think_ratio
+        for outcome, rate in (("error", self.error_rate), ("hang", self.hang_rate),
+                              ("malformed", self.malformed_rate)):
+            if roll < rate:
+                return outcome, think
+            roll -= rate
+        return "ok", think
+
+    def build_answer(self, prompt, think, max_tokens=None):
+        """Deterministic answer for a prompt, split into tokens (~one word or 4 chars each)."""
+        reply = self.replies[sum(prompt.encode("utf-8")) % len(self.replies)]
+        text = f"<think>\n{DEFAULT_THINK}\n</think>\n{reply}" if think else reply
+        tokens = []
+        for word in text.split(" "):
+            word = word + " "
+            tokens.extend(word[i:i + 4] for i in range(0, len(word), 4))
+        tokens[-1] = tokens[-1].rstrip(" ")
+        if max_tokens:
+            tokens = tokens[:max_tokens]
+        return tokens
+
+    def token_delay(self):
+        return 1.0 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+    def start(self):
+        """Serve in a daemon thread and return self."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_body(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload):
+        self._send_body(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": "mock:latest"}]})
+        elif self.path.endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "/model", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request_body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+
+        if self.path.endswith("/chat/completions"):
+            kind = "chat"
+        elif self.path == "/api/generate":
+            kind = "generate"
+        else:
+            self.server.count("not_found")
+            self._send_json(404, {"error": "not found"})
+            return
+
+        outcome, think = self.server.decide()
+        self.server.count(f"{kind}:{outcome}")
+
+        time.sleep(self.server.latency_model.sample())
+
+        if outcome == "hang":
+            time.sleep(self.server.hang_seconds)
+            self.close_connection = True
+            return
+        if outcome == "error":
+            self._send_json(500, {"error": "injected server error"})
+            return
+        if outcome == "malformed":
+            self._send_body(200, b'{"unexpected": true')
+            return
+
+        if kind == "chat":
+            self._chat_completions(request_body, think)
+        else:
+            self._ollama_generate(request_body, think)
+
+    def _chat_completions(self, body, think):
+        messages = body.get("messages") or [{}]
+        prompt = str(messages[-1].get("content", ""))
+        tokens = self.server.build_answer(prompt, think, body.get("max_tokens"))
+        model = body.get("model", "/model")
+        created = int(time.time())
+        delay = self.server.token_delay()
+
+        if not body.get("stream", False):
+            time.sleep(delay * len(tokens))
+            self._send_json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(tokens),
+                          "total_tokens": len(prompt) // 4 + len(tokens)},
+            })
+            return
+
+        # Server-sent events, one chunk per token
+        self._start_chunked("text/event-stream")
+        for i, token in enumerate(tokens):
+            delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+            chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created,
+                     "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            time.sleep(delay)
+        final = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created,
+                 "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        self._write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._end_chunked()
+
+    def _ollama_generate(self, body, think):
+        prompt = str(body.get("prompt", ""))
+        options = body.get("options") or {}
+        tokens = self.server.build_answer(prompt, think, options.get("num_predict"))
+        model = body.get("model", "mock")
+        delay = self.server.token_delay()
+        start = time.perf_counter()
+
+        def created_at():
+            return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+        def final_fields():
+            return {"done": True, "done_reason": "stop", "eval_count": len(tokens),
+                    "total_duration": int((time.perf_counter() - start) * 1e9)}
+
+        # Ollama streams by default unless "stream": false
+        if not body.get("stream", True):
+            time.sleep(delay * len(tokens))
+            self._send_json(200, {"model": model, "created_at": created_at(),
+                                  "response": "".join(tokens), **final_fields()})
+            return
+
+        self._start_chunked("application/x-ndjson")
+        for token in tokens:
+            line = {"model": model, "created_at": created_at(), "response": token, "done": False}
+            self._write_chunk((json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8"))
+            time.sleep(delay)
+        line = {"model": model, "created_at": created_at(), "response": "", **final_fields()}
+        self._write_chunk((json.dumps(line) + "\n").encode("utf-8"))
+        self._end_chunked()
+
+
+def add_arguments(parser, prefix=""):
+    """Register the mock's behaviour flags (shared with load_test.py via prefix='llm-')."""
+    parser.add_argument(f"--{prefix}latency", type=float, default=0.0, help="Mean time to first token (seconds)")
+    parser.add_argument(f"--{prefix}dist", choices=LATENCY_DISTRIBUTIONS, default="fixed",
+                        help="Latency distribution")
+    parser.add_argument(f"--{prefix}jitter", type=float, default=0.0,
+                        help="Spread: +/- range (uniform), stddev (normal) or sigma (lognormal)")
+    parser.add_argument(f"--{prefix}tokens-per-sec", type=float, default=0.0, help="Token rate (0 = instant)")
+    parser.add_argument(f"--{prefix}think-ratio", type=float, default=0.0,
+                        help="Fraction of answers that start with a <think> block")
+    parser.add_argument(f"--{prefix}error-rate", type=float, default=0.0, help="Fraction answered with HTTP 500")
+    parser.add_argument(f"--{prefix}hang-rate", type=float, default=0.0,
+                        help="Fraction that hang (to exercise client timeouts)")
+    parser.add_argument(f"--{prefix}hang-seconds", type=float, default=60.0, help="How long hung requests wait")
+    parser.add_argument(f"--{prefix}malformed-rate", type=float, default=0.0,
+                        help="Fraction answered with a malformed 200 body")
+
+
+def server_kwargs(args, prefix=""):
+    """Collect constructor kwargs from parsed arguments registered by add_arguments()."""
+    prefix = prefix.replace("-", "_")
+    names = ["latency", "dist", "jitter", "tokens_per_sec", "think_ratio", "error_rate",
+             "hang_rate", "hang_seconds", "malformed_rate"]
+    return {name: getattr(args, prefix + name) for name in names}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Thai LLM / Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--seed", type=int, default=42, help="Seed for latency and error sampling")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.host, args.port, seed=args.seed, **server_kwargs(args))
+    print(f"Mock LLM server listening on {server.url}")
+    print(f"  OpenAI-style: POST {server.url}/v1/chat/completions")
+    print(f"  Ollama:       POST {server.url}/api/generate")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Requests served: {server.counts}")
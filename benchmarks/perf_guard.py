@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Performance regression guard
+Re-runs the inference, preprocessing and logging microbenchmarks and compares them with
+a JSON baseline stored in the repo, flagging statistically significant slowdowns
+(one-sided Mann-Whitney U test plus a minimum effect size). No external service needed.
+
+The benchmarked functions are read straight from the entry points' source
+(predict_pil and log_conversation from main_enhanced.py, predict_pil / preprocess_image
+from pythonanywhere/main_pythonanywhere.py), so the guard tracks the code that ships.
+
+Usage:
+    python benchmarks/perf_guard.py record                  # write/refresh the baseline
+    python benchmarks/perf_guard.py compare                 # exit code 1 on regression
+    python benchmarks/perf_guard.py compare --only log_conversation preprocess_image
+    python benchmarks/perf_guard.py compare --baseline benchmarks/baselines/my-laptop.json
+"""
+
+import argparse
+import ast
+import builtins
+import csv
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import numpy as np
+from PIL import Image
+
+import dog_model
+import metrics
+from model_registry import ModelRegistry
+from stats import mann_whitney_u, median
+
+DEFAULT_BASELINE = os.path.join(PROJECT_ROOT, "benchmarks", "baselines", "default.json")
+ENHANCED_SOURCE = os.path.join(PROJECT_ROOT, "main_enhanced.py")
+PYTHONANYWHERE_SOURCE = os.path.join(PROJECT_ROOT, "pythonanywhere", "main_pythonanywhere.py")
+
+
+def optional_globals(tree):
+    """
+    Module-level names that are None while their feature is off: `x = None`,
+    `x = ... if ... else None` and `x = create_*_from_env(...)` (those factories return
+    None when disabled, e.g. inference_pool, cascade, tta).
+    """
+    names = set()
+    for node in tree.body:
+        if not (isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)):
+            continue
+        value = node.value.orelse if isinstance(node.value, ast.IfExp) else node.value
+        if ((isinstance(value, ast.Constant) and value.value is None)
+                or (isinstance(value, ast.Call) and isinstance(value.func, ast.Name)
+                    and value.func.id.startswith("create_") and value.func.id.endswith("_from_env"))):
+            names.add(node.targets[0].id)
+    return names
+
+
+def free_names(node):
+    """Global names a function reads (names it never binds itself)."""
+    bound = {arg.arg for arg in ast.walk(node.args) if isinstance(arg, ast.arg)}
+    loads = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name):
+            (loads if isinstance(child.ctx, ast.Load) else bound).add(child.id)
+        elif isinstance(child, (ast.FunctionDef, ast.ExceptHandler)) and child is not node and child.name:
+            bound.add(child.name)
+        elif isinstance(child, ast.alias):
+            bound.add((child.asname or child.name).split(".")[0])
+    return loads - bound
+
+
+def load_functions(path, names, namespace):
+    """
+    Compile selected top-level functions from a source file into `namespace` without importing it.
+    Optional-feature globals the functions read (see optional_globals) default to None, i.e.
+    the feature off; any other global missing from `namespace` is an error here rather than
+    a NameError halfway through a benchmark.
+    """
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    nodes = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name in names]
+    missing = set(names) - {node.name for node in nodes}
+    if missing:
+        raise LookupError(f"{', '.join(sorted(missing))} not found in {path}")
+
+    needed = set().union(*(free_names(node) for node in nodes)) - set(names) - set(dir(builtins))
+    optional = optional_globals(tree)
+    for name in needed - set(namespace):
+        if name not in optional:
+            raise LookupError(f"{path}: {', '.join(sorted(needed - set(namespace) - optional))} "
+                              f"must be provided to benchmark {', '.join(names)}")
+        namespace[name] = None
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), path, "exec"), namespace)
+    return [namespace[name] for name in names]
+
+
+def test_image(width=640, height=480):
+    """Deterministic photo-sized RGB image."""
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), "RGB")
+
+
+# ============================================================
+# Microbenchmarks: each builder returns a zero-argument callable
+# ============================================================
+def bench_preprocess_image():
+    namespace = {"np": np, "Image": Image,
+                 "IMAGENET_MEAN": dog_model.IMAGENET_MEAN, "IMAGENET_STD": dog_model.IMAGENET_STD}
+    preprocess_image, = load_functions(PYTHONANYWHERE_SOURCE, ["preprocess_image"], namespace)
+    image = test_image()
+    return lambda: preprocess_image(image)
+
+
+def bench_predict_pil_torch():
+    torch = dog_model.configure_torch(num_threads=1)
+    import torch.nn.functional as F
+    import torchvision.transforms as transforms
+
+    namespace = {
+        "torch": torch, "F": F, "class_names": dog_model.class_names,
+        "model_registry": ModelRegistry(os.path.join(PROJECT_ROOT, dog_model.MODEL_PATH),
+                                        dog_model.build_torch_model),
+        "transform": transforms.Compose([
+            transforms.Resize((224, 224)),
+            transforms.ToTensor(),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+        ]),
+    }
+    predict_pil, = load_functions(ENHANCED_SOURCE, ["predict_pil"], namespace)
+    image = test_image()
+    return lambda: predict_pil(image)
+
+
+def bench_predict_pil_onnx():
+    namespace = {
+        "np": np, "Image": Image, "class_names": dog_model.class_names,
+        "IMAGENET_MEAN": dog_model.IMAGENET_MEAN, "IMAGENET_STD": dog_model.IMAGENET_STD,
+        "model_registry": ModelRegistry(os.path.join(PROJECT_ROOT, dog_model.ONNX_MODEL_PATH),
+                                        lambda path: dog_model.load_onnx_session(path, 1)),
+    }
+    _, _, predict_pil = load_functions(
+        PYTHONANYWHERE_SOURCE, ["preprocess_image", "softmax", "predict_pil"], namespace)
+    image = test_image()
+    return lambda: predict_pil(image)
+
+
+def bench_log_conversation(workdir):
+    namespace = {"datetime": datetime, "os": os, "csv": csv, "time": time, "metrics": metrics,
+                 "print": lambda *args, **kwargs: None}
+    log_conversation, = load_functions(ENHANCED_SOURCE, ["log_conversation"], namespace)
+    os.makedirs(os.path.join(workdir, "logs"), exist_ok=True)
+    answer = "สุนัขพันธุ์นี้เป็นมิตร ฉลาด และเลี้ยงง่ายครับ " * 20
+
+    def run():
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            log_conversation("Ubenchmark", "สุนัขพันธุ์ไหนเลี้ยงง่าย", answer, 1.234, "คิด...")
+        finally:
+            os.chdir(cwd)
+    return run
+
+
+BENCHMARKS = {
+    "preprocess_image": (bench_preprocess_image, 50),
+    "predict_pil_torch": (bench_predict_pil_torch, 5),
+    "predict_pil_onnx": (bench_predict_pil_onnx, 5),
+    "log_conversation": (bench_log_conversation, 200),
+}
+
+
+def measure(fn, inner, samples, warmup=3):
+    """Return `samples` timings, each the mean seconds per call over `inner` calls."""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        for _ in range(inner):
+            fn()
+        timings.append((time.perf_counter() - start) / inner)
+    return timings
+
+
+def run_benchmarks(names, samples):
+    workdir = tempfile.mkdtemp(prefix="whatdog-perf-")
+    results = {}
+    try:
+        for name in names:
+            builder, inner = BENCHMARKS[name]
+            try:
+                fn = builder(workdir) if name == "log_conversation" else builder()
+            except (ImportError, OSError, LookupError) as e:
+                print(f"   ⏭️  {name}: skipped ({type(e).__name__}: {e})")
+                continue
+            timings = measure(fn, inner, samples)
+            results[name] = {"samples": timings, "median_us": median(timings) * 1e6}
+            print(f"   ✓ {name:20s} median {median(timings) * 1e6:10.1f} µs")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def host_info():
+    return {"platform": platform.platform(), "processor": platform.processor(),
+            "cpu_count": os.cpu_count(), "python": platform.python_version()}
+
+
+def compare(baseline, current, alpha, threshold):
+    """Return (rows, regressed) comparing current samples with the baseline."""
+    rows, regressed = [], False
+    for name, result in current.items():
+        if name not in baseline:
+            rows.append((name, None, result["median_us"], None, None, "new"))
+            continue
+        before = baseline[name]["samples"]
+        after = result["samples"]
+        change = median(after) / median(before) - 1.0
+        _, p_slower = mann_whitney_u(before, after)
+        _, p_faster = mann_whitney_u(after, before)
+        if p_slower < alpha and change > threshold:
+            verdict = "REGRESSION"
+            regressed = True
+        elif p_faster < alpha and change < -threshold:
+            verdict = "faster"
+        else:
+            verdict = "ok"
+        rows.append((name, median(before) * 1e6, median(after) * 1e6, change, min(p_slower, p_faster), verdict))
+    return rows, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or check performance baselines")
+    parser.add_argument("command", choices=["record", "compare"])
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Run a subset of benchmarks")
+    parser.add_argument("--samples", type=int, default=30, help="Samples per benchmark")
+    parser.add_argument("--alpha", type=float, default=0.01, help="Significance level")
+    parser.add_argument("--threshold", type=float, default=0.05,
+                        help="Minimum median slowdown to flag (0.05 = 5%%)")
+    args = parser.parse_args()
+
+    names = args.only or list(BENCHMARKS)
+    print(f"⏱️  Running {len(names)} microbenchmarks ({args.samples} samples each)...")
+    current = run_benchmarks(names, args.samples)
+
+    if args.command == "record":
+        existing = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                existing = json.load(f).get("benchmarks", {})
+        existing.update(current)
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "recorded_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "commit": git_commit(),
+                "host": host_info(),
+                "benchmarks": existing,
+            }, f, indent=2)
+        print(f"\n💾 Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\n❌ No baseline at {args.baseline}. Run: python benchmarks/perf_guard.py record")
+        sys.exit(2)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline_file = json.load(f)
+    if baseline_file.get("host", {}).get("processor") != host_info()["processor"]:
+        print("⚠️  Baseline was recorded on a different CPU - comparisons may not be meaningful")
+
+    rows, regressed = compare(baseline_file["benchmarks"], current, args.alpha, args.threshold)
+    print(f"\nBaseline: commit {baseline_file.get('commit')} recorded {baseline_file.get('recorded_at')}")
+    print(f"{'benchmark':20s} {'baseline µs':>12s} {'current µs':>12s} {'change':>8s} {'p':>8s}  verdict")
+    print("-" * 78)
+    for name, before, after, change, p_value, verdict in rows:
+        before_text = f"{before:12.1f}" if before is not None else f"{'-':>12s}"
+        change_text = f"{change * 100:+7.1f}%" if change is not None else f"{'-':>8s}"
+        p_text = f"{p_value:8.4f}" if p_value is not None else f"{'-':>8s}"
+        marker = "❌ " if verdict == "REGRESSION" else ""
+        print(f"{name:20s} {before_text} {after:12.1f} {change_text} {p_text}  {marker}{verdict}")
+
+    if regressed:
+        print("\n❌ Statistically significant performance regression detected")
+        sys.exit(1)
+    print("\n✅ No significant regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Small statistics helpers shared by the benchmark scripts
+"""
+
+
+def percentile(values, p):
+    """Linear-interpolated percentile (p in 0..100) of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def latency_summary(latencies):
+    """Mean and percentiles (in milliseconds) for a list of latencies in seconds."""
+    return {
+        "count": len(latencies),
+        "mean_ms": (sum(latencies) / len(latencies) * 1000) if latencies else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def median(values):
+    return percentile(values, 50)
+
+
+def mann_whitney_u(baseline, current):
+    """
+    One-sided Mann-Whitney U test that `current` tends to be larger than `baseline`.
+    Uses the normal approximation with tie correction (fine for >= ~8 samples each).
+
+    Returns:
+        tuple: (u_statistic, p_value)
+    """
+    import math
+
+    n1, n2 = len(baseline), len(current)
+    if n1 == 0 or n2 == 0:
+        return 0.0, 1.0
+
+    combined = sorted([(value, 0) for value in baseline] + [(value, 1) for value in current])
+    ranks = [0.0] * len(combined)
+    tie_term = 0.0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        average_rank = (i + j) / 2.0 + 1
+        for k in range(i, j + 1):
+            ranks[k] = average_rank
+        ties = j - i + 1
+        tie_term += ties ** 3 - ties
+        i = j + 1
+
+    rank_sum_current = sum(rank for rank, (_, group) in zip(ranks, combined) if group == 1)
+    u_current = rank_sum_current - n2 * (n2 + 1) / 2.0
+
+    mean_u = n1 * n2 / 2.0
+    n = n1 + n2
+    variance = n1 * n2 / 12.0 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return u_current, 1.0
+    z = (u_current - mean_u - 0.5) / math.sqrt(variance)
+    p_value = 0.5 * math.erfc(z / math.sqrt(2))
+    return u_current, p_value
@@ -0,0 +1,137 @@
+"""
+Confidence-aware model cascade
+Every photo used to go through the full ResNet18, even when the answer was obvious.
+With CASCADE=1 a cheaper model runs first (by default a static int8 (QDQ) quantization of
+the ONNX export of the same checkpoint the full model serves); the full model only runs
+when the fast answer is unsure:
+
+    top-1 confidence < CASCADE_MIN_CONFIDENCE  or  top-1 - top-2 < CASCADE_MIN_MARGIN
+
+A clear photo of a golden retriever is answered by the fast model alone; mixed breeds,
+odd angles and non-dogs are escalated. Whether the int8 model is actually faster depends
+on the CPU: measure it with benchmarks/bench_cascade.py, which reports the latency of both
+models and the accuracy cost for a range of thresholds on a held-out set from images/.
+
+The fast model is (re)built at startup when it is missing or older than the checkpoint:
+a .pth checkpoint is exported to ONNX first, and activation ranges are calibrated on up
+to CASCADE_CALIBRATION_IMAGES photos the bot has stored. Without stored photos the
+cascade stays off. It is not rebuilt on a hot model reload (see model_registry.py).
+
+Configuration (environment variables):
+    CASCADE=0                          # set to 1 to enable
+    CASCADE_FAST_MODEL=dog_breed_model.int8.onnx   # built from the full model's checkpoint
+    CASCADE_CALIBRATION_DIR=images     # photos for int8 calibration (defaults to IMAGE_STORE_DIR)
+    CASCADE_CALIBRATION_IMAGES=64
+    CASCADE_MIN_CONFIDENCE=0.8
+    CASCADE_MIN_MARGIN=0.0
+    CASCADE_THREADS=1                  # intra-op threads of the fast model
+"""
+
+import os
+import time
+
+import dog_model
+import metrics
+
+FAST_MODEL_PATH = "dog_breed_model.int8.onnx"
+
+
+class CascadeClassifier:
+    """Runs fast_forward first and full_forward only for unsure predictions."""
+
+    def __init__(self, fast_forward, full_forward, min_confidence=0.8, min_margin=0.0):
+        self.fast_forward = fast_forward
+        self.full_forward = full_forward
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+
+    def confident(self, probs):
+        """True if one probability vector is sure enough to skip the full model."""
+        top2 = probs[probs.argsort()[-2:][::-1]]
+        return top2[0] >= self.min_confidence and top2[0] - top2[1] >= self.min_margin
+
+    def predict_probs(self, batch):
+        """
+        (N, num_classes) probabilities for a preprocessed batch; only unsure rows reach
+        the full model.
+        """
+        start = time.perf_counter()
+        probs = dog_model.softmax(self.fast_forward(batch))
+        metrics.CASCADE_LATENCY.observe(time.perf_counter() - start, stage="fast")
+
+        unsure = [row for row in range(len(probs)) if not self.confident(probs[row])]
+        metrics.CASCADE.inc(len(probs) - len(unsure), stage="fast")
+        if unsure:
+            start = time.perf_counter()
+            probs[unsure] = dog_model.softmax(self.full_forward(batch[unsure]))
+            metrics.CASCADE_LATENCY.observe(time.perf_counter() - start, stage="full")
+            metrics.CASCADE.inc(len(unsure), stage="full")
+        return probs
+
+    def predict_pil(self, image, k=3):
+        """Same contract as predict_pil in the entry points: [(breed_name, confidence), ...]."""
+        probs = self.predict_probs(dog_model.preprocess_image(image))
+        return dog_model.top_k(probs[0], k)
+
+
+def build_fast_model(path, source_path, calibration_dir="images", calibration_images=64):
+    """
+    Static int8 quantization of source_path (the full model's .pth or fp32 .onnx) into path.
+    """
+    batches = dog_model.calibration_batches(calibration_dir, count=calibration_images)
+    if not batches:
+        raise ValueError(f"no calibration photos under {calibration_dir}/")
+    if source_path.endswith(".onnx"):
+        print(f"Quantizing {source_path} -> {path} for the cascade...")
+        return dog_model.quantize_onnx_model(source_path, path, batches)
+
+    exported = f"{os.path.splitext(path)[0]}.fp32.onnx"
+    print(f"Exporting {source_path} -> {exported} -> {path} for the cascade...")
+    try:
+        dog_model.export_onnx_model(source_path, exported)
+        return dog_model.quantize_onnx_model(exported, path, batches)
+    finally:
+        if os.path.exists(exported):
+            os.remove(exported)
+
+
+def load_fast_forward(path=FAST_MODEL_PATH, source_path=None, num_threads=1,
+                      calibration_dir="images", calibration_images=64):
+    """
+    forward() of the int8 ONNX model, built from source_path first if it is missing or
+    older than source_path.
+    """
+    source_path = source_path or dog_model.MODEL_PATH
+    if not os.path.exists(path) or (os.path.exists(source_path)
+                                    and os.path.getmtime(source_path) > os.path.getmtime(path)):
+        build_fast_model(path, source_path, calibration_dir, calibration_images)
+    return dog_model.load_forward("onnx", path, num_threads=num_threads)
+
+
+def create_cascade_from_env(full_forward, source_path):
+    """
+    CascadeClassifier in front of full_forward when CASCADE=1, otherwise None.
+    source_path is the checkpoint full_forward serves, so both stages come from the same weights.
+    A missing fast model (e.g. no onnxruntime) disables the cascade instead of failing startup.
+    """
+    if os.getenv("CASCADE", "0") != "1":
+        return None
+    try:
+        fast_forward = load_fast_forward(
+            os.getenv("CASCADE_FAST_MODEL", FAST_MODEL_PATH),
+            source_path=source_path,
+            num_threads=int(os.getenv("CASCADE_THREADS", "1")),
+            calibration_dir=os.getenv("CASCADE_CALIBRATION_DIR", os.getenv("IMAGE_STORE_DIR", "images")),
+            calibration_images=int(os.getenv("CASCADE_CALIBRATION_IMAGES", "64")))
+    except Exception as e:
+        print(f"⚠️  Cascade disabled, fast model unavailable: {e}")
+        return None
+    cascade = CascadeClassifier(
+        fast_forward,
+        full_forward,
+        min_confidence=float(os.getenv("CASCADE_MIN_CONFIDENCE", "0.8")),
+        min_margin=float(os.getenv("CASCADE_MIN_MARGIN", "0.0")),
+    )
+    print(f"Cascade: fast model first, full model below {cascade.min_confidence:.0%} confidence"
+          + (f" or {cascade.min_margin:.0%} margin" if cascade.min_margin else ""))
+    return cascade
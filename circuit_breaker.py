@@ -0,0 +1,201 @@
+"""
+Circuit breaker and adaptive timeouts for upstream LLM calls
+When thaillm.or.th is down, every text message and every image used to wait the full
+30 s timeout before falling back, holding a Waitress thread the whole time.
+
+CircuitBreaker (one per backend):
+    closed     calls go through; LLM_BREAKER_FAILURES consecutive failures or
+               timeouts open the circuit
+    open       calls are rejected immediately, so the caller serves its fallback reply;
+               after the cooldown the circuit goes half-open. The cooldown doubles
+               each time a trial fails, up to LLM_BREAKER_MAX_COOLDOWN
+    half_open  up to LLM_BREAKER_PROBES trial requests at a time; LLM_BREAKER_SUCCESSES
+               successful trials close the circuit, any failed trial reopens it
+
+AdaptiveTimeout: the timeout follows observed latency,
+    percentile(LLM_TIMEOUT_PERCENTILE) x LLM_TIMEOUT_MULTIPLIER, clamped to
+    [LLM_TIMEOUT_MIN, LLM_TIMEOUT]
+so a backend that normally answers in 3 s times out after ~10 s rather than 30 s.
+Until LLM_TIMEOUT_MIN_SAMPLES calls have been observed, LLM_TIMEOUT is used. Timed-out
+calls are observed at their timeout, so the timeout can grow back when the backend
+slows down. Half-open trials always get the full LLM_TIMEOUT.
+
+Configuration (environment variables):
+    LLM_TIMEOUT=30                 # maximum (and initial) timeout in seconds
+    LLM_ADAPTIVE_TIMEOUT=1         # set to 0 to always use LLM_TIMEOUT
+    LLM_TIMEOUT_MIN=5
+    LLM_TIMEOUT_PERCENTILE=99
+    LLM_TIMEOUT_MULTIPLIER=2
+    LLM_TIMEOUT_MIN_SAMPLES=20
+    LLM_BREAKER_FAILURES=5
+    LLM_BREAKER_COOLDOWN=30        # seconds before the first trial request
+    LLM_BREAKER_MAX_COOLDOWN=300
+    LLM_BREAKER_PROBES=1           # concurrent trial requests while half-open
+    LLM_BREAKER_SUCCESSES=2        # successful trials needed to close
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class LatencyStats:
+    """Latency of recent successful calls and outcome of recent calls."""
+
+    def __init__(self, window=200):
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        with self._lock:
+            if ok:
+                self._latencies.append(latency)
+            self._outcomes.append(ok)
+
+    def percentile(self, q, min_samples=1):
+        """q-th percentile (0-100) of recent successful latencies, or None with too few samples."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < max(1, min_samples):
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q / 100.0))]
+
+    def error_rate(self):
+        with self._lock:
+            outcomes = list(self._outcomes)
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+
+class CircuitBreaker:
+    """Closed / open / half-open circuit breaker for one backend."""
+
+    def __init__(self, name, failure_threshold=5, cooldown=30.0, max_cooldown=300.0,
+                 half_open_max_calls=1, success_threshold=2):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max(cooldown, max_cooldown)
+        self.half_open_max_calls = half_open_max_calls
+        self.success_threshold = success_threshold
+        self.state = "closed"
+        self.failures = 0
+        self.cooldown = cooldown
+        self.opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        metrics.LLM_CIRCUIT_STATE.set_function(lambda: CIRCUIT_STATES[self.state], backend=name)
+
+    def _transition(self, state):
+        print(f"{'⚠️  ' if state == 'open' else ''}LLM circuit {self.name}: {self.state} -> {state}"
+              + (f" for {self.cooldown:.0f}s" if state == "open" else ""))
+        self.state = state
+        metrics.LLM_CIRCUIT_TRANSITIONS.inc(backend=self.name, state=state)
+
+    def _open(self, now):
+        self.opened_at = now
+        self._probes = 0
+        self._probe_successes = 0
+        self._transition("open")
+
+    def allow(self):
+        """Return True if a call may go upstream now (counts as a trial while half-open)."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self._transition("half_open")
+            if self._probes >= self.half_open_max_calls:
+                return False
+            self._probes += 1
+            return True
+
+    def release(self):
+        """Give back a half-open trial slot for a call that ended without a result (cancelled)."""
+        with self._lock:
+            if self.state == "half_open":
+                self._probes = max(0, self._probes - 1)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != "half_open":
+                return
+            self._probes = max(0, self._probes - 1)
+            self._probe_successes += 1
+            if self._probe_successes >= self.success_threshold:
+                self.cooldown = self.base_cooldown
+                self._transition("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            now = time.monotonic()
+            if self.state == "half_open":
+                # Failed trial: back off longer before the next one
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                self._open(now)
+            elif self.state == "closed" and self.failures >= self.failure_threshold:
+                self._open(now)
+
+
+class AdaptiveTimeout:
+    """Timeout = percentile of recent latencies x multiplier, clamped to [min_timeout, max_timeout]."""
+
+    def __init__(self, max_timeout=30.0, min_timeout=5.0, percentile=99.0, multiplier=2.0,
+                 min_samples=20, window=200, enabled=True):
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.enabled = enabled
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, latency):
+        """Record a completed call, or a timed-out call at the timeout it was given."""
+        with self._lock:
+            self._latencies.append(latency)
+
+    def current(self):
+        if not self.enabled:
+            return self.max_timeout
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < self.min_samples:
+            return self.max_timeout
+        observed = latencies[min(len(latencies) - 1, int(len(latencies) * self.percentile / 100.0))]
+        return max(self.min_timeout, min(self.max_timeout, observed * self.multiplier))
+
+
+def create_circuit_breaker_from_env(name):
+    """Build a CircuitBreaker from the LLM_BREAKER_* settings."""
+    return CircuitBreaker(
+        name,
+        failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+        cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", "30")),
+        max_cooldown=float(os.getenv("LLM_BREAKER_MAX_COOLDOWN", "300")),
+        half_open_max_calls=int(os.getenv("LLM_BREAKER_PROBES", "1")),
+        success_threshold=int(os.getenv("LLM_BREAKER_SUCCESSES", "2")),
+    )
+
+
+def create_adaptive_timeout_from_env():
+    """Build an AdaptiveTimeout from LLM_TIMEOUT and the LLM_TIMEOUT_* settings."""
+    return AdaptiveTimeout(
+        max_timeout=float(os.getenv("LLM_TIMEOUT", "30")),
+        min_timeout=float(os.getenv("LLM_TIMEOUT_MIN", "5")),
+        percentile=float(os.getenv("LLM_TIMEOUT_PERCENTILE", "99")),
+        multiplier=float(os.getenv("LLM_TIMEOUT_MULTIPLIER", "2")),
+        min_samples=int(os.getenv("LLM_TIMEOUT_MIN_SAMPLES", "20")),
+        enabled=os.getenv("LLM_ADAPTIVE_TIMEOUT", "1") == "1",
+    )
@@ -0,0 +1,3 @@
+# test_model_fixed.py and test_thaillm.py are diagnostic scripts (they load the real
+# model / call the Thai LLM API at import time), not unit tests
+collect_ignore = ["test_model_fixed.py", "test_thaillm.py"]
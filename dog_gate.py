@@ -0,0 +1,127 @@
+"""
+"Is this a dog?" gate in front of the breed LLM call
+predict_pil always returns three of the 120 breeds, also for photos of cats, food or
+screenshots, and the image handlers then spent an LLM call describing a dog that is
+not there. The gate scores each prediction as out-of-distribution before the LLM step;
+for photos below the threshold the handler still replies with the prediction (and similar
+dogs), prefixed with NOT_A_DOG_CAVEAT, and skips only the LLM call.
+
+The score comes from the softmax the model already computed, so the gate costs nothing
+and works the same for PyTorch, ONNX Runtime and the inference pool:
+
+    top3   sum of the top-3 probabilities (recommended). A dog of an unclear or mixed
+           breed still puts most of its mass on 2-3 related breeds; a non-dog photo
+           spreads it thinly over many
+    msp    top-1 probability (maximum softmax probability, the classic OOD baseline)
+
+Thresholds depend on the model, so the gate is off by default: calibrate it on your own
+photos first. Run batch_classify.py over a folder of dogs and a folder of non-dogs, then
+
+    python dog_gate.py calibrate --dogs dogs.csv --other other.csv --recall 0.99
+
+prints the threshold that keeps 99% of dogs and how much junk it stops; set it with
+DOG_GATE=top3 DOG_GATE_THRESHOLD=<threshold>.
+
+Configuration (environment variables):
+    DOG_GATE=off             # top3, msp or off
+    DOG_GATE_THRESHOLD=0.4   # predictions scoring below this are treated as "not a dog"
+"""
+
+import argparse
+import csv
+import os
+
+import metrics
+
+GATE_METHODS = ("top3", "msp", "off")
+
+
+class DogGate:
+    """Decides from the top-k predictions whether a photo shows a dog at all."""
+
+    def __init__(self, method="top3", threshold=0.4):
+        if method not in GATE_METHODS:
+            raise ValueError(f"DOG_GATE must be one of {', '.join(GATE_METHODS)}, got '{method}'")
+        self.method = method
+        self.threshold = threshold
+
+    def score(self, predictions):
+        """OOD score of one predict_pil result [(breed_name, confidence), ...]; higher = more dog-like."""
+        confidences = [confidence for _, confidence in predictions]
+        if self.method == "msp":
+            return confidences[0] if confidences else 0.0
+        return sum(confidences[:3])
+
+    def is_dog(self, predictions):
+        if self.method == "off":
+            return True
+        score = self.score(predictions)
+        is_dog = score >= self.threshold
+        metrics.DOG_GATE.inc(result="dog" if is_dog else "not_dog")
+        if not is_dog:
+            print(f"Dog gate: {self.method} score {score:.2f} < {self.threshold:.2f}, not a dog")
+        return is_dog
+
+
+def create_dog_gate_from_env():
+    gate = DogGate(os.getenv("DOG_GATE", "off"), float(os.getenv("DOG_GATE_THRESHOLD", "0.4")))
+    if gate.method != "off":
+        print(f"Dog gate: {gate.method} >= {gate.threshold:.2f}")
+    return gate
+
+
+def read_predictions(path):
+    """Top-k predictions per row of a batch_classify.py CSV (unreadable files skipped)."""
+    rows = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row.get("error"):
+                continue
+            predictions, rank = [], 1
+            while row.get(f"breed_{rank}"):
+                predictions.append((row[f"breed_{rank}"], float(row[f"confidence_{rank}"])))
+                rank += 1
+            rows.append(predictions)
+    return rows
+
+
+def calibrate(dog_rows, other_rows, method="top3", recall=0.99):
+    """
+    Highest threshold that still lets `recall` of the dog photos through.
+
+    Returns:
+        dict: threshold, dog recall and share of non-dog photos rejected
+    """
+    gate = DogGate(method)
+    dog_scores = sorted(gate.score(predictions) for predictions in dog_rows)
+    other_scores = [gate.score(predictions) for predictions in other_rows]
+    if not dog_scores:
+        raise ValueError("no dog predictions to calibrate on")
+    threshold = dog_scores[min(len(dog_scores) - 1, int(len(dog_scores) * (1 - recall)))]
+    kept = sum(score >= threshold for score in dog_scores)
+    rejected = sum(score < threshold for score in other_scores)
+    return {
+        "method": method,
+        "threshold": round(threshold, 4),
+        "dog_recall": round(kept / len(dog_scores), 4),
+        "other_rejected": round(rejected / len(other_scores), 4) if other_scores else None,
+        "dogs": len(dog_scores),
+        "other": len(other_scores),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the dog gate threshold")
+    parser.add_argument("command", choices=["calibrate"])
+    parser.add_argument("--dogs", required=True, help="batch_classify.py CSV of dog photos")
+    parser.add_argument("--other", required=True, help="batch_classify.py CSV of non-dog photos")
+    parser.add_argument("--recall", type=float, default=0.99, help="share of dog photos that must pass")
+    args = parser.parse_args()
+
+    dog_rows, other_rows = read_predictions(args.dogs), read_predictions(args.other)
+    for method in ("top3", "msp"):
+        print(calibrate(dog_rows, other_rows, method, args.recall))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Shared dog breed model helpers
+Class names, model loading (PyTorch and ONNX Runtime), preprocessing and top-k
+decoding used by the benchmark and batch tools.
+
+torch and onnxruntime are imported lazily so this module also works on hosts that
+only have one of them installed (e.g. PythonAnywhere with ONNX Runtime only).
+"""
+
+import glob
+import os
+
+import numpy as np
+from PIL import Image
+
+MODEL_PATH = "resnet18_best.pth"
+ONNX_MODEL_PATH = "dog_breed_model.onnx"
+INPUT_SIZE = 224
+
+# ImageNet normalization values (same as the PyTorch transforms)
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# Define class names for the prediction
+class_names = ['Afghan_hound', 'African_hunting_dog', 'Airedale', 'American_Staffordshire_terrier', 
+               'Appenzeller', 'Australian_terrier', 'Bedlington_terrier', 'Bernese_mountain_dog', 
+               'Blenheim_spaniel', 'Border_collie', 'Border_terrier', 'Boston_bull', 'Bouvier_des_Flandres', 
+               'Brabancon_griffon', 'Brittany_spaniel', 'Cardigan', 'Chesapeake_Bay_retriever', 'Chihuahua', 
+               'Dandie_Dinmont', 'Doberman', 'English_foxhound', 'English_setter', 'English_springer', 
+               'EntleBucher', 'Eskimo_dog', 'French_bulldog', 'German_shepherd', 'German_short-haired_pointer', 
+               'Gordon_setter', 'Great_Dane', 'Great_Pyrenees', 'Greater_Swiss_Mountain_dog', 'Ibizan_hound', 
+               'Irish_setter', 'Irish_terrier', 'Irish_water_spaniel', 'Irish_wolfhound', 'Italian_greyhound', 
+               'Japanese_spaniel', 'Kerry_blue_terrier', 'Labrador_retriever', 'Lakeland_terrier', 'Leonberg', 
+               'Lhasa', 'Maltese_dog', 'Mexican_hairless', 'Newfoundland', 'Norfolk_terrier', 'Norwegian_elkhound', 
+               'Norwich_terrier', 'Old_English_sheepdog', 'Pekinese', 'Pembroke', 'Pomeranian', 'Rhodesian_ridgeback', 
+               'Rottweiler', 'Saint_Bernard', 'Saluki', 'Samoyed', 'Scotch_terrier', 'Scottish_deerhound', 
+               'Sealyham_terrier', 'Shetland_sheepdog', 'Shih-Tzu', 'Siberian_husky', 'Staffordshire_bullterrier', 
+               'Sussex_spaniel', 'Tibetan_mastiff', 'Tibetan_terrier', 'Walker_hound', 'Weimaraner', 
+               'Welsh_springer_spaniel', 'West_Highland_white_terrier', 'Yorkshire_terrier', 'affenpinscher', 
+               'basenji', 'basset', 'beagle', 'black-and-tan_coonhound', 'bloodhound', 'bluetick', 'borzoi', 
+               'boxer', 'briard', 'bull_mastiff', 'cairn', 'chow', 'clumber', 'cocker_spaniel', 'collie', 
+               'curly-coated_retriever', 'dhole', 'dingo', 'flat-coated_retriever', 'giant_schnauzer', 
+               'golden_retriever', 'groenendael', 'keeshond', 'kelpie', 'komondor', 'kuvasz', 'malamute', 
+               'malinois', 'miniature_pinscher', 'miniature_poodle', 'miniature_schnauzer', 'otterhound', 
+               'papillon', 'pug', 'redbone', 'schipperke', 'silky_terrier', 'soft-coated_wheaten_terrier', 
+               'standard_poodle', 'standard_schnauzer', 'toy_poodle', 'toy_terrier', 'vizsla', 'whippet', 
+               'wire-haired_fox_terrier']
+
+
+def configure_torch(num_threads=1, mkldnn=False):
+    """
+    Apply the thread and MKL-DNN settings the bot runs with.
+    Must be called before torch is imported for the environment variables to apply.
+    """
+    os.environ['MKL_THREADING_LAYER'] = 'GNU'
+    os.environ['OMP_NUM_THREADS'] = str(num_threads)
+    os.environ['MKL_NUM_THREADS'] = str(num_threads)
+
+    import torch
+
+    torch.set_num_threads(num_threads)
+    # Disabled by default to avoid "could not create a primitive" error
+    torch.backends.mkldnn.enabled = mkldnn
+    return torch
+
+
+def build_torch_model(path=MODEL_PATH):
+    """Load the fine-tuned ResNet18 in eval mode."""
+    import torch
+    import torch.nn as nn
+    from torchvision import models
+
+    model_ft = models.resnet18(weights=None)
+    model_ft.fc = nn.Linear(model_ft.fc.in_features, len(class_names))
+
+    state_dict = torch.load(path, map_location='cpu', weights_only=False)
+    model_ft.load_state_dict(state_dict)
+    model_ft.eval()
+    return model_ft
+
+
+def quantize_torch_model(model_ft, calibration_batches):
+    """
+    Post-training static int8 quantization (FX graph mode, fbgemm backend).
+
+    Args:
+        model_ft: float ResNet18 in eval mode
+        calibration_batches: iterable of float32 numpy arrays shaped (N, 3, 224, 224)
+    """
+    import copy
+    import torch
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    torch.backends.quantized.engine = "fbgemm"
+    example_inputs = (torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE),)
+    prepared = prepare_fx(copy.deepcopy(model_ft), get_default_qconfig_mapping("fbgemm"), example_inputs)
+    with torch.no_grad():
+        for batch in calibration_batches:
+            prepared(torch.from_numpy(batch))
+    return convert_fx(prepared)
+
+
+def load_onnx_session(path=ONNX_MODEL_PATH, num_threads=None):
+    """Create an ONNX Runtime CPU session, optionally limiting intra-op threads."""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def load_forward(backend="torch", model_path=None, num_threads=1):
+    """
+    Load the model and return forward(batch) -> logits for float32 (N, 3, 224, 224) arrays.
+
+    Args:
+        backend: "torch" (MODEL_PATH) or "onnx" (ONNX_MODEL_PATH)
+    """
+    if backend == "torch":
+        torch = configure_torch(num_threads=num_threads)
+        model = build_torch_model(model_path or MODEL_PATH)
+
+        def forward(batch):
+            with torch.no_grad():
+                return model(torch.from_numpy(batch)).numpy()
+    else:
+        session = load_onnx_session(model_path or ONNX_MODEL_PATH, num_threads=num_threads)
+        input_name = session.get_inputs()[0].name
+
+        def forward(batch):
+            return session.run(None, {input_name: batch})[0]
+    return forward
+
+
+def export_onnx_model(model_path, target_path):
+    """Export the PyTorch checkpoint to ONNX (input 'input', dynamic batch size)."""
+    import torch
+
+    model_ft = build_torch_model(model_path)
+    torch.onnx.export(
+        model_ft,
+        torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE),
+        target_path,
+        opset_version=13,
+        do_constant_folding=True,
+        input_names=['input'],
+        output_names=['output'],
+        dynamic_axes={'input': {0: 'batch_size'}, 'output': {0: 'batch_size'}},
+    )
+    return target_path
+
+
+def calibration_batches(image_dir, count=64, batch_size=8):
+    """Preprocessed photos from image_dir (recursively) as (N, 3, 224, 224) batches; [] if there are none."""
+    paths = sorted(glob.glob(os.path.join(image_dir, "**", "*.jpg"), recursive=True))[:count]
+    arrays = []
+    for path in paths:
+        try:
+            with Image.open(path) as image:
+                arrays.append(preprocess_image(image))
+        except Exception:
+            continue
+    return [np.concatenate(arrays[i:i + batch_size]) for i in range(0, len(arrays), batch_size)]
+
+
+def quantize_onnx_model(source_path, target_path, calibration_batches):
+    """
+    Static int8 quantization of the ONNX model in QDQ format.
+
+    Activation ranges come from running calibration_batches (float32 (N, 3, 224, 224)
+    arrays, ideally real photos) through the fp32 model, so ONNX Runtime can fuse the
+    QuantizeLinear/DequantizeLinear pairs into int8 Conv and MatMul kernels. Dynamic
+    quantization would instead leave ConvInteger nodes that quantize activations on
+    every call, which is often no faster than fp32 on CPU.
+    """
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    batches = list(calibration_batches)
+    if not batches:
+        raise ValueError("static quantization needs at least one calibration batch")
+    session = load_onnx_session(source_path)
+    input_name = session.get_inputs()[0].name
+    del session
+
+    class BatchReader(CalibrationDataReader):
+        def __init__(self):
+            self._batches = iter(batches)
+
+        def get_next(self):
+            batch = next(self._batches, None)
+            return None if batch is None else {input_name: batch}
+
+    quantize_static(
+        source_path,
+        target_path,
+        BatchReader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+    return target_path
+
+
+def preprocess_image(image):
+    """
+    Preprocess PIL image (equivalent to the PyTorch transforms).
+
+    Returns:
+        numpy array of shape (1, 3, 224, 224)
+    """
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image = image.resize((INPUT_SIZE, INPUT_SIZE), Image.BILINEAR)
+    img_array = np.asarray(image, dtype=np.float32) / 255.0
+    img_array = (img_array - IMAGENET_MEAN) / IMAGENET_STD
+    return np.ascontiguousarray(img_array.transpose(2, 0, 1))[np.newaxis]
+
+
+def preprocess_batch(images):
+    """Preprocess a list of PIL images into one (N, 3, 224, 224) array."""
+    return np.concatenate([preprocess_image(image) for image in images], axis=0)
+
+
+def softmax(x):
+    """Row-wise softmax for a (N, C) numpy array."""
+    exp_x = np.exp(x - np.max(x, axis=1, keepdims=True))
+    return exp_x / exp_x.sum(axis=1, keepdims=True)
+
+
+def top_k(probs, k=3):
+    """Top-k (breed_name, confidence) pairs for one probability vector."""
+    top_idx = np.argsort(probs)[::-1][:k]
+    return [(class_names[idx], float(probs[idx])) for idx in top_idx]
@@ -0,0 +1,132 @@
+"""
+Per-user rate limiting and webhook redelivery deduplication
+Checked at the top of every message handler, before any download or inference work:
+
+- TTLSeenSet remembers webhook event IDs and message IDs for a few minutes, so a LINE
+  redelivery of an event that was already handled is dropped
+- TokenBucketLimiter gives every user_id a bucket per message type (image / text), so
+  one user flooding images cannot take the model away from everyone else
+
+Configuration (environment variables):
+    DEDUP_TTL_SECONDS=600          # how long event/message IDs are remembered
+    USER_IMAGE_RATE_PER_MIN=10     # sustained images per user per minute (0 = unlimited)
+    USER_IMAGE_BURST=5             # images a user may send back to back
+    USER_TEXT_RATE_PER_MIN=30      # sustained text messages per user per minute (0 = unlimited)
+    USER_TEXT_BURST=10
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+class TTLSeenSet:
+    """Set of keys that expire `ttl` seconds after they were added (bounded by max_size)."""
+
+    def __init__(self, ttl=600.0, max_size=100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expiry = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        # Same TTL for every key, so insertion order is expiry order
+        while self._expiry:
+            key, expires = next(iter(self._expiry.items()))
+            if expires > now and len(self._expiry) < self.max_size:
+                break
+            self._expiry.popitem(last=False)
+
+    def check_and_add(self, *keys):
+        """Return True if any key was seen within the TTL; otherwise remember all keys."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if any(key in self._expiry for key in keys):
+                return True
+            for key in keys:
+                self._expiry[key] = now + self.ttl
+            return False
+
+    def __len__(self):
+        return len(self._expiry)
+
+
+class TokenBucketLimiter:
+    """One token bucket per key: `rate` tokens per second, holding at most `burst` tokens."""
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+
+    def _prune(self, now):
+        """Drop buckets that have refilled completely (they behave like new ones)."""
+        full_after = self.burst / self.rate
+        self._buckets = {key: (tokens, updated) for key, (tokens, updated) in self._buckets.items()
+                         if now - updated < full_after}
+        self._last_prune = now
+
+    def allow(self, key, cost=1.0):
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if len(self._buckets) >= self.max_keys or now - self._last_prune > 60:
+                self._prune(now)
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            return allowed
+
+
+class EventGuard:
+    """Drops duplicate and over-limit LINE message events."""
+
+    def __init__(self, seen, limiters):
+        self.seen = seen
+        self.limiters = limiters
+
+    def admit(self, event, kind):
+        """Return True if the handler should process this event, False to drop it."""
+        keys = []
+        webhook_event_id = getattr(event, "webhook_event_id", None)
+        if webhook_event_id:
+            keys.append(f"event:{webhook_event_id}")
+        message = getattr(event, "message", None)
+        if message is not None and getattr(message, "id", None):
+            keys.append(f"message:{message.id}")
+
+        if keys and self.seen.check_and_add(*keys):
+            metrics.DROPPED_EVENTS.inc(reason="duplicate")
+            print(f"Dropped duplicate {kind} event {keys[-1]}")
+            return False
+
+        user_id = getattr(event.source, "user_id", None)
+        limiter = self.limiters.get(kind)
+        if user_id and limiter is not None and not limiter.allow(user_id):
+            metrics.DROPPED_EVENTS.inc(reason="rate_limited")
+            print(f"Dropped {kind} event from {user_id}: rate limited")
+            return False
+        return True
+
+
+def create_event_guard_from_env():
+    """Build the EventGuard from DEDUP_* / USER_* environment variables."""
+    def bucket(prefix, rate_per_min, burst):
+        rate = float(os.getenv(f"{prefix}_RATE_PER_MIN", rate_per_min)) / 60.0
+        return TokenBucketLimiter(rate, float(os.getenv(f"{prefix}_BURST", burst)))
+
+    return EventGuard(
+        TTLSeenSet(ttl=float(os.getenv("DEDUP_TTL_SECONDS", "600"))),
+        {"image": bucket("USER_IMAGE", "10", "5"), "text": bucket("USER_TEXT", "30", "10")},
+    )
@@ -0,0 +1,222 @@
+"""
+Semantic FAQ cache for free-text chat
+Serves a previous LLM answer when a new question is a near-duplicate of one already
+answered, e.g. "สุนัขพันธุ์ไหนเลี้ยงง่ายครับ" vs "สุนัขพันธุ์ไหน เลี้ยงง่าย??".
+
+- normalize_thai() folds case, strips spaces, punctuation, emoji, zero-width characters,
+  repeated characters and trailing polite particles (ครับ / ค่ะ / นะ ...)
+- questions are compared by cosine similarity of character n-grams (Thai has no word
+  spaces, so character trigrams work better than words); an inverted n-gram index keeps
+  lookups to the few entries that share n-grams with the question
+- a match must have the same negation words (ไม่ / ห้าม / อย่า) and numbers as the
+  question: "กินอะไรได้บ้าง" and "กินอะไรไม่ได้บ้าง" score 0.92 but ask the opposite
+- LRU eviction at FAQ_CACHE_SIZE entries, optional TTL
+- seeded at startup from question/answer pairs in logs/*.csv
+- hit / miss / eviction counts in /metrics
+
+Configuration (environment variables):
+    FAQ_CACHE=1                  # set to 0 to disable
+    FAQ_CACHE_THRESHOLD=0.95     # minimum similarity (0-1) to serve a cached answer
+    FAQ_CACHE_SIZE=2000          # maximum cached questions
+    FAQ_CACHE_TTL_HOURS=0        # drop answers older than this (0 = keep until evicted)
+    FAQ_CACHE_MINE_LOGS=1        # seed from logs/ at startup
+"""
+
+import csv
+import glob
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+import metrics
+
+ZERO_WIDTH = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+# Runs of the same letter ("ครับบบบ"); digits are kept as they are ("1000" is not "10")
+REPEATED_CHARS = re.compile(r"(\D)\1{2,}")
+# Trailing politeness particles do not change the question
+POLITE_SUFFIX = re.compile("(?:ครับผม|ครับ|คับ|ค่ะ|คะ|ค่า|จ้า|จ้ะ|จ๊ะ|ฮะ|นะ|น้า|หน่อย)+$")
+# Words that turn a question into its opposite ("อย่าง" = "how / kind of" is not "อย่า")
+NEGATION = re.compile("ไม่|ห้าม|อย่า(?!ง)")
+NUMBER = re.compile(r"\d+")
+
+
+def normalize_thai(text):
+    """Canonical form of a question for matching."""
+    text = unicodedata.normalize("NFC", text).casefold()
+    text = ZERO_WIDTH.sub("", text)
+    # Keep letters, digits and combining marks (Thai vowels and tone marks are category M)
+    text = "".join(ch for ch in text if unicodedata.category(ch)[0] in "LNM")
+    text = REPEATED_CHARS.sub(r"\1", text)
+    return POLITE_SUFFIX.sub("", text) or text
+
+
+def question_guard(text):
+    """
+    Negation words and numbers of a question. Two questions with different guards are
+    never near-duplicates, however similar the rest of the text is.
+    """
+    text = ZERO_WIDTH.sub("", unicodedata.normalize("NFC", text))
+    # int() also reads Thai digits, so "๓" and "3" agree
+    return tuple(sorted(NEGATION.findall(text))), tuple(int(number) for number in NUMBER.findall(text))
+
+
+def char_ngrams(text, n=3):
+    if len(text) <= n:
+        return Counter([text]) if text else Counter()
+    return Counter(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+class _Entry:
+    def __init__(self, question, answer, grams):
+        self.question = question
+        self.answer = answer
+        self.grams = grams
+        self.guard = question_guard(question)
+        self.norm = math.sqrt(sum(count * count for count in grams.values()))
+        self.created = time.time()
+
+
+class FAQCache:
+    """LRU cache of LLM answers keyed by normalized question, matched by n-gram cosine similarity."""
+
+    def __init__(self, threshold=0.95, max_entries=2000, ttl=0, ngram=3, exclude_answers=()):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.ngram = ngram
+        # Fallback / error replies that must never be served as cached answers
+        self.exclude_answers = set(exclude_answers)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._index = {}
+        self._lock = threading.Lock()
+        metrics.FAQ_ENTRIES.set_function(lambda: len(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _remove(self, key, reason):
+        entry = self._entries.pop(key)
+        for gram in entry.grams:
+            keys = self._index.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[gram]
+        metrics.FAQ_EVICTIONS.inc(reason=reason)
+
+    def _expired(self, entry):
+        return self.ttl > 0 and time.time() - entry.created > self.ttl
+
+    def _best_match(self, key, grams, guard):
+        if key in self._entries and self._entries[key].guard == guard:
+            return key, 1.0
+        norm = math.sqrt(sum(count * count for count in grams.values()))
+        if not norm:
+            return None, 0.0
+        dots = Counter()
+        for gram, count in grams.items():
+            for candidate in self._index.get(gram, ()):
+                dots[candidate] += count * self._entries[candidate].grams[gram]
+        best_key, best_score = None, 0.0
+        for candidate, dot in dots.items():
+            entry = self._entries[candidate]
+            if entry.guard != guard:
+                continue
+            score = dot / (norm * entry.norm)
+            if score > best_score:
+                best_key, best_score = candidate, score
+        return best_key, best_score
+
+    def lookup(self, question):
+        """Return the cached answer for a near-duplicate question, or None."""
+        if self.max_entries <= 0:
+            return None
+        key = normalize_thai(question)
+        grams = char_ngrams(key, self.ngram)
+        with self._lock:
+            match, score = self._best_match(key, grams, question_guard(question))
+            if match is not None and score >= self.threshold:
+                entry = self._entries[match]
+                if self._expired(entry):
+                    self._remove(match, "expired")
+                else:
+                    self._entries.move_to_end(match)
+                    self.hits += 1
+                    metrics.FAQ_LOOKUPS.inc(result="hit")
+                    print(f"FAQ cache hit ({score:.2f}): '{question[:30]}' ~ '{entry.question[:30]}'")
+                    return entry.answer
+            self.misses += 1
+        metrics.FAQ_LOOKUPS.inc(result="miss")
+        return None
+
+    def add(self, question, answer):
+        if self.max_entries <= 0 or not answer or answer in self.exclude_answers:
+            return
+        key = normalize_thai(question)
+        if not key:
+            return
+        entry = _Entry(question, answer, char_ngrams(key, self.ngram))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key, "replaced")
+            self._entries[key] = entry
+            for gram in entry.grams:
+                self._index.setdefault(gram, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)), "lru")
+
+    def load_logs(self, log_dir="logs", max_files=60):
+        """
+        Seed the cache from the most recent CSV conversation logs.
+        Most frequently asked questions are added last, so they are the last to be evicted.
+
+        Returns:
+            int: number of questions loaded
+        """
+        paths = sorted(glob.glob(os.path.join(log_dir, "*.csv")), key=os.path.getmtime)[-max_files:]
+        answers, counts = {}, Counter()
+        for path in paths:
+            try:
+                with open(path, newline="", encoding="utf-8") as f:
+                    for row in csv.DictReader(f):
+                        question = (row.get("question") or "").strip()
+                        answer = (row.get("answer_reply") or "").strip()
+                        if (not question or not answer or question.startswith("[IMAGE]")
+                                or answer in self.exclude_answers):
+                            continue
+                        key = normalize_thai(question)
+                        if key:
+                            answers[key] = (question, answer)  # newest answer wins
+                            counts[key] += 1
+            except (OSError, csv.Error, UnicodeDecodeError) as e:
+                print(f"Skipping log {path}: {e}")
+
+        for key, _ in reversed(counts.most_common(self.max_entries)):
+            self.add(*answers[key])
+        return min(len(counts), self.max_entries)
+
+
+def create_faq_cache_from_env(exclude_answers=()):
+    """Build the FAQ cache from FAQ_CACHE_* settings and seed it from logs/."""
+    enabled = os.getenv("FAQ_CACHE", "1") != "0"
+    cache = FAQCache(
+        # 0.95 until calibrated on real question pairs from logs/
+        threshold=float(os.getenv("FAQ_CACHE_THRESHOLD", "0.95")),
+        max_entries=int(os.getenv("FAQ_CACHE_SIZE", "2000")) if enabled else 0,
+        ttl=float(os.getenv("FAQ_CACHE_TTL_HOURS", "0")) * 3600,
+        exclude_answers=exclude_answers,
+    )
+    if enabled and os.getenv("FAQ_CACHE_MINE_LOGS", "1") == "1":
+        loaded = cache.load_logs("logs")
+        print(f"FAQ cache seeded with {loaded} questions from logs/")
+    return cache
@@ -0,0 +1,395 @@
+"""
+Content-addressed image store
+Replaces the flat images/{timestamp}_{message_id}.jpg layout, which kept one file per
+message forever in a single directory:
+
+- every image is stored once, under its SHA-256: images/3f/a2/3fa2...e1.jpg
+  (two levels of 256 shard directories keep every directory small)
+- a SQLite index (images/index.sqlite3) maps message_id -> hash, with the receive
+  time and user_id, so the same photo sent by many users costs one file
+- optional compression tiers for old images, run by a background thread:
+  recompress (JPEG quality IMAGE_RECOMPRESS_QUALITY) after IMAGE_RECOMPRESS_AFTER_DAYS,
+  then shrink to a thumbnail (IMAGE_THUMBNAIL_SIZE px) after IMAGE_THUMBNAIL_AFTER_DAYS.
+  Re-encoded blobs are JPEGs (a PNG / WebP original moves to .jpg); a blob keeps its
+  original hash as its key, so a re-upload of the same photo is still recognised as a
+  duplicate.
+- retention sweeps by the same thread: index rows older than IMAGE_RETENTION_DAYS are
+  dropped with any blob no longer referenced, and the least recently seen blobs are
+  deleted while the store is over IMAGE_STORE_MAX_MB
+
+Configuration (environment variables):
+    IMAGE_STORE_DIR=images
+    IMAGE_RECOMPRESS_AFTER_DAYS=0        # 0 = keep originals
+    IMAGE_RECOMPRESS_QUALITY=75
+    IMAGE_THUMBNAIL_AFTER_DAYS=0         # 0 = never thumbnail
+    IMAGE_THUMBNAIL_SIZE=256
+    IMAGE_RETENTION_DAYS=0               # 0 = keep forever
+    IMAGE_STORE_MAX_MB=0                 # 0 = no size cap
+    IMAGE_MAINTENANCE_INTERVAL_HOURS=1   # how often the background thread compacts and sweeps
+
+Maintenance:
+    python image_store.py stats
+    python image_store.py migrate        # move old flat images/*.jpg files into the store
+    python image_store.py compact
+    python image_store.py sweep
+"""
+
+import argparse
+import datetime
+import glob
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from io import BytesIO
+
+from PIL import Image
+
+import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    tier TEXT NOT NULL DEFAULT 'original',
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    message_id TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL REFERENCES blobs(sha256),
+    user_id TEXT,
+    received_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_received_at ON messages(received_at);
+CREATE INDEX IF NOT EXISTS messages_sha256 ON messages(sha256);
+CREATE INDEX IF NOT EXISTS blobs_last_seen ON blobs(last_seen);
+"""
+
+
+def sniff_extension(data):
+    """File extension from the image's magic bytes."""
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return "bin"
+
+
+class ImageStore:
+    """One file per unique image under a hash-sharded tree, indexed by message_id in SQLite."""
+
+    def __init__(self, root="images", index_path=None):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.index_path = index_path or os.path.join(root, "index.sqlite3")
+        self._db = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._maintenance = None
+        self._bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        metrics.IMAGE_STORE_BYTES.set_function(lambda: self._bytes)
+
+    @staticmethod
+    def relative_path(sha256, extension="jpg"):
+        return os.path.join(sha256[:2], sha256[2:4], f"{sha256}.{extension}")
+
+    def _write_file(self, path, data):
+        """Write atomically: a reader never sees a half-written image."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def put(self, data, message_id, user_id=None, received_at=None):
+        """
+        Store one downloaded image (a no-op on disk if the same bytes are already stored).
+
+        Returns:
+            tuple: (sha256, relative_path, is_new)
+        """
+        sha256 = hashlib.sha256(data).hexdigest()
+        received_at = received_at or time.time()
+        relative = self.relative_path(sha256, sniff_extension(data))
+        with self._lock:
+            row = self._db.execute("SELECT path FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            is_new = row is None or not os.path.exists(os.path.join(self.root, row[0]))
+            if is_new:
+                self._write_file(os.path.join(self.root, relative), data)
+                if row is None:
+                    self._bytes += len(data)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO blobs (sha256, path, size, tier, first_seen, last_seen) "
+                    "VALUES (?, ?, ?, 'original', ?, ?)",
+                    (sha256, relative, len(data), received_at, received_at))
+            else:
+                relative = row[0]
+                self._db.execute("UPDATE blobs SET last_seen = MAX(last_seen, ?) WHERE sha256 = ?",
+                                 (received_at, sha256))
+            self._db.execute(
+                "INSERT OR REPLACE INTO messages (message_id, sha256, user_id, received_at) VALUES (?, ?, ?, ?)",
+                (str(message_id), sha256, user_id, received_at))
+            self._db.commit()
+        metrics.IMAGES_STORED.inc(result="new" if is_new else "duplicate")
+        return sha256, relative, is_new
+
+    def path_for(self, message_id):
+        """Absolute path of the image received as message_id, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT b.path FROM messages m JOIN blobs b ON b.sha256 = m.sha256 WHERE m.message_id = ?",
+                (str(message_id),)).fetchone()
+        return os.path.join(self.root, row[0]) if row else None
+
+    def path_for_hash(self, sha256):
+        """Absolute path of the blob with this SHA-256 (hex), or None if it was swept."""
+        with self._lock:
+            row = self._db.execute("SELECT path FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        return os.path.join(self.root, row[0]) if row else None
+
+    def stats(self):
+        with self._lock:
+            blobs, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            messages = self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            tiers = dict(self._db.execute("SELECT tier, COUNT(*) FROM blobs GROUP BY tier").fetchall())
+        return {"messages": messages, "blobs": blobs, "bytes": size, "tiers": tiers}
+
+    # ------------------------------------------------------------
+    # Compression tiers
+    # ------------------------------------------------------------
+    def _reencode(self, path, quality, max_side=None):
+        with Image.open(path) as image:
+            image = image.convert("RGB")
+            if max_side:
+                image.thumbnail((max_side, max_side))
+            out = BytesIO()
+            image.save(out, format="JPEG", quality=quality, optimize=True)
+        return out.getvalue()
+
+    def compact(self, recompress_after_days=0, quality=75, thumbnail_after_days=0, thumbnail_size=256,
+                batch=200):
+        """
+        Re-encode blobs not seen for a while: recompress, then thumbnail.
+        A blob is only replaced when the new file is smaller.
+
+        Returns:
+            dict: {"recompressed": n, "thumbnail": n, "bytes_saved": n}
+        """
+        now = time.time()
+        passes = []
+        if recompress_after_days > 0:
+            passes.append(("recompressed", ("original",), recompress_after_days, None))
+        if thumbnail_after_days > 0:
+            passes.append(("thumbnail", ("original", "recompressed"), thumbnail_after_days, thumbnail_size))
+
+        result = {"recompressed": 0, "thumbnail": 0, "bytes_saved": 0}
+        for tier, from_tiers, days, max_side in passes:
+            cutoff = now - days * 86400
+            while not self._stop.is_set():
+                with self._lock:
+                    rows = self._db.execute(
+                        f"SELECT sha256, path, size FROM blobs WHERE last_seen < ? "
+                        f"AND tier IN ({','.join('?' * len(from_tiers))}) LIMIT ?",
+                        (cutoff, *from_tiers, batch)).fetchall()
+                if not rows:
+                    break
+                for sha256, relative, size in rows:
+                    path = os.path.join(self.root, relative)
+                    try:
+                        data = self._reencode(path, quality, max_side)
+                    except Exception as e:
+                        print(f"Image store: cannot re-encode {relative}: {e}")
+                        data = None
+                    if data is not None and len(data) >= size:
+                        data = None
+                    # The tier moves on either way, so a blob that cannot shrink is not retried
+                    with self._lock:
+                        if data is not None:
+                            # Now a JPEG: a .png / .webp blob moves to .jpg (same hash key)
+                            new_relative = self.relative_path(sha256, "jpg")
+                            self._write_file(os.path.join(self.root, new_relative), data)
+                            self._bytes -= size - len(data)
+                            result["bytes_saved"] += size - len(data)
+                            result[tier] += 1
+                        else:
+                            new_relative = relative
+                        self._db.execute("UPDATE blobs SET tier = ?, size = ?, path = ? WHERE sha256 = ?",
+                                         (tier, len(data) if data is not None else size, new_relative, sha256))
+                        self._db.commit()
+                        if new_relative != relative:
+                            try:
+                                os.remove(path)
+                            except FileNotFoundError:
+                                pass
+        return result
+
+    # ------------------------------------------------------------
+    # Retention
+    # ------------------------------------------------------------
+    def _delete_blobs(self, rows):
+        """Delete blob files and their index rows (caller holds the lock)."""
+        for sha256, relative, size in rows:
+            try:
+                os.remove(os.path.join(self.root, relative))
+            except FileNotFoundError:
+                pass
+            self._db.execute("DELETE FROM messages WHERE sha256 = ?", (sha256,))
+            self._db.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+            self._bytes -= size
+
+    def sweep(self, retention_days=0, max_bytes=0, batch=500):
+        """
+        Drop images older than retention_days, then the least recently seen ones while
+        the store holds more than max_bytes.
+
+        Returns:
+            dict: {"expired": blobs removed by age, "evicted": blobs removed by size}
+        """
+        result = {"expired": 0, "evicted": 0}
+        if retention_days > 0:
+            cutoff = time.time() - retention_days * 86400
+            with self._lock:
+                self._db.execute("DELETE FROM messages WHERE received_at < ?", (cutoff,))
+                self._db.commit()
+            while not self._stop.is_set():
+                with self._lock:
+                    rows = self._db.execute(
+                        "SELECT sha256, path, size FROM blobs WHERE last_seen < ? "
+                        "AND sha256 NOT IN (SELECT sha256 FROM messages) LIMIT ?", (cutoff, batch)).fetchall()
+                    self._delete_blobs(rows)
+                    self._db.commit()
+                result["expired"] += len(rows)
+                if len(rows) < batch:
+                    break
+
+        while max_bytes > 0 and self._bytes > max_bytes and not self._stop.is_set():
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT sha256, path, size FROM blobs ORDER BY last_seen LIMIT ?", (batch,)).fetchall()
+                evict = []
+                freed = 0
+                for row in rows:
+                    if self._bytes - freed <= max_bytes:
+                        break
+                    evict.append(row)
+                    freed += row[2]
+                self._delete_blobs(evict)
+                self._db.commit()
+            result["evicted"] += len(evict)
+            if not evict:
+                break
+
+        for reason in ("expired", "evicted"):
+            if result[reason]:
+                metrics.IMAGES_REMOVED.inc(result[reason], reason=reason)
+        return result
+
+    def start_maintenance(self, interval, compact_args=None, sweep_args=None):
+        """Run compact() and sweep() every `interval` seconds in a daemon thread."""
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    if compact_args:
+                        result = self.compact(**compact_args)
+                        if result["recompressed"] or result["thumbnail"]:
+                            print(f"Image store compaction: {result}")
+                    if sweep_args:
+                        result = self.sweep(**sweep_args)
+                        if result["expired"] or result["evicted"]:
+                            print(f"Image store sweep: {result}")
+                except Exception as e:
+                    print(f"Image store maintenance failed: {e}")
+
+        self._maintenance = threading.Thread(target=run, name="image-store-maintenance", daemon=True)
+        self._maintenance.start()
+
+    # ------------------------------------------------------------
+    # Migration from the flat images/{timestamp}_{message_id}.jpg layout
+    # ------------------------------------------------------------
+    def migrate_flat_images(self, remove=True):
+        """Import images/*.jpg files written by earlier versions. Returns the number imported."""
+        imported = 0
+        for path in sorted(glob.glob(os.path.join(self.root, "*.jpg"))):
+            name = os.path.splitext(os.path.basename(path))[0]
+            parts = name.split("_", 6)
+            try:
+                received_at = datetime.datetime.strptime("_".join(parts[:6]), "%Y_%m_%d_%H_%M_%S").timestamp()
+                message_id = parts[6]
+            except (ValueError, IndexError):
+                received_at, message_id = os.path.getmtime(path), name
+            with open(path, "rb") as f:
+                self.put(f.read(), message_id, received_at=received_at)
+            if remove:
+                os.remove(path)
+            imported += 1
+        return imported
+
+    def close(self):
+        self._stop.set()
+        if self._maintenance is not None:
+            self._maintenance.join(timeout=5)
+        with self._lock:
+            self._db.close()
+
+
+def _compact_args_from_env():
+    return {
+        "recompress_after_days": float(os.getenv("IMAGE_RECOMPRESS_AFTER_DAYS", "0")),
+        "quality": int(os.getenv("IMAGE_RECOMPRESS_QUALITY", "75")),
+        "thumbnail_after_days": float(os.getenv("IMAGE_THUMBNAIL_AFTER_DAYS", "0")),
+        "thumbnail_size": int(os.getenv("IMAGE_THUMBNAIL_SIZE", "256")),
+    }
+
+
+def _sweep_args_from_env():
+    return {
+        "retention_days": float(os.getenv("IMAGE_RETENTION_DAYS", "0")),
+        "max_bytes": int(float(os.getenv("IMAGE_STORE_MAX_MB", "0")) * 1024 * 1024),
+    }
+
+
+def create_image_store_from_env():
+    """Open the store in IMAGE_STORE_DIR and start background maintenance if any is configured."""
+    store = ImageStore(os.getenv("IMAGE_STORE_DIR", "images"))
+    compact_args = _compact_args_from_env()
+    if not (compact_args["recompress_after_days"] > 0 or compact_args["thumbnail_after_days"] > 0):
+        compact_args = None
+    sweep_args = _sweep_args_from_env()
+    if not (sweep_args["retention_days"] > 0 or sweep_args["max_bytes"] > 0):
+        sweep_args = None
+    if compact_args or sweep_args:
+        interval = float(os.getenv("IMAGE_MAINTENANCE_INTERVAL_HOURS", "1")) * 3600
+        store.start_maintenance(interval, compact_args, sweep_args)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Content-addressed image store maintenance")
+    parser.add_argument("command", choices=["stats", "migrate", "compact", "sweep"])
+    parser.add_argument("--dir", default=os.getenv("IMAGE_STORE_DIR", "images"))
+    parser.add_argument("--keep", action="store_true", help="migrate: keep the flat files after import")
+    args = parser.parse_args()
+
+    store = ImageStore(args.dir)
+    if args.command == "migrate":
+        print(f"Imported {store.migrate_flat_images(remove=not args.keep)} images")
+    elif args.command == "compact":
+        print(store.compact(**_compact_args_from_env()))
+    elif args.command == "sweep":
+        print(store.sweep(**_sweep_args_from_env()))
+    print(store.stats())
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
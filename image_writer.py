@@ -0,0 +1,141 @@
+"""
+Deferred, off-thread image persistence
+Photos used to be written to images/ inside the download loop, before inference even
+started. Handlers now hand the downloaded bytes to an ImageWriter *after* the reply has
+been sent; a background thread hashes them and writes them to the ImageStore, so disk
+I/O never sits on the reply latency path.
+
+Which images are kept:
+    IMAGE_SAVE=all              # every image (default, same as before)
+    IMAGE_SAVE=low_confidence   # only images whose top-1 confidence is below
+                                # IMAGE_SAVE_CONFIDENCE - the ones worth reviewing
+    IMAGE_SAVE=none             # nothing is written
+
+Other settings (environment variables):
+    IMAGE_SAVE_CONFIDENCE=0.6   # threshold for low_confidence
+    IMAGE_MAX_KB=10240          # larger images are not saved (0 = no cap)
+    IMAGE_WRITER_QUEUE=256      # pending writes; when full, new images are dropped, not waited for
+
+Retention and the total size cap are enforced by the store (IMAGE_RETENTION_DAYS,
+IMAGE_STORE_MAX_MB, see image_store.py). With an UncertaintyIndex (ACTIVE_LEARNING=1,
+see active_learning.py) the writer also records the prediction of every saved image,
+and with an EmbeddingIndex (EMBEDDINGS=1, see embedding_index.py) its embedding.
+"""
+
+import atexit
+import os
+import queue
+import threading
+
+import metrics
+from active_learning import create_uncertainty_index_from_env
+
+SAVE_POLICIES = ("all", "low_confidence", "none")
+
+
+class ImageWriter:
+    """Single background thread that persists images to an ImageStore."""
+
+    def __init__(self, store, policy="all", confidence_threshold=0.6, max_bytes=0, max_queue=256,
+                 uncertainty_index=None, embedding_index=None):
+        if policy not in SAVE_POLICIES:
+            raise ValueError(f"IMAGE_SAVE must be one of {', '.join(SAVE_POLICIES)}, got '{policy}'")
+        self.store = store
+        self.policy = policy
+        self.confidence_threshold = confidence_threshold
+        self.max_bytes = max_bytes
+        self.uncertainty_index = uncertainty_index
+        self.embedding_index = embedding_index
+        self._queue = queue.Queue(maxsize=max_queue)
+        metrics.QUEUE_DEPTH.set_function(self._queue.qsize, queue="image_writer")
+        self._thread = None
+        if policy != "none":
+            self._thread = threading.Thread(target=self._run, name="image-writer", daemon=True)
+            self._thread.start()
+
+    def wants(self, top_confidence=None):
+        """True if the sampling policy keeps an image with this top-1 confidence."""
+        if self.policy == "all":
+            return True
+        if self.policy == "low_confidence":
+            return top_confidence is not None and top_confidence < self.confidence_threshold
+        return False
+
+    def submit(self, data, message_id, user_id=None, predictions=None, embedding=None):
+        """
+        Queue one image for saving. Never blocks.
+
+        Args:
+            predictions: predict_pil result [(breed_name, confidence), ...], used for
+                sampling and recorded in the uncertainty index
+            embedding: 512-d image embedding for the embedding index, if captured
+
+        Returns:
+            bool: True if the image was queued
+        """
+        reason = None
+        top_confidence = predictions[0][1] if predictions else None
+        if not self.wants(top_confidence):
+            reason = "sampled_out"
+        elif self.max_bytes and len(data) > self.max_bytes:
+            reason = "too_large"
+        else:
+            try:
+                self._queue.put_nowait((data, message_id, user_id, predictions, embedding))
+                return True
+            except queue.Full:
+                reason = "queue_full"
+                print(f"⚠️  Image writer queue full, not saving {message_id}")
+        metrics.IMAGES_NOT_STORED.inc(reason=reason)
+        return False
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                data, message_id, user_id, predictions, embedding = item
+                sha256, relative, is_new = self.store.put(data, message_id, user_id)
+                print(f"Image {'saved' if is_new else 'already stored'} at: {relative}")
+                if self.uncertainty_index is not None and predictions:
+                    self.uncertainty_index.append(message_id, sha256, predictions)
+                if self.embedding_index is not None and embedding is not None:
+                    self.embedding_index.add(embedding, message_id, sha256,
+                                             predictions[0][0] if predictions else None)
+            except Exception as e:
+                metrics.IMAGES_NOT_STORED.inc(reason="error")
+                print(f"Error saving image: {e}")
+            finally:
+                self._queue.task_done()
+
+    def close(self, timeout=10):
+        """Write what is already queued (up to `timeout` seconds), then stop the thread."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)  # after every queued image
+        except queue.Full:
+            return
+        self._thread.join(timeout=timeout)
+
+
+def create_image_writer_from_env(store, class_names=None, embedding_index=None):
+    """Build the ImageWriter from IMAGE_SAVE* settings; pending writes are flushed at exit."""
+    uncertainty_index = None
+    if class_names is not None:
+        uncertainty_index = create_uncertainty_index_from_env(store, class_names)
+    writer = ImageWriter(
+        store,
+        policy=os.getenv("IMAGE_SAVE", "all"),
+        confidence_threshold=float(os.getenv("IMAGE_SAVE_CONFIDENCE", "0.6")),
+        max_bytes=int(float(os.getenv("IMAGE_MAX_KB", "10240")) * 1024),
+        max_queue=int(os.getenv("IMAGE_WRITER_QUEUE", "256")),
+        uncertainty_index=uncertainty_index,
+        embedding_index=embedding_index,
+    )
+    atexit.register(writer.close)
+    print(f"Image writer: save {writer.policy}"
+          + (f" (top-1 < {writer.confidence_threshold:.0%})" if writer.policy == "low_confidence" else "")
+          + (", recording uncertainty" if uncertainty_index is not None else ""))
+    return writer
@@ -0,0 +1,402 @@
+"""
+Process-pool inference for CPU parallelism beyond the GIL
+Runs the dog breed model in N worker processes (each loads the model once and is pinned
+to one core). Tensors travel through a shared-memory SlotRing (shm_ring.py): the request
+thread copies the preprocessed (N, 3, 224, 224) float32 batch into a free slot and puts a
+SlotHandle on the task queue; whichever worker is idle runs the model and writes the logits
+back into the same slot. Only the handle is pickled.
+
+Enable in the entry points with:
+    INFERENCE_PROCESSES=4      # number of worker processes (0 = run in the request thread)
+    INFERENCE_MAX_BATCH=8      # largest batch one slot can hold (default 8)
+    INFERENCE_SLOTS=8          # slots in the ring (default 2 per worker)
+    INFERENCE_TIMEOUT=30       # seconds to wait for a slot and for a batch before giving up
+
+Slots are never lost: every slot carries a generation number (shared with the workers).
+A request that times out bumps its slot's generation and returns the slot at once unless
+a worker is running it; a queued stale task is then skipped by the worker and a late
+result is ignored. A worker still running an abandoned slot after another timeout is
+considered hung and is terminated; restarting it reclaims the slot.
+
+Every worker reports back on its own pipe, written synchronously: a worker that dies
+mid-message (crash, OOM kill, terminate) breaks only its own pipe, which is replaced
+with the worker. A shared result queue would stay locked by the dead writer.
+"""
+
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from multiprocessing.connection import wait
+from queue import Empty
+
+import numpy as np
+
+import dog_model
+import metrics
+from shm_ring import SlotHandle, SlotRing
+from warmup import batch_sizes_from_env, warm_forward, warm_rounds
+
+INPUT_SHAPE = (3, dog_model.INPUT_SIZE, dog_model.INPUT_SIZE)
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class InferenceError(Exception):
+    """Raised when a worker process fails to run a batch."""
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _worker_main(index, backend, model_path, core, ring_spec, tasks, results, current, generations,
+                 warmup_sizes=(), warmup_rounds=3, load_forward=dog_model.load_forward):
+    """Worker process loop: take a SlotHandle, run the model on that slot, report back on `results` (a pipe)."""
+    if core is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {core})
+
+    try:
+        forward = load_forward(backend, model_path, num_threads=1)
+        # Warm up before reporting ready, so no request gets this worker's cold first batch
+        warm_forward(forward, warmup_sizes, warmup_rounds)
+    except Exception as e:
+        results.send(("error", -1, -1, f"worker {index} model load failed: {e!r}"))
+        return
+
+    ring = SlotRing.attach(ring_spec)
+    results.send(("ready", -1, -1, index))
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, batch_size, generation = task
+            handle = SlotHandle(slot, batch_size)
+            # Claim the slot first, then check it was not reclaimed while queued: the parent
+            # only reclaims slots no worker has claimed, so one of the two always backs off
+            current[index] = slot
+            try:
+                if generations[slot] != generation:
+                    continue
+                ring.output_view(handle)[:] = forward(ring.input_view(handle))
+                results.send(("ok", slot, generation, None))
+            except Exception as e:
+                results.send(("error", slot, generation, repr(e)))
+            finally:
+                current[index] = -1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+        results.close()
+
+
+class _Pending:
+    """A request waiting for its slot to come back from a worker."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.status = None
+        self.value = None
+
+
+class InferencePool:
+    """Pool of model worker processes fed through a shared-memory slot ring."""
+
+    def __init__(self, num_workers, backend="torch", model_path=None, max_batch=8, num_slots=None,
+                 pin_cores=True, ready_timeout=300, timeout=30, warmup_sizes=(), warmup_rounds=3,
+                 load_forward=dog_model.load_forward):
+        self.num_workers = num_workers
+        self.backend = backend
+        self.model_path = model_path or (dog_model.MODEL_PATH if backend == "torch" else dog_model.ONNX_MODEL_PATH)
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.warmup_sizes = tuple(warmup_sizes)
+        self.warmup_rounds = warmup_rounds
+        self.load_forward = load_forward
+        self._context = multiprocessing.get_context("spawn")
+        self._cores = available_cores() if pin_cores else []
+
+        # Two slots per worker by default, so the next batch is copied in while the current one runs
+        self.ring = SlotRing(num_slots or 2 * num_workers, max_batch, INPUT_SHAPE, len(dog_model.class_names))
+        self._tasks = self._context.Queue()
+        # Worker index -> read end of its result pipe (None once the pipe is broken)
+        self._results = {}
+        self._current = self._context.Array("i", [-1] * num_workers, lock=False)
+        self._generations = self._context.Array("i", [0] * self.ring.num_slots, lock=False)
+        self._pending = {}
+        # Timed-out slots still being run by a worker: slot -> time abandoned
+        self._abandoned = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self._processes = [self._spawn(index) for index in range(num_workers)]
+        self._wait_ready(ready_timeout)
+
+        self._collector = threading.Thread(target=self._collect, name="inference-collector", daemon=True)
+        self._collector.start()
+
+        metrics.QUEUE_DEPTH.set_function(lambda: len(self._pending), queue="inference_pool")
+        print(f"Inference pool ready: {num_workers} {backend} workers, {self.ring.num_slots} slots"
+              f"{' pinned to cores ' + str([self._core(i) for i in range(num_workers)]) if self._cores else ''}")
+
+    def _core(self, index):
+        return self._cores[index % len(self._cores)] if self._cores else None
+
+    def _spawn(self, index):
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.backend, self.model_path, self._core(index), self.ring.spec(),
+                  self._tasks, writer, self._current, self._generations,
+                  self.warmup_sizes, self.warmup_rounds, self.load_forward),
+            name=f"inference-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        # Only the worker writes: without our copy, its pipe reports EOF once it exits
+        writer.close()
+        old = self._results.get(index)
+        if old is not None:
+            old.close()
+        self._results[index] = reader
+        return process
+
+    def _receive(self, timeout):
+        """Messages from the workers' result pipes that arrive within `timeout` seconds."""
+        readers = {reader: index for index, reader in self._results.items() if reader is not None}
+        if not readers:
+            time.sleep(timeout)
+            return []
+        messages = []
+        for reader in wait(list(readers), timeout):
+            try:
+                messages.append(reader.recv())
+            except (EOFError, OSError):
+                # The worker exited, maybe mid-message; _check_workers restarts it with a new pipe
+                self._results[readers[reader]] = None
+                reader.close()
+        return messages
+
+    def _wait_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        ready = 0
+        while ready < self.num_workers:
+            remaining = deadline - time.monotonic()
+            messages = self._receive(remaining) if remaining > 0 else []
+            if not messages and (remaining <= 0 or not any(self._results.values())):
+                self.close()
+                raise InferenceError(f"workers did not load the model within {timeout}s")
+            for status, _, _, value in messages:
+                if status != "ready":
+                    self.close()
+                    raise InferenceError(value)
+                ready += 1
+
+    # ------------------------------------------------------------
+    # Collector thread: completes pending requests, restarts dead workers
+    # ------------------------------------------------------------
+    def _holder(self, slot):
+        """Index of the worker running `slot`, or None."""
+        for index in range(self.num_workers):
+            if self._current[index] == slot:
+                return index
+        return None
+
+    def _reclaim(self, slot):
+        """Return an abandoned slot to the ring (caller holds self._lock)."""
+        # Queued tasks and late results for the old generation are ignored from now on
+        self._generations[slot] += 1
+        self._abandoned.pop(slot, None)
+        self.ring.release(slot)
+        metrics.INFERENCE_SLOTS_RECLAIMED.inc()
+
+    def _abandon(self, slot):
+        """A request gave up on `slot` (caller holds self._lock)."""
+        if self._holder(slot) is None:
+            self._reclaim(slot)
+        else:
+            self._abandoned[slot] = time.monotonic()
+
+    def _finish(self, slot, generation, status, value):
+        with self._lock:
+            if generation != self._generations[slot]:
+                return
+            pending = self._pending.pop(slot, None)
+            if pending is None:
+                # The caller timed out; the worker is done with the slot now
+                self._reclaim(slot)
+                return
+        pending.status = status
+        pending.value = value
+        pending.event.set()
+
+    def _check_workers(self):
+        for index, process in enumerate(self._processes):
+            if self._closed or process.is_alive():
+                continue
+            print(f"Inference worker {index} died (exit code {process.exitcode}), restarting...")
+            slot = self._current[index]
+            self._current[index] = -1
+            if slot >= 0:
+                self._finish(slot, self._generations[slot], "error", f"worker {index} crashed")
+            self._processes[index] = self._spawn(index)
+
+        # A worker still busy with a slot abandoned a full timeout ago is hung: restart it
+        # (the restart above reclaims the slot). A slot nobody runs any more lost its result.
+        hung = []
+        with self._lock:
+            for slot, since in list(self._abandoned.items()):
+                if time.monotonic() - since < self.timeout:
+                    continue
+                index = self._holder(slot)
+                if index is None:
+                    self._reclaim(slot)
+                else:
+                    hung.append((slot, index))
+        for slot, index in hung:
+            if not self._closed:
+                print(f"Inference worker {index} hung on slot {slot}, terminating...")
+                self._processes[index].terminate()
+
+    def _collect(self):
+        last_check = time.monotonic()
+        while not self._closed:
+            try:
+                messages = self._receive(1.0)
+            except (OSError, ValueError):
+                # close() shut the pipes while we were waiting on them
+                break
+            for status, slot, generation, value in messages:
+                if status == "ready":
+                    print(f"Inference worker {value} ready")
+                elif slot >= 0:
+                    self._finish(slot, generation, status, value)
+                else:
+                    print(f"Inference worker error: {value}")
+            if time.monotonic() - last_check >= 1.0:
+                self._check_workers()
+                last_check = time.monotonic()
+
+    # ------------------------------------------------------------
+    # Request side
+    # ------------------------------------------------------------
+    def _run_chunk(self, batch):
+        try:
+            slot = self.ring.acquire(timeout=self.timeout)
+        except Empty:
+            raise InferenceError(f"no free inference slot within {self.timeout}s")
+        pending = _Pending()
+        with self._lock:
+            self._pending[slot] = pending
+            generation = self._generations[slot]
+        handle = self.ring.write_input(slot, batch)
+        self._tasks.put((handle.slot, handle.batch_size, generation))
+
+        if not pending.event.wait(self.timeout):
+            with self._lock:
+                abandoned = self._pending.pop(slot, None) is pending
+                if abandoned:
+                    self._abandon(slot)
+            if abandoned:
+                raise InferenceError(f"inference timed out after {self.timeout}s")
+            # The collector already claimed the result and is about to set the event
+            pending.event.wait()
+
+        try:
+            if pending.status != "ok":
+                raise InferenceError(pending.value)
+            return self.ring.read_output(handle)
+        finally:
+            self.ring.release(slot)
+
+    def predict_logits(self, batch):
+        """Run a (N, 3, 224, 224) float32 batch and return (N, num_classes) logits."""
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        chunks = [self._run_chunk(batch[i:i + self.max_batch]) for i in range(0, batch.shape[0], self.max_batch)]
+        return np.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+
+    def predict_pil(self, image, k=3):
+        """Same contract as predict_pil in the entry points: [(breed_name, confidence), ...]."""
+        probs = dog_model.softmax(self.predict_logits(dog_model.preprocess_image(image)))
+        return dog_model.top_k(probs[0], k)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for reader in self._results.values():
+            if reader is not None:
+                reader.close()
+        self.ring.close()
+
+
+def main_script_reimported_by_workers():
+    """
+    The project script run as __main__ (e.g. `python main_enhanced.py`), or None.
+    Spawned workers re-run that script before _worker_main, i.e. the whole entry point:
+    a second model load, warm-up, image writer and model watcher in every worker.
+    Under waitress-serve / `python -m waitress` __main__ is the launcher, which is safe.
+    """
+    main = sys.modules.get("__main__")
+    path = getattr(main, "__file__", None)
+    spec_name = getattr(getattr(main, "__spec__", None), "name", "") or ""
+    if path is None or spec_name.endswith("__main__"):
+        return None
+    path = os.path.abspath(path)
+    return path if path.startswith(PROJECT_ROOT + os.sep) else None
+
+
+def create_pool_from_env(backend, model_path=None):
+    """
+    Build an InferencePool when INFERENCE_PROCESSES > 0, otherwise return None.
+    Refuses (and runs inference in-process) when the entry point is run as a script.
+    """
+    num_workers = int(os.getenv("INFERENCE_PROCESSES", "0"))
+    if num_workers <= 0:
+        return None
+    script = main_script_reimported_by_workers()
+    if script is not None:
+        print(f"⚠️  INFERENCE_PROCESSES ignored: every worker would re-run {os.path.basename(script)}. "
+              f"Start the app with waitress-serve (e.g. waitress-serve main_enhanced:app) to use the pool.")
+        return None
+
+    import atexit
+
+    max_batch = int(os.getenv("INFERENCE_MAX_BATCH", "8"))
+    pool = InferencePool(
+        num_workers,
+        backend=backend,
+        model_path=model_path,
+        max_batch=max_batch,
+        num_slots=int(os.getenv("INFERENCE_SLOTS", "0")) or None,
+        pin_cores=os.getenv("INFERENCE_PIN_CORES", "1") == "1",
+        timeout=float(os.getenv("INFERENCE_TIMEOUT", "30")),
+        # Batches of 1 up to max_batch reach the workers (see warmup.py)
+        warmup_sizes=batch_sizes_from_env(max_batch) if os.getenv("WARMUP", "sync") != "off" else (),
+        warmup_rounds=warm_rounds(),
+    )
+    atexit.register(pool.close)
+    return pool
+
+
+def warn_bypassed(settings):
+    """
+    Startup warning for in-process features the workers do not run: the pool answers
+    predict_pil with the plain model. settings maps a setting (e.g. "TTA=1") to the
+    object it enabled, or None when it is off.
+    """
+    bypassed = [name for name, enabled in settings.items() if enabled is not None]
+    if bypassed:
+        print(f"⚠️  INFERENCE_PROCESSES workers run the plain model: {', '.join(bypassed)} "
+              f"ignored for predictions. Set INFERENCE_PROCESSES=0 to use them.")
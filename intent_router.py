@@ -0,0 +1,214 @@
+"""
+Compiled intent router for text messages
+Replaces the per-request quick_responses dict. Intents are loaded once at startup from
+intents.json and compiled into:
+
+- a dict of exact phrases
+- one Aho-Corasick automaton holding every prefix and keyword pattern (the automaton's
+  trie answers prefix matches, its failure links find keywords anywhere in the message)
+- one combined regular expression with a named group per regex intent
+- a dict of breed names / Thai aliases for breed lookups ("โกลเด้น", "พันธุ์ปอมคืออะไร")
+
+Matching runs on normalize_thai() text (see faq_cache.py), so "สวัสดีครับ!!" and
+"สวัสดี" are the same message. Resolution order: exact, breed lookup, longest prefix,
+keyword (earliest intent in the file wins), regex. An intent with "max_length" only
+matches short messages, so "ขอบคุณครับ แล้วโกลเด้นกินอะไรได้บ้าง" still reaches the LLM.
+
+Configuration:
+    INTENTS_CONFIG=intents.json    # path to the intents file (default: next to this module)
+"""
+
+import json
+import os
+import re
+from collections import deque, namedtuple
+
+import metrics
+from faq_cache import normalize_thai
+
+IntentMatch = namedtuple("IntentMatch", ["intent", "reply", "kind"])
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intents.json")
+
+# Used when intents.json is missing, so the bot keeps its original quick replies
+FALLBACK_INTENTS = {
+    "intents": [
+        {"name": "greeting", "exact": ["สวัสดี"], "reply": "สวัสดีครับ ยินดีที่ได้รู้จักนะครับ 😊"},
+        {"name": "bot_name", "exact": ["ชื่ออะไร"],
+         "reply": "ผมชื่อไลน์บอทครับ สามารถส่งรูปน้องหมามาให้ผมทายสายพันธุ์ได้เลยครับ 🐶"},
+    ]
+}
+
+
+class Automaton:
+    """Aho-Corasick automaton; values are attached to the node where each pattern ends."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        self.depth = [0]
+
+    def add(self, pattern, value):
+        node = 0
+        for ch in pattern:
+            next_node = self.goto[node].get(ch)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][ch] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.depth.append(self.depth[node] + 1)
+            node = next_node
+        self.outputs[node].append(value)
+
+    def build(self):
+        """Compute failure links (breadth first) and merge outputs along them."""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(ch, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def prefixes(self, text):
+        """Values of patterns that are prefixes of text (trie walk, no failure links)."""
+        node = 0
+        for ch in text:
+            node = self.goto[node].get(ch)
+            if node is None:
+                return
+            for value in self.outputs[node]:
+                if value[2] == self.depth[node]:
+                    yield value
+
+    def search(self, text):
+        """Values of every pattern occurring anywhere in text."""
+        node = 0
+        for ch in text:
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            yield from self.outputs[node]
+
+
+class IntentRouter:
+    """Resolves greetings, help and breed-name lookups locally."""
+
+    def __init__(self, config, class_names=()):
+        self.intents = config.get("intents", [])
+        self.replies = [intent["reply"] for intent in self.intents]
+        self.names = [intent["name"] for intent in self.intents]
+        self.max_lengths = [intent.get("max_length", 0) for intent in self.intents]
+
+        self.exact = {}
+        self.automaton = Automaton()
+        regex_parts = []
+        for index, intent in enumerate(self.intents):
+            for phrase in intent.get("exact", []):
+                self.exact.setdefault(normalize_thai(phrase), index)
+            for kind in ("prefix", "keywords"):
+                for pattern in intent.get(kind, []):
+                    pattern = normalize_thai(pattern)
+                    if pattern:
+                        self.automaton.add(pattern, (kind, index, len(pattern)))
+            for number, pattern in enumerate(intent.get("regex", [])):
+                regex_parts.append(f"(?P<i{index}_{number}>{pattern})")
+        self.automaton.build()
+        self.regex = re.compile("|".join(regex_parts)) if regex_parts else None
+
+        self._load_breeds(config.get("breeds", {}), config.get("lookup_strip", {}), class_names)
+
+    def _load_breeds(self, breeds, strip, class_names):
+        self.breed_intent = breeds.get("intent", "breed_lookup")
+        template = breeds.get("reply_template", "🐶 {display_name}\n\n{info}")
+        self.breed_replies = {}
+        known = set(class_names)
+        for breed, entry in breeds.get("entries", {}).items():
+            if breed not in known or not entry.get("info"):
+                print(f"Intent router: skipping breed entry '{breed}'")
+                continue
+            reply = template.format(display_name=breed.replace("_", " "), info=entry["info"])
+            for name in [breed, breed.replace("_", " ")] + entry.get("aliases", []):
+                key = normalize_thai(name)
+                if key:
+                    self.breed_replies.setdefault(key, reply)
+        # Longest first, so "สุนัขพันธุ์" is stripped before "สุนัข"
+        self.strip_prefixes = sorted({normalize_thai(p) for p in strip.get("prefixes", [])}, key=len, reverse=True)
+        self.strip_suffixes = sorted({normalize_thai(s) for s in strip.get("suffixes", [])}, key=len, reverse=True)
+
+    def _allowed(self, index, key):
+        return not self.max_lengths[index] or len(key) <= self.max_lengths[index]
+
+    def _breed_lookup(self, key):
+        if key in self.breed_replies:
+            return self.breed_replies[key]
+        for suffix in self.strip_suffixes:
+            if suffix and key.endswith(suffix) and len(key) > len(suffix):
+                key = key[:-len(suffix)]
+                break
+        for prefix in self.strip_prefixes:
+            if prefix and key.startswith(prefix) and len(key) > len(prefix):
+                key = key[len(prefix):]
+                break
+        return self.breed_replies.get(key)
+
+    def _match(self, text):
+        key = normalize_thai(text)
+        if not key:
+            return None
+
+        index = self.exact.get(key)
+        if index is not None:
+            return IntentMatch(self.names[index], self.replies[index], "exact")
+
+        breed_reply = self._breed_lookup(key)
+        if breed_reply is not None:
+            return IntentMatch(self.breed_intent, breed_reply, "breed")
+
+        prefixes = [value for value in self.automaton.prefixes(key)
+                    if value[0] == "prefix" and self._allowed(value[1], key)]
+        if prefixes:
+            _, index, _ = max(prefixes, key=lambda value: value[2])
+            return IntentMatch(self.names[index], self.replies[index], "prefix")
+
+        keywords = [value for value in self.automaton.search(key)
+                    if value[0] == "keywords" and self._allowed(value[1], key)]
+        if keywords:
+            _, index, _ = min(keywords, key=lambda value: (value[1], -value[2]))
+            return IntentMatch(self.names[index], self.replies[index], "keyword")
+
+        if self.regex is not None:
+            found = self.regex.search(text.strip().casefold())
+            if found:
+                index = int(found.lastgroup[1:].split("_")[0])
+                if self._allowed(index, key):
+                    return IntentMatch(self.names[index], self.replies[index], "regex")
+        return None
+
+    def route(self, text):
+        """Return an IntentMatch for messages answered locally, or None to fall through."""
+        match = self._match(text)
+        if match is not None:
+            metrics.INTENTS.inc(intent=match.intent)
+            print(f"Intent '{match.intent}' ({match.kind}) for: {text[:30]}")
+        return match
+
+
+def create_intent_router_from_env(class_names):
+    """Load intents from INTENTS_CONFIG (default intents.json next to this module)."""
+    path = os.getenv("INTENTS_CONFIG", DEFAULT_CONFIG)
+    try:
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Could not load intents from {path} ({e}), using built-in quick replies")
+        config = FALLBACK_INTENTS
+    router = IntentRouter(config, class_names)
+    print(f"Intent router ready: {len(router.intents)} intents, {len(router.breed_replies)} breed names")
+    return router
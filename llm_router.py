@@ -0,0 +1,411 @@
+"""
+Multi-backend LLM router with failover, hedged requests and circuit breakers
+Each entry point used to call exactly one LLM with a flat 30 s timeout. The router holds
+a list of backends in priority order (Thai LLM, a local Ollama, any OpenAI-compatible
+server) and for every prompt:
+
+- sends it to the highest-priority backend whose circuit is not open
+- if that backend has not answered after its own p95 latency, sends a hedged copy to
+  the next backend and returns whichever answers first
+- if it fails (error, timeout, bad response), fails over to the next backend
+- records latency and success/failure per backend; each backend has its own circuit
+  breaker and adaptive timeout (see circuit_breaker.py), so a dead backend is skipped
+  instead of costing a full timeout per message
+
+With a single backend (the default) there is no thread hop: the call runs in the
+caller's thread and only the circuit breaker applies.
+
+complete_async() does the same on an asyncio event loop (main_async.py): backends are
+called with aiohttp instead of requests and hedged copies are tasks instead of threads,
+so a slow LLM costs a coroutine, not an OS thread. Both paths share each backend's
+circuit breaker, adaptive timeout, latency stats and metrics. aiohttp is only imported
+by the async path.
+
+Configuration (environment variables):
+    LLM_BACKENDS=thai_llm,ollama   # priority order (default: the entry point's own backend)
+    LLM_HEDGE=1                    # set to 0 to disable hedged requests
+    LLM_HEDGE_PERCENTILE=95        # hedge once the first backend is slower than this percentile
+    LLM_HEDGE_MIN_SAMPLES=20       # successful calls needed before a backend is hedged
+    LLM_TIMEOUT / LLM_TIMEOUT_* / LLM_BREAKER_*   # see circuit_breaker.py
+
+Backends:
+    thai_llm    THAI_LLM_URL, THAI_LLM_API_KEY, THAI_LLM_MODEL
+    ollama      OLLAMA_URL, OLLAMA_MODEL
+    openai      LLM_OPENAI_URL, LLM_OPENAI_API_KEY, LLM_OPENAI_MODEL  (vLLM, LM Studio, ...)
+"""
+
+import asyncio
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+import metrics
+from circuit_breaker import (AdaptiveTimeout, CircuitBreaker, LatencyStats,
+                             create_adaptive_timeout_from_env, create_circuit_breaker_from_env)
+
+LLMResult = namedtuple("LLMResult", ["text", "backend"])
+
+
+class LLMBackendError(Exception):
+    """Raised by a backend when the upstream answer is unusable."""
+
+
+class LLMBackend:
+    """One upstream LLM. Subclasses implement _request() and return the answer text."""
+
+    def __init__(self, name, timeout=None, breaker=None):
+        self.name = name
+        self.timeout = timeout or AdaptiveTimeout()
+        self.breaker = breaker or CircuitBreaker(name)
+        self.stats = LatencyStats()
+        metrics.LLM_ERROR_RATE.set_function(self.stats.error_rate, backend=name)
+        metrics.LLM_TIMEOUT_SECONDS.set_function(self.timeout.current, backend=name)
+
+    def _request(self, prompt, max_tokens, temperature, timeout):
+        raise NotImplementedError
+
+    async def _request_async(self, session, prompt, max_tokens, temperature, timeout):
+        raise NotImplementedError
+
+    def _call_timeout(self):
+        # Half-open trials get the full timeout so a slow recovery is not mistaken for an outage
+        return self.timeout.max_timeout if self.breaker.state == "half_open" else self.timeout.current()
+
+    def _record(self, outcome, latency, timeout):
+        """Feed one call's outcome into the stats, adaptive timeout, breaker and metrics."""
+        if outcome == "cancelled":
+            # No verdict on the backend; give back a half-open trial slot
+            self.breaker.release()
+        else:
+            self.stats.record(latency, outcome == "success")
+            if outcome == "success":
+                self.timeout.observe(latency)
+                self.breaker.record_success()
+            else:
+                if outcome == "timeout":
+                    self.timeout.observe(timeout)
+                self.breaker.record_failure()
+        metrics.LLM_REQUESTS.inc(backend=self.name, outcome=outcome)
+        metrics.LLM_LATENCY.observe(latency, backend=self.name)
+
+    def call(self, prompt, max_tokens=None, temperature=None):
+        """Return the answer text, or None on any failure (recorded in stats and breaker)."""
+        timeout = self._call_timeout()
+        llm_start = time.perf_counter()
+        outcome = "error"
+        try:
+            text = self._request(prompt, max_tokens, temperature, timeout)
+            outcome = "success"
+            return text
+        except requests.exceptions.Timeout:
+            outcome = "timeout"
+            print(f"LLM backend {self.name} timeout after {timeout:.1f}s")
+            return None
+        except Exception as e:
+            print(f"LLM backend {self.name} error: {e}")
+            return None
+        finally:
+            self._record(outcome, time.perf_counter() - llm_start, timeout)
+
+    async def call_async(self, session, prompt, max_tokens=None, temperature=None):
+        """call() on the event loop with an aiohttp ClientSession; a cancelled call is not a failure."""
+        timeout = self._call_timeout()
+        llm_start = time.perf_counter()
+        outcome = "error"
+        try:
+            text = await self._request_async(session, prompt, max_tokens, temperature, timeout)
+            outcome = "success"
+            return text
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            print(f"LLM backend {self.name} timeout after {timeout:.1f}s")
+            return None
+        except Exception as e:
+            print(f"LLM backend {self.name} error: {e}")
+            return None
+        finally:
+            self._record(outcome, time.perf_counter() - llm_start, timeout)
+
+
+async def _post_json(session, url, payload, timeout, headers=None):
+    """POST payload with aiohttp and return the JSON answer; non-200 answers raise LLMBackendError."""
+    import aiohttp
+
+    async with session.post(url, headers=headers, json=payload,
+                            timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+        if response.status != 200:
+            raise LLMBackendError(f"{response.status} - {(await response.text())[:200]}")
+        return await response.json(content_type=None)
+
+
+class ChatCompletionsBackend(LLMBackend):
+    """OpenAI-style /chat/completions endpoint (Thai LLM, vLLM, LM Studio, ...)."""
+
+    def __init__(self, name, url, model, headers=None, timeout=None, breaker=None):
+        super().__init__(name, timeout, breaker)
+        self.url = url
+        self.model = model
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+
+    def _payload(self, prompt, max_tokens, temperature):
+        payload = {"model": self.model, "messages": [{"role": "user", "content": prompt}]}
+        if max_tokens is not None:
+            payload["max_tokens"] = max_tokens
+        if temperature is not None:
+            payload["temperature"] = temperature
+        return payload
+
+    @staticmethod
+    def _answer(result):
+        if not result.get("choices"):
+            raise LLMBackendError(f"unexpected response structure: {str(result)[:200]}")
+        return result["choices"][0]["message"]["content"]
+
+    def _request(self, prompt, max_tokens, temperature, timeout):
+        response = requests.post(self.url, headers=self.headers, json=self._payload(prompt, max_tokens, temperature),
+                                 timeout=timeout)
+        if response.status_code != 200:
+            raise LLMBackendError(f"{response.status_code} - {response.text[:200]}")
+        return self._answer(response.json())
+
+    async def _request_async(self, session, prompt, max_tokens, temperature, timeout):
+        return self._answer(await _post_json(
+            session, self.url, self._payload(prompt, max_tokens, temperature), timeout, self.headers))
+
+
+class OllamaBackend(LLMBackend):
+    """Local Ollama server (/api/generate, non-streaming)."""
+
+    def __init__(self, name, url, model, timeout=None, breaker=None):
+        super().__init__(name, timeout, breaker)
+        self.url = url.rstrip("/")
+        self.model = model
+
+    def _payload(self, prompt, max_tokens, temperature):
+        payload = {"model": self.model, "prompt": prompt, "stream": False}
+        options = {}
+        if max_tokens is not None:
+            options["num_predict"] = max_tokens
+        if temperature is not None:
+            options["temperature"] = temperature
+        if options:
+            payload["options"] = options
+        return payload
+
+    @staticmethod
+    def _answer(result):
+        text = result.get("response")
+        if text is None:
+            raise LLMBackendError("response field missing")
+        return text
+
+    def _request(self, prompt, max_tokens, temperature, timeout):
+        response = requests.post(f"{self.url}/api/generate", json=self._payload(prompt, max_tokens, temperature),
+                                 timeout=timeout)
+        if response.status_code != 200:
+            raise LLMBackendError(f"{response.status_code} - {response.text[:200]}")
+        return self._answer(response.json())
+
+    async def _request_async(self, session, prompt, max_tokens, temperature, timeout):
+        return self._answer(await _post_json(
+            session, f"{self.url}/api/generate", self._payload(prompt, max_tokens, temperature), timeout))
+
+
+class LLMRouter:
+    """Sends each prompt to the backends in priority order with hedging and failover."""
+
+    def __init__(self, backends, hedge=True, hedge_percentile=95.0, hedge_min_samples=20, max_workers=32):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        self.backends = list(backends)
+        self.hedge = hedge and len(self.backends) > 1
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._executor = None
+        # Hedged / failed-over asyncio calls still running after complete_async() returned
+        self._background = set()
+        if len(self.backends) > 1:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+
+    def _next_backend(self, remaining):
+        """Pop the next backend whose circuit lets a request through."""
+        while remaining:
+            backend = remaining.pop(0)
+            if backend.breaker.allow():
+                return backend
+            metrics.LLM_CIRCUIT_REJECTIONS.inc(backend=backend.name)
+        return None
+
+    def _hedge_delay(self, backend):
+        if not self.hedge:
+            return None
+        return backend.stats.percentile(self.hedge_percentile, self.hedge_min_samples)
+
+    def complete(self, prompt, max_tokens=None, temperature=None):
+        """
+        Ask the backends for an answer to one user-role prompt.
+
+        Returns:
+            LLMResult: (text, backend name), or None if every backend failed or is open
+        """
+        remaining = list(self.backends)
+        backend = self._next_backend(remaining)
+        if backend is None:
+            print("All LLM backends unavailable (circuit open)")
+            return None
+
+        if self._executor is None:
+            text = backend.call(prompt, max_tokens, temperature)
+            return LLMResult(text, backend.name) if text is not None else None
+
+        pending = {}
+        hedged = False
+        hedge_at = None
+        while backend is not None or pending:
+            if backend is not None:
+                pending[self._executor.submit(backend.call, prompt, max_tokens, temperature)] = backend
+                if not hedged and remaining:
+                    delay = self._hedge_delay(backend)
+                    hedge_at = time.monotonic() + delay if delay is not None else None
+                backend = None
+
+            timeout = max(0.0, hedge_at - time.monotonic()) if hedge_at is not None else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Slower than its p95: race a copy on the next backend
+                hedge_at = None
+                hedged = True
+                backend = self._next_backend(remaining)
+                if backend is not None:
+                    metrics.LLM_HEDGES.inc(backend=backend.name)
+                    print(f"Hedging slow LLM request to {backend.name}")
+                continue
+
+            for future in done:
+                source = pending.pop(future)
+                text = future.result()
+                if text is not None:
+                    # A losing hedged request finishes in the background and only updates stats
+                    return LLMResult(text, source.name)
+            if not pending:
+                hedge_at = None
+                backend = self._next_backend(remaining)
+                if backend is not None:
+                    print(f"Failing over to LLM backend {backend.name}")
+        return None
+
+    async def complete_async(self, session, prompt, max_tokens=None, temperature=None):
+        """
+        complete() for the event loop: backends are called with aiohttp on `session`.
+
+        Returns:
+            LLMResult: (text, backend name), or None if every backend failed or is open
+        """
+        remaining = list(self.backends)
+        backend = self._next_backend(remaining)
+        if backend is None:
+            print("All LLM backends unavailable (circuit open)")
+            return None
+
+        if len(self.backends) == 1:
+            text = await backend.call_async(session, prompt, max_tokens, temperature)
+            return LLMResult(text, backend.name) if text is not None else None
+
+        pending = {}
+        hedged = False
+        hedge_at = None
+        try:
+            while backend is not None or pending:
+                if backend is not None:
+                    task = asyncio.ensure_future(backend.call_async(session, prompt, max_tokens, temperature))
+                    pending[task] = backend
+                    if not hedged and remaining:
+                        delay = self._hedge_delay(backend)
+                        hedge_at = time.monotonic() + delay if delay is not None else None
+                    backend = None
+
+                timeout = max(0.0, hedge_at - time.monotonic()) if hedge_at is not None else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Slower than its p95: race a copy on the next backend
+                    hedge_at = None
+                    hedged = True
+                    backend = self._next_backend(remaining)
+                    if backend is not None:
+                        metrics.LLM_HEDGES.inc(backend=backend.name)
+                        print(f"Hedging slow LLM request to {backend.name}")
+                    continue
+
+                for task in done:
+                    source = pending.pop(task)
+                    text = task.result()
+                    if text is not None:
+                        # A losing hedged request finishes in the background and only updates stats
+                        for loser in pending:
+                            self._background.add(loser)
+                            loser.add_done_callback(self._background.discard)
+                        pending = {}
+                        return LLMResult(text, source.name)
+                if not pending:
+                    hedge_at = None
+                    backend = self._next_backend(remaining)
+                    if backend is not None:
+                        print(f"Failing over to LLM backend {backend.name}")
+            return None
+        finally:
+            # Only reached with calls pending when the caller was cancelled: nobody wants the answer
+            for task in pending:
+                task.cancel()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+def _build_backend(name):
+    timeout = create_adaptive_timeout_from_env()
+    breaker = create_circuit_breaker_from_env(name)
+    if name == "thai_llm":
+        return ChatCompletionsBackend(
+            name,
+            os.getenv("THAI_LLM_URL", "http://thaillm.or.th/api/pathumma/v1/chat/completions"),
+            os.getenv("THAI_LLM_MODEL", "/model"),
+            headers={"apikey": os.getenv("THAI_LLM_API_KEY", "")},
+            timeout=timeout, breaker=breaker)
+    if name == "ollama":
+        return OllamaBackend(
+            name,
+            os.getenv("OLLAMA_URL", "http://localhost:11434"),
+            os.getenv("OLLAMA_MODEL", "llama3.2:1b"),
+            timeout=timeout, breaker=breaker)
+    if name == "openai":
+        api_key = os.getenv("LLM_OPENAI_API_KEY", "")
+        return ChatCompletionsBackend(
+            name,
+            os.getenv("LLM_OPENAI_URL", "http://localhost:8000/v1/chat/completions"),
+            os.getenv("LLM_OPENAI_MODEL", "default"),
+            headers={"Authorization": f"Bearer {api_key}"} if api_key else None,
+            timeout=timeout, breaker=breaker)
+    raise ValueError(f"Unknown LLM backend '{name}' (expected thai_llm, ollama or openai)")
+
+
+def create_llm_router_from_env(default="thai_llm"):
+    """Build the router from LLM_BACKENDS, the LLM_HEDGE_* settings and circuit_breaker.py settings."""
+    names = [name.strip() for name in os.getenv("LLM_BACKENDS", default).split(",") if name.strip()]
+    backends = [_build_backend(name) for name in names]
+    router = LLMRouter(
+        backends,
+        hedge=os.getenv("LLM_HEDGE", "1") == "1",
+        hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+        hedge_min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")),
+    )
+    timeout = backends[0].timeout
+    print(f"LLM router: {' > '.join(names)} (timeout {timeout.min_timeout:g}-{timeout.max_timeout:g}s"
+          f"{' adaptive' if timeout.enabled else ''}, hedging {'on' if router.hedge else 'off'})")
+    return router
@@ -1,8 +1,9 @@
-from flask import Flask, request
+from flask import Flask, request, Response
 from linebot import LineBotApi, WebhookHandler
 from linebot.models import MessageEvent, TextMessage, TextSendMessage, ImageMessage
 import os
-import datetime
+import json
+import time
 import torch
 import torchvision.transforms as transforms
 from PIL import Image
@@ -11,6 +12,13 @@ import torch.nn as nn
 import torch.nn.functional as F
 from dotenv import load_dotenv
 from io import BytesIO
+import metrics
+from event_guard import create_event_guard_from_env
+from intent_router import create_intent_router_from_env
+from image_store import create_image_store_from_env
+from image_writer import create_image_writer_from_env
+from inference_pool import create_pool_from_env
+from warmup import start_warmup_from_env
 
 # ============================================================
 # CRITICAL FIX: Must be set BEFORE importing torch operations
@@ -32,9 +40,16 @@ channel_access_token = os.getenv("CHANNEL_ACCESS_TOKEN")
 if not channel_secret or not channel_access_token:
     raise ValueError("Missing CHANNEL_SECRET or CHANNEL_ACCESS_TOKEN environment variables.")
 
-line_bot_api = LineBotApi(channel_access_token)
+# LINE API endpoints (override only to point at a local stand-in for benchmarking)
+line_api_endpoint = os.getenv("LINE_API_ENDPOINT", "https://api.line.me")
+line_api_data_endpoint = os.getenv("LINE_API_DATA_ENDPOINT", "https://api-data.line.me")
+
+line_bot_api = LineBotApi(channel_access_token, endpoint=line_api_endpoint, data_endpoint=line_api_data_endpoint)
 handler = WebhookHandler(channel_secret)
 
+# Drop LINE redeliveries and per-user floods before any work is done (see event_guard.py)
+event_guard = create_event_guard_from_env()
+
 # Define class names for the prediction
 class_names = ['Afghan_hound', 'African_hunting_dog', 'Airedale', 'American_Staffordshire_terrier', 
                'Appenzeller', 'Australian_terrier', 'Bedlington_terrier', 'Bernese_mountain_dog', 
@@ -60,6 +75,9 @@ class_names = ['Afghan_hound', 'African_hunting_dog', 'Airedale', 'American_Staf
                'standard_poodle', 'standard_schnauzer', 'toy_poodle', 'toy_terrier', 'vizsla', 'whippet', 
                'wire-haired_fox_terrier']
 
+# Greetings, help and breed-name lookups answered locally (see intent_router.py / intents.json)
+intent_router = create_intent_router_from_env(class_names)
+
 # Load the trained model
 print("Loading model...")
 model_ft = models.resnet18(weights='IMAGENET1K_V1')
@@ -78,9 +96,16 @@ transform = transforms.Compose([
     transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
 ])
 
+# Optional: run predict_pil in worker processes (one model per core, images via shared memory)
+# Enable with INFERENCE_PROCESSES=<n>; default 0 keeps inference on the request thread
+inference_pool = create_pool_from_env(backend="torch")
+
 
 def predict_pil(image):
     """Predict dog breed from PIL image."""
+    if inference_pool is not None:
+        return inference_pool.predict_pil(image)
+
     # Ensure image is in RGB mode
     if image.mode != 'RGB':
         image = image.convert('RGB')
@@ -110,69 +135,88 @@ def predict_pil(image):
     ]
 
 
+# Dummy predictions before serving, so the first user does not pay the cold start;
+# GET /ready reports the warm-up state (see warmup.py)
+readiness = start_warmup_from_env(predict_pil)
+
+
 app = Flask(__name__)
 
-# Ensure "images" folder exists
-if not os.path.exists("images"):
-    os.makedirs("images")
+# Store each unique photo once under images/ab/cd/<sha256>.jpg (see image_store.py),
+# written by a background thread after the reply has been sent
+image_store = create_image_store_from_env()
+image_writer = create_image_writer_from_env(image_store, class_names)
 
 @app.route("/", methods=["GET", "POST"])
 def home():
+    webhook_start = time.perf_counter()
+    metrics.QUEUE_DEPTH.inc(queue="webhook")
+    status = "ok"
     try:
         signature = request.headers["X-Line-Signature"]
         body = request.get_data(as_text=True)
         handler.handle(body, signature)
     except Exception as e:
+        status = "error"
         print("Error:", e)
+    finally:
+        metrics.QUEUE_DEPTH.dec(queue="webhook")
+        metrics.WEBHOOK_REQUESTS.inc(status=status)
+        metrics.WEBHOOK_LATENCY.observe(time.perf_counter() - webhook_start)
     
     return "Hello Line Chatbot"
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus-style metrics (counters, latency histograms, queue depths)."""
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+@app.route("/ready", methods=["GET"])
+def ready_endpoint():
+    """Readiness probe: 200 once startup warm-up is done, 503 while warming or if it failed."""
+    return Response(json.dumps(readiness.describe()), status=200 if readiness.ready else 503,
+                    mimetype="application/json")
+
 # Handle text messages
 @handler.add(MessageEvent, message=TextMessage)
 def handle_text_message(event):
+    if not event_guard.admit(event, "text"):
+        return
+    metrics.MESSAGES.inc(type="text")
     text = event.message.text
     print(f"Received text: {text}")
 
-    responses = {
-        "สวัสดี": "สวัสดีครับ ยินดีต้อนรับสู่บริการทำนายสายพันธุ์น้องหมาครับ ส่งรูปน้องหมามาให้ผมทายสายพันธุ์ได้เลยครับ",
-        "ชื่ออะไร": "ผมชื่อไลน์บอทครับ สามารถส่งรูปน้องหมามาให้ผมทายสายพันธุ์ได้เลยครับ",
-    }
-
-    reply_text = responses.get(text, "ส่งรูปเพื่อ ทำนาย 🐶 สายพันธ์น้องหมา มาได้เลยครับ")
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
+    intent = intent_router.route(text)
+    reply_text = intent.reply if intent else "ส่งรูปเพื่อ ทำนาย 🐶 สายพันธ์น้องหมา มาได้เลยครับ"
+    with metrics.STAGE_LATENCY.time(stage="reply"):
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
 
 # Handle image messages
 @handler.add(MessageEvent, message=ImageMessage)
 def handle_image_message(event):
+    if not event_guard.admit(event, "image"):
+        return
+    metrics.MESSAGES.inc(type="image")
     message_id = event.message.id
 
-    # Get current time in the format YYYY_MM_DD_HH_MM_SS
-    timestamp = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-
-    # Construct the image filename with timestamp and message_id
-    image_filename = f"{timestamp}_{message_id}.jpg"
-    image_path = os.path.join("images", image_filename)
-
     try:
         # Download image from LINE server
+        stage_start = time.perf_counter()
         message_content = line_bot_api.get_message_content(message_id)
         
         image_bytes = BytesIO()
-
-        # Save to both disk and memory
-        with open(image_path, "wb") as img_file:
-            for chunk in message_content.iter_content(chunk_size=1024):
-                img_file.write(chunk)      # save to disk
-                image_bytes.write(chunk)   # keep in memory
+        for chunk in message_content.iter_content(chunk_size=1024):
+            image_bytes.write(chunk)
 
         image_bytes.seek(0)
-        print(f"Image saved at: {image_path}")
+        metrics.STAGE_LATENCY.observe(time.perf_counter() - stage_start, stage="download")
 
         # Load image from memory
         image = Image.open(image_bytes).convert("RGB")
         
         # Predict top 3 classes and confidence scores
-        top3_predictions = predict_pil(image)
+        with metrics.STAGE_LATENCY.time(stage="inference"):
+            top3_predictions = predict_pil(image)
         
         print(f"Top 3 Predictions: {top3_predictions}")
         
@@ -184,12 +228,17 @@ def handle_image_message(event):
         print(f"Prediction results:\n{reply_text}")
         
         # Reply to the user
-        line_bot_api.reply_message(
-            event.reply_token, 
-            TextSendMessage(text=f"🐶 สายพันธ์น้องหมา\n📊มีความน่าจะเป็นดังนี้:\n{reply_text}")
-        )
+        with metrics.STAGE_LATENCY.time(stage="reply"):
+            line_bot_api.reply_message(
+                event.reply_token, 
+                TextSendMessage(text=f"🐶 สายพันธ์น้องหมา\n📊มีความน่าจะเป็นดังนี้:\n{reply_text}")
+            )
+
+        # Persist the photo in the background, after the user has their answer (see image_writer.py)
+        image_writer.submit(image_bytes.getvalue(), message_id, event.source.user_id, top3_predictions)
         
     except Exception as e:
+        metrics.HANDLER_ERRORS.inc(type="image")
         print(f"Error in handle_image_message: {e}")
         import traceback
         traceback.print_exc()
@@ -0,0 +1,329 @@
+"""
+Asyncio-native Dog Breed Detection LINE Chatbot (aiohttp)
+Same behaviour as main_enhanced.py (breed prediction + Thai LLM chat/breed info), but
+webhooks are served by one event loop instead of one Waitress thread each:
+
+- LINE content download, reply_message and LLM calls use non-blocking aiohttp; LLM calls
+  go through main_enhanced's LLM router (LLMRouter.complete_async: failover, hedging,
+  circuit breakers and adaptive timeouts per backend, shared with the threaded path)
+- Image decoding + model inference run in a small thread pool (torch releases the GIL)
+- CSV logging and image saving run in a separate I/O thread pool
+
+so a single process can hold hundreds of slow LLM conversations at once.
+
+Run:
+    python main_async.py
+    # or
+    python -m aiohttp.web -H 0.0.0.0 -P 5000 main_async:init_app
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import aiohttp
+from aiohttp import web
+from linebot import WebhookParser
+from linebot.models import MessageEvent, TextMessage, ImageMessage
+from PIL import Image
+
+import metrics
+from singleflight import AsyncSingleFlight, request_key
+from model_registry import admin_authorized
+from admission import Shed
+# Reuse the model, prompts, parsing and logging from the threaded entry point
+import main_enhanced as bot
+
+# Async server configuration
+inference_workers = int(os.getenv("INFERENCE_WORKERS", "2"))
+io_workers = int(os.getenv("IO_WORKERS", "4"))
+http_connection_limit = int(os.getenv("HTTP_CONNECTION_LIMIT", "200"))
+
+parser = WebhookParser(bot.channel_secret)
+llm_flights = AsyncSingleFlight("thai_llm")
+inference_executor = ThreadPoolExecutor(max_workers=inference_workers, thread_name_prefix="inference")
+io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="io")
+
+
+class LineAPIError(Exception):
+    """Raised when the LINE Messaging API answers with a non-200 status."""
+
+
+async def run_in_pool(executor, queue_name, fn, *args):
+    """Run a blocking function in a thread pool, tracking its queue depth."""
+    metrics.QUEUE_DEPTH.inc(queue=queue_name)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    finally:
+        metrics.QUEUE_DEPTH.dec(queue=queue_name)
+
+
+# ============================================================
+# Non-blocking LINE and LLM clients
+# ============================================================
+async def get_message_content(session, message_id):
+    """Download the binary content of a LINE message."""
+    url = f"{bot.line_api_data_endpoint}/v2/bot/message/{message_id}/content"
+    headers = {"Authorization": f"Bearer {bot.channel_access_token}"}
+    async with session.get(url, headers=headers) as response:
+        if response.status != 200:
+            raise LineAPIError(f"get_message_content failed: {response.status} {await response.text()}")
+        return await response.read()
+
+
+async def reply_message(session, reply_token, text):
+    """Send a single text reply."""
+    url = f"{bot.line_api_endpoint}/v2/bot/message/reply"
+    headers = {"Authorization": f"Bearer {bot.channel_access_token}"}
+    payload = {"replyToken": reply_token, "messages": [{"type": "text", "text": text}]}
+    with metrics.STAGE_LATENCY.time(stage="reply"):
+        async with session.post(url, headers=headers, json=payload) as response:
+            if response.status != 200:
+                raise LineAPIError(f"reply_message failed: {response.status} {await response.text()}")
+
+
+async def ask_thai_llm(session, user_message, max_tokens=2048, temperature=0.3):
+    """
+    Async version of main_enhanced.ask_thai_llm
+    Identical requests already in flight share one upstream call (see singleflight.py).
+
+    Returns:
+        tuple: (full_response_with_think, thinking_content, clean_response) or (None, None, None) if error
+    """
+    _, payload = bot.build_thai_llm_request(user_message, max_tokens, temperature)
+    return await llm_flights.do(request_key(payload), call_thai_llm, session, user_message, max_tokens, temperature)
+
+
+async def call_thai_llm(session, user_message, max_tokens, temperature):
+    """Send one request to bot.llm_router's backends (same breakers and metrics as main_enhanced.py)."""
+    print(f"Calling Thai LLM API for: {user_message[:50]}...")
+    return bot.unpack_llm_result(await bot.llm_router.complete_async(session, user_message, max_tokens, temperature))
+
+
+# ============================================================
+# Blocking helpers (run in thread pools)
+# ============================================================
+def decode_and_predict(image_bytes):
+    """
+    Decode the JPEG and predict top 3 breeds (runs in the inference pool).
+
+    Returns:
+        tuple: (top3_predictions, is_dog, embedding or None, similar dogs)
+    """
+    image = Image.open(BytesIO(image_bytes)).convert("RGB")
+    with metrics.STAGE_LATENCY.time(stage="inference"):
+        top3_predictions = bot.predict_pil(image)
+    is_dog = bot.dog_gate.is_dog(top3_predictions)
+    # The embedding is captured per thread, so it is read in this same worker thread
+    embedding, similar = bot.find_similar_dogs()
+    return top3_predictions, is_dog, embedding, similar
+
+
+# ============================================================
+# Event handlers
+# ============================================================
+async def handle_text_message(session, event):
+    metrics.MESSAGES.inc(type="text")
+    start_time = time.time()
+
+    text = event.message.text
+    user_id = event.source.user_id
+
+    print(f"Received text from {user_id}: {text}")
+
+    thinking_content = ''
+
+    # Resolve greetings, help and breed lookups locally, then try a cached answer to a near-duplicate question
+    intent = bot.intent_router.route(text)
+    cached_answer = None if intent else bot.faq_cache.lookup(text)
+    if intent:
+        reply_text = intent.reply
+    elif cached_answer is not None:
+        reply_text = cached_answer
+    else:
+        # Use Thai LLM API for general chat
+        with metrics.STAGE_LATENCY.time(stage="llm"):
+            full_response, thinking, clean_response = await ask_thai_llm(session, text)
+
+        if clean_response:
+            reply_text = clean_response
+            thinking_content = thinking or ''
+            bot.faq_cache.add(text, clean_response)
+        else:
+            reply_text = bot.LLM_UNAVAILABLE_REPLY
+
+    # Send reply (without <think> tags)
+    await reply_message(session, event.reply_token, reply_text)
+
+    response_time = time.time() - start_time
+    await run_in_pool(io_executor, "io", bot.log_conversation,
+                      user_id, text, reply_text, response_time, thinking_content)
+
+
+async def handle_image_message(session, event):
+    metrics.MESSAGES.inc(type="image")
+    start_time = time.time()
+
+    try:
+        # Same admission limits as main_enhanced.py (see admission.py)
+        async with bot.admission.stage_async("pipeline"):
+            await process_image_message(session, event, start_time)
+    except Shed:
+        await reply_busy(session, event, start_time)
+
+
+async def reply_busy(session, event, start_time):
+    """Fast degraded reply when admission control sheds an image."""
+    try:
+        await reply_message(session, event.reply_token, bot.BUSY_REPLY)
+        await run_in_pool(io_executor, "io", bot.log_conversation,
+                          event.source.user_id, "[IMAGE] Busy", bot.BUSY_REPLY, time.time() - start_time)
+    except Exception as e:
+        print(f"Error sending busy reply: {e}")
+
+
+async def process_image_message(session, event, start_time):
+    """Download, predict, ask the LLM and reply (each stage behind admission control)."""
+    message_id = event.message.id
+    user_id = event.source.user_id
+
+    try:
+        # Download image from LINE server
+        async with bot.admission.stage_async("download"):
+            stage_start = time.perf_counter()
+            image_bytes = await get_message_content(session, message_id)
+            metrics.STAGE_LATENCY.observe(time.perf_counter() - stage_start, stage="download")
+
+        # Decode + predict off the event loop
+        async with bot.admission.stage_async("inference"):
+            top3_predictions, is_dog, embedding, similar = await run_in_pool(
+                inference_executor, "inference", decode_and_predict, image_bytes)
+        print(f"Top 3 Predictions: {top3_predictions}")
+
+        initial_reply = bot.format_similar_dogs(bot.format_prediction_reply(top3_predictions), similar)
+        thinking_content, breed_info = None, None
+        if is_dog:
+            # Get detailed information from LLM about the breeds (skipped under load: prediction only)
+            async with bot.admission.try_stage_async("llm") as admitted:
+                if admitted:
+                    prompt = bot.build_breed_info_prompt(top3_predictions)
+                    with metrics.STAGE_LATENCY.time(stage="llm"):
+                        _, thinking_content, breed_info = await ask_thai_llm(
+                            session, prompt, max_tokens=1500, temperature=0.3)
+                else:
+                    print("LLM stage saturated, replying with the prediction only")
+        else:
+            # Maybe not a dog (see dog_gate.py): prediction with a caveat, no LLM call
+            initial_reply = f"{bot.NOT_A_DOG_CAVEAT}\n\n{initial_reply}"
+        full_reply = bot.combine_breed_reply(initial_reply, breed_info)
+        await reply_message(session, event.reply_token, full_reply)
+        # Non-blocking hand-off to the image writer thread (see image_writer.py)
+        bot.image_writer.submit(image_bytes, message_id, user_id, top3_predictions, embedding)
+
+        response_time = time.time() - start_time
+        await run_in_pool(io_executor, "io", bot.log_conversation,
+                          user_id, f"[IMAGE] {message_id}", full_reply, response_time, thinking_content or '')
+
+    except Shed:
+        raise
+    except Exception as e:
+        metrics.HANDLER_ERRORS.inc(type="image")
+        print(f"Error in handle_image_message: {e}")
+
+        try:
+            await reply_message(session, event.reply_token, bot.IMAGE_ERROR_REPLY)
+            response_time = time.time() - start_time
+            await run_in_pool(io_executor, "io", bot.log_conversation,
+                              user_id, "[IMAGE] Error", bot.IMAGE_ERROR_REPLY, response_time)
+        except Exception:
+            pass
+
+
+async def dispatch(session, event):
+    if not isinstance(event, MessageEvent):
+        return
+    if isinstance(event.message, TextMessage):
+        if bot.event_guard.admit(event, "text"):
+            await handle_text_message(session, event)
+    elif isinstance(event.message, ImageMessage):
+        if bot.event_guard.admit(event, "image"):
+            await handle_image_message(session, event)
+
+
+# ============================================================
+# aiohttp application
+# ============================================================
+async def home(request):
+    webhook_start = time.perf_counter()
+    metrics.QUEUE_DEPTH.inc(queue="webhook")
+    status = "ok"
+    try:
+        if request.method == "POST":
+            signature = request.headers["X-Line-Signature"]
+            body = await request.text()
+            events = parser.parse(body, signature)
+            await asyncio.gather(*(dispatch(request.app["http"], event) for event in events))
+    except Exception as e:
+        status = "error"
+        print("Error:", e)
+    finally:
+        metrics.QUEUE_DEPTH.dec(queue="webhook")
+        metrics.WEBHOOK_REQUESTS.inc(status=status)
+        metrics.WEBHOOK_LATENCY.observe(time.perf_counter() - webhook_start)
+
+    return web.Response(text="Hello Line Chatbot - Async Edition")
+
+
+async def metrics_endpoint(request):
+    """Prometheus-style metrics (counters, latency histograms, queue depths)."""
+    return web.Response(body=metrics.render().encode("utf-8"), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+async def ready_endpoint(request):
+    """Readiness probe: 200 once startup warm-up is done, 503 while warming or if it failed."""
+    return web.json_response(bot.readiness.describe(), status=200 if bot.readiness.ready else 503)
+
+
+async def reload_model_endpoint(request):
+    """Load, warm and swap in resnet18_best.pth in the background (requires ADMIN_TOKEN)."""
+    if not admin_authorized(request.headers.get("Authorization")):
+        return web.Response(status=403, text="Forbidden")
+    started = bot.model_registry.reload_in_background()
+    return web.json_response({"reloading": True, "started": started, "version": bot.model_registry.version},
+                             status=202)
+
+
+async def model_status_endpoint(request):
+    """Serving model version, draining versions and the last reload error."""
+    if not admin_authorized(request.headers.get("Authorization")):
+        return web.Response(status=403, text="Forbidden")
+    return web.json_response(bot.model_registry.describe())
+
+
+async def on_startup(app):
+    connector = aiohttp.TCPConnector(limit=http_connection_limit)
+    app["http"] = aiohttp.ClientSession(connector=connector)
+
+
+async def on_cleanup(app):
+    await app["http"].close()
+    inference_executor.shutdown(wait=False)
+    io_executor.shutdown(wait=True)
+
+
+def init_app(argv=None):
+    app = web.Application()
+    app.router.add_route("*", "/", home)
+    app.router.add_get("/metrics", metrics_endpoint)
+    app.router.add_get("/ready", ready_endpoint)
+    app.router.add_post("/admin/reload-model", reload_model_endpoint)
+    app.router.add_get("/admin/model", model_status_endpoint)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(init_app(), host='0.0.0.0', port=int(os.getenv("PORT", "5000")))
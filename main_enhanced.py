@@ -1,4 +1,4 @@
-from flask import Flask, request
+from flask import Flask, request, Response
 from linebot import LineBotApi, WebhookHandler
 from linebot.models import MessageEvent, TextMessage, TextSendMessage, ImageMessage
 import os
@@ -11,7 +11,22 @@ import torch.nn as nn
 import torch.nn.functional as F
 from dotenv import load_dotenv
 from io import BytesIO
-import requests
+import metrics
+from event_guard import create_event_guard_from_env
+from singleflight import SingleFlight, request_key
+from llm_router import create_llm_router_from_env
+from faq_cache import create_faq_cache_from_env
+from intent_router import create_intent_router_from_env
+from image_store import create_image_store_from_env
+from image_writer import create_image_writer_from_env
+from embedding_index import TorchEmbeddingCapture, create_embedding_index_from_env
+from dog_gate import create_dog_gate_from_env
+from cascade import create_cascade_from_env
+from model_registry import admin_authorized, create_model_registry_from_env, warn_not_reloaded
+from tta import create_tta_from_env
+from inference_pool import create_pool_from_env, warn_bypassed
+from admission import Shed, create_admission_from_env
+from warmup import batch_sizes_from_env, start_warmup_from_env, warm_forward, warm_rounds
 import json
 import csv
 import time
@@ -34,17 +49,23 @@ load_dotenv()
 channel_secret = os.getenv("CHANNEL_SECRET")
 channel_access_token = os.getenv("CHANNEL_ACCESS_TOKEN")
 
-# Thai LLM API configuration
-thai_llm_url = os.getenv("THAI_LLM_URL", "http://thaillm.or.th/api/pathumma/v1/chat/completions")
+# Thai LLM API configuration (the LLM_BACKENDS endpoints themselves are read by llm_router.py)
 thai_llm_api_key = os.getenv("THAI_LLM_API_KEY", "----------")
 thai_llm_model = os.getenv("THAI_LLM_MODEL", "/model")
 
 if not channel_secret or not channel_access_token:
     raise ValueError("Missing CHANNEL_SECRET or CHANNEL_ACCESS_TOKEN environment variables.")
 
-line_bot_api = LineBotApi(channel_access_token)
+# LINE API endpoints (override only to point at a local stand-in for benchmarking)
+line_api_endpoint = os.getenv("LINE_API_ENDPOINT", "https://api.line.me")
+line_api_data_endpoint = os.getenv("LINE_API_DATA_ENDPOINT", "https://api-data.line.me")
+
+line_bot_api = LineBotApi(channel_access_token, endpoint=line_api_endpoint, data_endpoint=line_api_data_endpoint)
 handler = WebhookHandler(channel_secret)
 
+# Drop LINE redeliveries and per-user floods before any work is done (see event_guard.py)
+event_guard = create_event_guard_from_env()
+
 # Define class names for the prediction
 class_names = ['Afghan_hound', 'African_hunting_dog', 'Airedale', 'American_Staffordshire_terrier', 
                'Appenzeller', 'Australian_terrier', 'Bedlington_terrier', 'Bernese_mountain_dog', 
@@ -70,15 +91,35 @@ class_names = ['Afghan_hound', 'African_hunting_dog', 'Airedale', 'American_Staf
                'standard_poodle', 'standard_schnauzer', 'toy_poodle', 'toy_terrier', 'vizsla', 'whippet', 
                'wire-haired_fox_terrier']
 
+# Greetings, help and breed-name lookups answered locally (see intent_router.py / intents.json)
+intent_router = create_intent_router_from_env(class_names)
+
 # Load the trained model
-print("Loading dog breed model...")
-model_ft = models.resnet18(weights='IMAGENET1K_V1')
-num_ftrs = model_ft.fc.in_features
-model_ft.fc = nn.Linear(num_ftrs, len(class_names))
+def load_model(path):
+    # No ImageNet weights: every parameter is overwritten by the checkpoint
+    model_ft = models.resnet18(weights=None)
+    num_ftrs = model_ft.fc.in_features
+    model_ft.fc = nn.Linear(num_ftrs, len(class_names))
+
+    state_dict = torch.load(path, map_location='cpu', weights_only=False)
+    model_ft.load_state_dict(state_dict)
+    model_ft.eval()
+    return model_ft
+
+def warm_model(model_ft):
+    """Dummy batches before a reloaded model serves; rejects checkpoints with the wrong classes."""
+    with torch.no_grad():
+        outputs = model_ft(torch.zeros(1, 3, 224, 224))
+        if tuple(outputs.shape) != (1, len(class_names)):
+            raise ValueError(f"model outputs {tuple(outputs.shape)}, expected (1, {len(class_names)})")
+        # Only called on reload, so tta (set up below) exists by then
+        batch_sizes = batch_sizes_from_env(tta.batch_size if tta is not None else 0)
+        warm_forward(lambda batch: model_ft(torch.from_numpy(batch)), batch_sizes, warm_rounds())
 
-state_dict = torch.load('resnet18_best.pth', map_location='cpu', weights_only=False)
-model_ft.load_state_dict(state_dict)
-model_ft.eval()
+print("Loading dog breed model...")
+# predict_pil takes the model from the registry, so resnet18_best.pth can be replaced
+# without a restart (MODEL_WATCH_INTERVAL or POST /admin/reload-model, see model_registry.py)
+model_registry = create_model_registry_from_env('resnet18_best.pth', load_model, warm=warm_model)
 print("Dog breed model loaded successfully!")
 
 # Define preprocessing transformations
@@ -88,10 +129,46 @@ transform = transforms.Compose([
     transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
 ])
 
+# Optional: run predict_pil in worker processes (one model per core, images via shared memory)
+# Enable with INFERENCE_PROCESSES=<n>; default 0 keeps inference on the request thread
+inference_pool = create_pool_from_env(backend="torch")
+if inference_pool is not None:
+    warn_not_reloaded("the INFERENCE_PROCESSES workers, which serve every prediction")
+
+# Optional (CASCADE=1): int8 ONNX copy of this ResNet18 first, the full model only when it is unsure (see cascade.py)
+def full_forward(batch):
+    with torch.no_grad(), model_registry.acquire() as model_ft:
+        return model_ft(torch.from_numpy(batch)).numpy()
+
+cascade = create_cascade_from_env(full_forward, 'resnet18_best.pth')
+if cascade is not None:
+    warn_not_reloaded("the cascade's int8 fast model (CASCADE=1)")
+
+# Optional (TTA=1): flipped / cropped views in one batch when the first pass is unsure (see tta.py)
+tta = create_tta_from_env(full_forward, first_pass=cascade.predict_probs if cascade else None)
+
+# Admission control: bounded in-flight work per image pipeline stage (see admission.py)
+admission = create_admission_from_env()
+
+# Set up with the similar-dogs index below (EMBEDDINGS=1), after warm-up
+embedding_capture = None
+
 # Create logs directory if it doesn't exist
 if not os.path.exists("logs"):
     os.makedirs("logs")
 
+# Fallback replies
+LLM_UNAVAILABLE_REPLY = "ขอโทษครับ ขณะนี้ระบบตอบคำถามไม่สามารถใช้งานได้ 🙏\n\nคุณสามารถส่งรูปน้องหมามาให้ผมทายสายพันธุ์ได้เลยครับ 🐶"
+IMAGE_ERROR_REPLY = "ขอโทษครับ เกิดข้อผิดพลาดในการทำนาย กรุณาลองใหม่อีกครั้ง"
+BUSY_REPLY = "ขณะนี้มีผู้ใช้งานจำนวนมาก 🙏 กรุณาส่งรูปน้องหมาอีกครั้งในอีกสักครู่นะครับ 🐶"
+NOT_A_DOG_CAVEAT = "🤔 รูปนี้อาจไม่ใช่น้องหมานะครับ ผลทายด้านล่างจึงอาจไม่แม่นยำ"
+
+# Photos that may not be dogs get a caveat and skip the LLM call (see dog_gate.py)
+dog_gate = create_dog_gate_from_env()
+
+# Serve cached LLM answers for near-duplicate questions (see faq_cache.py)
+faq_cache = create_faq_cache_from_env(exclude_answers=[LLM_UNAVAILABLE_REPLY, IMAGE_ERROR_REPLY, BUSY_REPLY])
+
 
 def extract_think_tags(text):
     """
@@ -155,11 +232,22 @@ def log_conversation(user_id, question, answer, response_time, thinking_content=
             
         print(f"Logged to {csv_filename}: {user_id} - {question[:30]}...")
     except Exception as e:
+        metrics.LOG_WRITE_FAILURES.inc()
         print(f"Error logging to CSV: {e}")
 
 
 def predict_pil(image):
     """Predict dog breed from PIL image."""
+    if embedding_capture is not None:
+        # Only this call's forward passes may leave an embedding (see TorchEmbeddingCapture)
+        embedding_capture.reset()
+    if inference_pool is not None:
+        return inference_pool.predict_pil(image)
+    if tta is not None:
+        return tta.predict_pil(image)
+    if cascade is not None:
+        return cascade.predict_pil(image)
+
     # Ensure image is in RGB mode
     if image.mode != 'RGB':
         image = image.convert('RGB')
@@ -168,7 +256,7 @@ def predict_pil(image):
     input_tensor = transform(image).unsqueeze(0)
     
     # Make prediction
-    with torch.no_grad():
+    with torch.no_grad(), model_registry.acquire() as model_ft:
         outputs = model_ft(input_tensor)
         probs = F.softmax(outputs, dim=1)
         top3_conf, top3_idx = torch.topk(probs, 3)
@@ -189,9 +277,35 @@ def predict_pil(image):
     ]
 
 
+def build_thai_llm_request(user_message, max_tokens=2048, temperature=0.3):
+    """Build the (headers, payload) pair for a Thai LLM chat completion call."""
+    headers = {
+        "Content-Type": "application/json",
+        "apikey": thai_llm_api_key
+    }
+    
+    payload = {
+        "model": thai_llm_model,
+        "messages": [
+            {"role": "user", "content": user_message}
+        ],
+        "max_tokens": max_tokens,
+        "temperature": temperature
+    }
+    return headers, payload
+
+
+# Thai LLM first; LLM_BACKENDS can add fallbacks such as a local Ollama (see llm_router.py)
+llm_router = create_llm_router_from_env(default="thai_llm")
+
+# Identical Thai LLM requests in flight share one upstream call
+llm_flights = SingleFlight("thai_llm")
+
+
 def ask_thai_llm(user_message, max_tokens=2048, temperature=0.3):
     """
     Ask Thai LLM API a question
+    Identical requests already in flight share one upstream call (see singleflight.py).
     
     Args:
         user_message: User's question/message
@@ -201,72 +315,45 @@ def ask_thai_llm(user_message, max_tokens=2048, temperature=0.3):
     Returns:
         tuple: (full_response_with_think, thinking_content, clean_response) or (None, None, None) if error
     """
-    try:
-        headers = {
-            "Content-Type": "application/json",
-            "apikey": thai_llm_api_key
-        }
-        
-        payload = {
-            "model": thai_llm_model,
-            "messages": [
-                {"role": "user", "content": user_message}
-            ],
-            "max_tokens": max_tokens,
-            "temperature": temperature
-        }
-        
-        print(f"Calling Thai LLM API for: {user_message[:50]}...")
-        
-        response = requests.post(
-            thai_llm_url,
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            
-            # Extract response from the API result
-            if 'choices' in result and len(result['choices']) > 0:
-                full_message = result['choices'][0]['message']['content']
-                
-                # Extract thinking and clean text
-                thinking_content, clean_text = extract_think_tags(full_message)
-                
-                print(f"Thai LLM response received: {clean_text[:50]}...")
-                if thinking_content:
-                    print(f"Thinking process captured: {thinking_content[:50]}...")
-                
-                return full_message, thinking_content, clean_text
-            else:
-                print(f"Unexpected API response structure: {result}")
-                return None, None, None
-        else:
-            print(f"Thai LLM API error: {response.status_code} - {response.text}")
-            return None, None, None
-            
-    except requests.exceptions.Timeout:
-        print("Thai LLM API timeout")
-        return None, None, None
-    except Exception as e:
-        print(f"Thai LLM error: {e}")
-        import traceback
-        traceback.print_exc()
+    _, payload = build_thai_llm_request(user_message, max_tokens, temperature)
+    return llm_flights.do(request_key(payload), call_thai_llm, user_message, max_tokens, temperature)
+
+
+def call_thai_llm(user_message, max_tokens=2048, temperature=0.3):
+    """Send one request to the LLM backends (use ask_thai_llm, which coalesces identical calls)."""
+    print(f"Calling Thai LLM API for: {user_message[:50]}...")
+    return unpack_llm_result(llm_router.complete(user_message, max_tokens, temperature))
+
+
+def unpack_llm_result(result):
+    """
+    Split a router answer (LLMResult or None) into the ask_thai_llm tuple.
+
+    Returns:
+        tuple: (full_response_with_think, thinking_content, clean_response) or (None, None, None)
+    """
+    if result is None:
         return None, None, None
 
+    # Extract thinking and clean text
+    thinking_content, clean_text = extract_think_tags(result.text)
 
-def get_dog_breed_info(breed_name, top3_breeds):
+    print(f"LLM response received from {result.backend}: {clean_text[:50]}...")
+    if thinking_content:
+        print(f"Thinking process captured: {thinking_content[:50]}...")
+
+    return result.text, thinking_content, clean_text
+
+
+def build_breed_info_prompt(top3_breeds):
     """
-    Ask Thai LLM for detailed information about the top breed and comparison with other breeds.
+    Build the Thai LLM prompt asking about the top breed and comparing all three.
     
     Args:
-        breed_name: The top predicted breed name
         top3_breeds: List of tuples [(breed1, conf1), (breed2, conf2), (breed3, conf3)]
     
     Returns:
-        str: LLM response about the breed
+        str: Prompt text
     """
     # Format breed names nicely (replace underscores with spaces)
     formatted_breeds = [(name.replace('_', ' '), conf) for name, conf in top3_breeds]
@@ -291,6 +378,21 @@ def get_dog_breed_info(breed_name, top3_breeds):
    - {formatted_breeds[2][0]}
 
 ตอบเป็นภาษาไทยแบบกระชับและเข้าใจง่าย ไม่เกิน 500 คำ"""
+    return prompt
+
+
+def get_dog_breed_info(breed_name, top3_breeds):
+    """
+    Ask Thai LLM for detailed information about the top breed and comparison with other breeds.
+    
+    Args:
+        breed_name: The top predicted breed name
+        top3_breeds: List of tuples [(breed1, conf1), (breed2, conf2), (breed3, conf3)]
+    
+    Returns:
+        str: LLM response about the breed
+    """
+    prompt = build_breed_info_prompt(top3_breeds)
 
     # Call Thai LLM
     full_response, thinking, clean_response = ask_thai_llm(prompt, max_tokens=1500, temperature=0.3)
@@ -301,26 +403,129 @@ def get_dog_breed_info(breed_name, top3_breeds):
         return None, None
 
 
+def format_prediction_reply(top3_predictions):
+    """Format the top-3 predictions as the first part of the image reply."""
+    prediction_text = "\n".join(
+        [f"{i+1}. {class_name.replace('_', ' ')} ({confidence*100:.2f}%)" 
+         for i, (class_name, confidence) in enumerate(top3_predictions)]
+    )
+    return f"🐶 สายพันธ์น้องหมา\n📊 มีความน่าจะเป็นดังนี้:\n{prediction_text}"
+
+
+def find_similar_dogs():
+    """
+    Take the embedding of this thread's last predict_pil call and find similar dogs seen before.
+    Always call it after predict_pil so the embedding is consumed with its own photo.
+
+    Returns:
+        tuple: (embedding or None, [SimilarDog, ...])
+    """
+    if embedding_capture is None:
+        return None, []
+    embedding = embedding_capture.pop()
+    if embedding is None or not similar_dogs:
+        return embedding, []
+    return embedding, embedding_index.search(embedding, similar_dogs, similar_dogs_min_similarity)
+
+
+def format_similar_dogs(initial_reply, matches):
+    """Append the "dogs that look like yours" list (if any) to the prediction reply."""
+    if not matches:
+        return initial_reply
+    lines = "\n".join(
+        f"{i+1}. {match.breed.replace('_', ' ')} (คล้ายกัน {match.similarity*100:.0f}%)"
+        for i, match in enumerate(matches))
+    return f"{initial_reply}\n\n🐾 น้องหมาที่หน้าตาคล้ายกันที่เคยส่งมา:\n{lines}"
+
+
+def combine_breed_reply(initial_reply, breed_info):
+    """Append the LLM breed information (if any) to the prediction reply."""
+    if breed_info:
+        return f"{initial_reply}\n\n📖 ข้อมูลเพิ่มเติม:\n{breed_info}"
+    return initial_reply
+
+
+# Dummy batches of the served sizes, then predict_pil, before serving; GET /ready reports
+# the warm-up state (see warmup.py). The pool workers warm their own models.
+readiness = start_warmup_from_env(
+    predict_pil,
+    forward=full_forward if inference_pool is None else None,
+    extra_batch_sizes=(tta.batch_size,) if tta is not None else ())
+
+
 app = Flask(__name__)
 
-# Ensure "images" folder exists
-if not os.path.exists("images"):
-    os.makedirs("images")
+# Store each unique photo once under images/ab/cd/<sha256>.jpg (see image_store.py),
+# written by a background thread after the reply has been sent
+image_store = create_image_store_from_env()
+
+# Optional (EMBEDDINGS=1): keep the 512-d features before model_ft.fc for "similar dogs"
+embedding_index = create_embedding_index_from_env(image_store, class_names)
+embedding_capture = TorchEmbeddingCapture(model_registry.current) if embedding_index is not None else None
+if embedding_capture is not None:
+    model_registry.on_swap(embedding_capture.attach)
+    if cascade is not None:
+        print("⚠️  EMBEDDINGS=1 with CASCADE=1: only photos the fast model escalates reach "
+              "ResNet18, so only those get similar dogs and are indexed")
+if inference_pool is not None:
+    warn_bypassed({"TTA=1": tta, "CASCADE=1": cascade, "EMBEDDINGS=1": embedding_index})
+similar_dogs = int(os.getenv("SIMILAR_DOGS", "3"))
+similar_dogs_min_similarity = float(os.getenv("SIMILAR_DOGS_MIN_SIMILARITY", "0.8"))
+
+image_writer = create_image_writer_from_env(image_store, class_names, embedding_index)
 
 @app.route("/", methods=["GET", "POST"])
 def home():
+    webhook_start = time.perf_counter()
+    metrics.QUEUE_DEPTH.inc(queue="webhook")
+    status = "ok"
     try:
         signature = request.headers["X-Line-Signature"]
         body = request.get_data(as_text=True)
         handler.handle(body, signature)
     except Exception as e:
+        status = "error"
         print("Error:", e)
+    finally:
+        metrics.QUEUE_DEPTH.dec(queue="webhook")
+        metrics.WEBHOOK_REQUESTS.inc(status=status)
+        metrics.WEBHOOK_LATENCY.observe(time.perf_counter() - webhook_start)
     
     return "Hello Line Chatbot"
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus-style metrics (counters, latency histograms, queue depths)."""
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+@app.route("/ready", methods=["GET"])
+def ready_endpoint():
+    """Readiness probe: 200 once startup warm-up is done, 503 while warming or if it failed."""
+    return Response(json.dumps(readiness.describe()), status=200 if readiness.ready else 503,
+                    mimetype="application/json")
+
+@app.route("/admin/reload-model", methods=["POST"])
+def reload_model_endpoint():
+    """Load, warm and swap in resnet18_best.pth in the background (requires ADMIN_TOKEN)."""
+    if not admin_authorized(request.headers.get("Authorization")):
+        return Response("Forbidden", status=403)
+    started = model_registry.reload_in_background()
+    return Response(json.dumps({"reloading": True, "started": started, "version": model_registry.version}),
+                    status=202, mimetype="application/json")
+
+@app.route("/admin/model", methods=["GET"])
+def model_status_endpoint():
+    """Serving model version, draining versions and the last reload error."""
+    if not admin_authorized(request.headers.get("Authorization")):
+        return Response("Forbidden", status=403)
+    return Response(json.dumps(model_registry.describe()), mimetype="application/json")
+
 # Handle text messages
 @handler.add(MessageEvent, message=TextMessage)
 def handle_text_message(event):
+    if not event_guard.admit(event, "text"):
+        return
+    metrics.MESSAGES.inc(type="text")
     start_time = time.time()
     
     text = event.message.text
@@ -328,30 +533,31 @@ def handle_text_message(event):
     
     print(f"Received text from {user_id}: {text}")
 
-    # Predefined responses (optional - for quick replies)
-    quick_responses = {
-        "สวัสดี": "สวัสดีครับ ยินดีที่ได้รู้จักนะครับ 😊",
-        "ชื่ออะไร": "ผมชื่อไลน์บอทครับ สามารถส่งรูปน้องหมามาให้ผมทายสายพันธุ์ได้เลยครับ 🐶",
-    }
-
     thinking_content = ''
     
-    # Check if there's a quick response
-    if text in quick_responses:
-        reply_text = quick_responses[text]
+    # Resolve greetings, help and breed lookups locally, then try a cached answer to a near-duplicate question
+    intent = intent_router.route(text)
+    cached_answer = None if intent else faq_cache.lookup(text)
+    if intent:
+        reply_text = intent.reply
+    elif cached_answer is not None:
+        reply_text = cached_answer
     else:
         # Use Thai LLM API for general chat
-        full_response, thinking, clean_response = ask_thai_llm(text)
+        with metrics.STAGE_LATENCY.time(stage="llm"):
+            full_response, thinking, clean_response = ask_thai_llm(text)
         
         if clean_response:
             reply_text = clean_response
+            faq_cache.add(text, clean_response)
             thinking_content = thinking or ''
         else:
             # Fallback if LLM is not available
-            reply_text = "ขอโทษครับ ขณะนี้ระบบตอบคำถามไม่สามารถใช้งานได้ 🙏\n\nคุณสามารถส่งรูปน้องหมามาให้ผมทายสายพันธุ์ได้เลยครับ 🐶"
+            reply_text = LLM_UNAVAILABLE_REPLY
     
     # Send reply (without <think> tags)
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
+    with metrics.STAGE_LATENCY.time(stage="reply"):
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
     
     # Calculate response time
     response_time = time.time() - start_time
@@ -362,86 +568,111 @@ def handle_text_message(event):
 # Handle image messages
 @handler.add(MessageEvent, message=ImageMessage)
 def handle_image_message(event):
+    if not event_guard.admit(event, "image"):
+        return
+    metrics.MESSAGES.inc(type="image")
     start_time = time.time()
-    
-    message_id = event.message.id
-    user_id = event.source.user_id
 
-    # Get current time in the format YYYY_MM_DD_HH_MM_SS
-    timestamp = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+    try:
+        with admission.stage("pipeline"):
+            process_image_message(event, start_time)
+    except Shed:
+        reply_busy(event, start_time)
 
-    # Construct the image filename with timestamp and message_id
-    image_filename = f"{timestamp}_{message_id}.jpg"
-    image_path = os.path.join("images", image_filename)
+
+def reply_busy(event, start_time):
+    """Fast degraded reply when admission control sheds an image."""
+    try:
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=BUSY_REPLY))
+        log_conversation(event.source.user_id, "[IMAGE] Busy", BUSY_REPLY, time.time() - start_time)
+    except Exception as e:
+        print(f"Error sending busy reply: {e}")
+
+
+def process_image_message(event, start_time):
+    """Download, predict, ask the LLM and reply (each stage behind admission control)."""
+    message_id = event.message.id
+    user_id = event.source.user_id
 
     try:
         # Download image from LINE server
-        message_content = line_bot_api.get_message_content(message_id)
-        
-        image_bytes = BytesIO()
+        with admission.stage("download"):
+            stage_start = time.perf_counter()
+            message_content = line_bot_api.get_message_content(message_id)
 
-        # Save to both disk and memory
-        with open(image_path, "wb") as img_file:
+            image_bytes = BytesIO()
             for chunk in message_content.iter_content(chunk_size=1024):
-                img_file.write(chunk)      # save to disk
-                image_bytes.write(chunk)   # keep in memory
+                image_bytes.write(chunk)
 
-        image_bytes.seek(0)
-        print(f"Image saved at: {image_path}")
+            image_bytes.seek(0)
+            metrics.STAGE_LATENCY.observe(time.perf_counter() - stage_start, stage="download")
 
         # Load image from memory
         image = Image.open(image_bytes).convert("RGB")
         
         # Predict top 3 classes and confidence scores
-        top3_predictions = predict_pil(image)
+        with admission.stage("inference"):
+            with metrics.STAGE_LATENCY.time(stage="inference"):
+                top3_predictions = predict_pil(image)
         
         print(f"Top 3 Predictions: {top3_predictions}")
         
-        # Format the prediction results
-        prediction_text = "\n".join(
-            [f"{i+1}. {class_name.replace('_', ' ')} ({confidence*100:.2f}%)" 
-             for i, (class_name, confidence) in enumerate(top3_predictions)]
-        )
+        # Cats, food and screenshots still get the prediction, with a caveat and no LLM call
+        is_dog = dog_gate.is_dog(top3_predictions)
+        embedding, similar = find_similar_dogs()
         
         # Initial reply with predictions
-        initial_reply = f"🐶 สายพันธ์น้องหมา\n📊 มีความน่าจะเป็นดังนี้:\n{prediction_text}"
+        initial_reply = format_similar_dogs(format_prediction_reply(top3_predictions), similar)
+        if not is_dog:
+            initial_reply = f"{NOT_A_DOG_CAVEAT}\n\n{initial_reply}"
         
-        print(f"Prediction results:\n{prediction_text}")
+        print(f"Prediction results:\n{initial_reply}")
         
-        # Get detailed information from LLM about the breeds
-        print("Getting breed information from Thai LLM...")
-        breed_info, thinking_content = get_dog_breed_info(top3_predictions[0][0], top3_predictions)
+        # Get detailed information from LLM about the breeds (skipped under load: prediction only)
+        breed_info, thinking_content = None, None
+        if is_dog:
+            with admission.try_stage("llm") as admitted:
+                if admitted:
+                    print("Getting breed information from Thai LLM...")
+                    with metrics.STAGE_LATENCY.time(stage="llm"):
+                        breed_info, thinking_content = get_dog_breed_info(top3_predictions[0][0], top3_predictions)
+                else:
+                    print("LLM stage saturated, replying with the prediction only")
         
         # Combine prediction and breed info
-        if breed_info:
-            full_reply = f"{initial_reply}\n\n📖 ข้อมูลเพิ่มเติม:\n{breed_info}"
-        else:
-            full_reply = initial_reply
+        full_reply = combine_breed_reply(initial_reply, breed_info)
         
         # Reply to the user
-        line_bot_api.reply_message(
-            event.reply_token, 
-            TextSendMessage(text=full_reply)
-        )
+        with metrics.STAGE_LATENCY.time(stage="reply"):
+            line_bot_api.reply_message(
+                event.reply_token, 
+                TextSendMessage(text=full_reply)
+            )
         
+        # Persist the photo in the background, after the user has their answer (see image_writer.py)
+        image_writer.submit(image_bytes.getvalue(), message_id, user_id, top3_predictions, embedding)
+
         # Calculate response time
         response_time = time.time() - start_time
         
         # Log conversation (with thinking process if available)
         log_conversation(
             user_id, 
-            f"[IMAGE] {image_filename}", 
+            f"[IMAGE] {message_id}", 
             full_reply, 
             response_time,
             thinking_content or ''
         )
         
+    except Shed:
+        raise
     except Exception as e:
+        metrics.HANDLER_ERRORS.inc(type="image")
         print(f"Error in handle_image_message: {e}")
         import traceback
         traceback.print_exc()
         
-        error_message = "ขอโทษครับ เกิดข้อผิดพลาดในการทำนาย กรุณาลองใหม่อีกครั้ง"
+        error_message = IMAGE_ERROR_REPLY
         
         try:
             line_bot_api.reply_message(
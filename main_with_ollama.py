@@ -1,4 +1,4 @@
-from flask import Flask, request
+from flask import Flask, request, Response
 from linebot import LineBotApi, WebhookHandler
 from linebot.models import MessageEvent, TextMessage, TextSendMessage, ImageMessage
 import os
@@ -11,7 +11,18 @@ import torch.nn as nn
 import torch.nn.functional as F
 from dotenv import load_dotenv
 from io import BytesIO
-import requests
+import metrics
+from event_guard import create_event_guard_from_env
+from singleflight import SingleFlight, request_key
+from llm_router import create_llm_router_from_env
+from faq_cache import create_faq_cache_from_env
+from intent_router import create_intent_router_from_env
+from image_store import create_image_store_from_env
+from image_writer import create_image_writer_from_env
+from inference_pool import create_pool_from_env
+from admission import Shed, create_admission_from_env
+from warmup import start_warmup_from_env
+import json
 import csv
 import time
 
@@ -37,9 +48,22 @@ ollama_model = os.getenv("OLLAMA_MODEL", "llama3.2:1b")
 if not channel_secret or not channel_access_token:
     raise ValueError("Missing CHANNEL_SECRET or CHANNEL_ACCESS_TOKEN environment variables.")
 
-line_bot_api = LineBotApi(channel_access_token)
+# LINE API endpoints (override only to point at a local stand-in for benchmarking)
+line_api_endpoint = os.getenv("LINE_API_ENDPOINT", "https://api.line.me")
+line_api_data_endpoint = os.getenv("LINE_API_DATA_ENDPOINT", "https://api-data.line.me")
+
+line_bot_api = LineBotApi(channel_access_token, endpoint=line_api_endpoint, data_endpoint=line_api_data_endpoint)
 handler = WebhookHandler(channel_secret)
 
+# Drop LINE redeliveries and per-user floods before any work is done (see event_guard.py)
+event_guard = create_event_guard_from_env()
+
+# Serve cached LLM answers for near-duplicate questions (see faq_cache.py)
+faq_cache = create_faq_cache_from_env(exclude_answers=[
+    "ส่งรูปเพื่อ ทำนาย 🐶 สายพันธ์น้องหมา มาได้เลยครับ",
+    "ขอโทษครับ ไม่สามารถตอบได้",
+])
+
 # Define class names for the prediction
 class_names = ['Afghan_hound', 'African_hunting_dog', 'Airedale', 'American_Staffordshire_terrier', 
                'Appenzeller', 'Australian_terrier', 'Bedlington_terrier', 'Bernese_mountain_dog', 
@@ -65,6 +89,9 @@ class_names = ['Afghan_hound', 'African_hunting_dog', 'Airedale', 'American_Staf
                'standard_poodle', 'standard_schnauzer', 'toy_poodle', 'toy_terrier', 'vizsla', 'whippet', 
                'wire-haired_fox_terrier']
 
+# Greetings, help and breed-name lookups answered locally (see intent_router.py / intents.json)
+intent_router = create_intent_router_from_env(class_names)
+
 # Load the trained model
 print("Loading dog breed model...")
 model_ft = models.resnet18(weights='IMAGENET1K_V1')
@@ -83,6 +110,14 @@ transform = transforms.Compose([
     transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
 ])
 
+# Optional: run predict_pil in worker processes (one model per core, images via shared memory)
+# Enable with INFERENCE_PROCESSES=<n>; default 0 keeps inference on the request thread
+inference_pool = create_pool_from_env(backend="torch")
+
+# Admission control: bounded in-flight work per image pipeline stage (see admission.py)
+admission = create_admission_from_env()
+BUSY_REPLY = "ขณะนี้มีผู้ใช้งานจำนวนมาก 🙏 กรุณาส่งรูปน้องหมาอีกครั้งในอีกสักครู่นะครับ 🐶"
+
 # Create logs directory if it doesn't exist
 if not os.path.exists("logs"):
     os.makedirs("logs")
@@ -125,11 +160,15 @@ def log_conversation(user_id, question, answer, response_time):
             
         print(f"Logged to {csv_filename}: {user_id} - {question[:30]}...")
     except Exception as e:
+        metrics.LOG_WRITE_FAILURES.inc()
         print(f"Error logging to CSV: {e}")
 
 
 def predict_pil(image):
     """Predict dog breed from PIL image."""
+    if inference_pool is not None:
+        return inference_pool.predict_pil(image)
+
     # Ensure image is in RGB mode
     if image.mode != 'RGB':
         image = image.convert('RGB')
@@ -159,52 +198,73 @@ def predict_pil(image):
     ]
 
 
-def ask_ollama(prompt, model=None):
-    """Ask Ollama LLM a question."""
-    if model is None:
-        model = ollama_model
-    
-    try:
-        response = requests.post(
-            f"{ollama_url}/api/generate",
-            json={
-                "model": model,
-                "prompt": prompt,
-                "stream": False
-            },
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result.get("response", "ขอโทษครับ ไม่สามารถตอบได้")
-        else:
-            return None
-    except Exception as e:
-        print(f"Ollama error: {e}")
-        return None
+# Local Ollama first; LLM_BACKENDS can add fallbacks (see llm_router.py)
+llm_router = create_llm_router_from_env(default="ollama")
+
+# Identical Ollama prompts in flight share one upstream call
+llm_flights = SingleFlight("ollama")
+
+
+def ask_ollama(prompt):
+    """Ask Ollama LLM a question (identical prompts already in flight share one upstream call)."""
+    key = request_key({"model": ollama_model, "prompt": prompt}, fields=("model", "prompt"))
+    return llm_flights.do(key, call_ollama, prompt)
+
+
+def call_ollama(prompt):
+    """Send one request to the LLM backends (use ask_ollama, which coalesces identical calls)."""
+    result = llm_router.complete(prompt)
+    return result.text if result is not None else None
+
+
+# Dummy predictions before serving, so the first user does not pay the cold start;
+# GET /ready reports the warm-up state (see warmup.py)
+readiness = start_warmup_from_env(predict_pil)
 
 
 app = Flask(__name__)
 
-# Ensure "images" folder exists
-if not os.path.exists("images"):
-    os.makedirs("images")
+# Store each unique photo once under images/ab/cd/<sha256>.jpg (see image_store.py),
+# written by a background thread after the reply has been sent
+image_store = create_image_store_from_env()
+image_writer = create_image_writer_from_env(image_store, class_names)
 
 @app.route("/", methods=["GET", "POST"])
 def home():
+    webhook_start = time.perf_counter()
+    metrics.QUEUE_DEPTH.inc(queue="webhook")
+    status = "ok"
     try:
         signature = request.headers["X-Line-Signature"]
         body = request.get_data(as_text=True)
         handler.handle(body, signature)
     except Exception as e:
+        status = "error"
         print("Error:", e)
+    finally:
+        metrics.QUEUE_DEPTH.dec(queue="webhook")
+        metrics.WEBHOOK_REQUESTS.inc(status=status)
+        metrics.WEBHOOK_LATENCY.observe(time.perf_counter() - webhook_start)
     
     return "Hello Line Chatbot"
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus-style metrics (counters, latency histograms, queue depths)."""
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+@app.route("/ready", methods=["GET"])
+def ready_endpoint():
+    """Readiness probe: 200 once startup warm-up is done, 503 while warming or if it failed."""
+    return Response(json.dumps(readiness.describe()), status=200 if readiness.ready else 503,
+                    mimetype="application/json")
+
 # Handle text messages
 @handler.add(MessageEvent, message=TextMessage)
 def handle_text_message(event):
+    if not event_guard.admit(event, "text"):
+        return
+    metrics.MESSAGES.inc(type="text")
     start_time = time.time()
     
     text = event.message.text
@@ -212,27 +272,28 @@ def handle_text_message(event):
     
     print(f"Received text from {user_id}: {text}")
 
-    # Predefined responses
-    responses = {
-        "สวัสดี": "สวัสดีครับ ยินดีต้อนรับสู่บริการทำนายสายพันธุ์น้องหมาครับ ส่งรูปน้องหมามาให้ผมทายสายพันธุ์ได้เลยครับ",
-        "ชื่ออะไร": "ผมชื่อไลน์บอทครับ สามารถส่งรูปน้องหมามาให้ผมทายสายพันธุ์ได้เลยครับ",
-    }
-
-    # Check if there's a predefined response
-    if text in responses:
-        reply_text = responses[text]
+    # Resolve greetings, help and breed lookups locally, then try a cached answer to a near-duplicate question
+    intent = intent_router.route(text)
+    cached_answer = None if intent else faq_cache.lookup(text)
+    if intent:
+        reply_text = intent.reply
+    elif cached_answer is not None:
+        reply_text = cached_answer
     else:
         # Try to use Ollama for general chat
-        ollama_response = ask_ollama(text)
+        with metrics.STAGE_LATENCY.time(stage="llm"):
+            ollama_response = ask_ollama(text)
         
         if ollama_response:
             reply_text = ollama_response
+            faq_cache.add(text, ollama_response)
         else:
             # Fallback if Ollama is not available
             reply_text = "ส่งรูปเพื่อ ทำนาย 🐶 สายพันธ์น้องหมา มาได้เลยครับ"
     
     # Send reply
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
+    with metrics.STAGE_LATENCY.time(stage="reply"):
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
     
     # Calculate response time
     response_time = time.time() - start_time
@@ -243,38 +304,52 @@ def handle_text_message(event):
 # Handle image messages
 @handler.add(MessageEvent, message=ImageMessage)
 def handle_image_message(event):
+    if not event_guard.admit(event, "image"):
+        return
+    metrics.MESSAGES.inc(type="image")
     start_time = time.time()
-    
-    message_id = event.message.id
-    user_id = event.source.user_id
 
-    # Get current time in the format YYYY_MM_DD_HH_MM_SS
-    timestamp = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+    try:
+        with admission.stage("pipeline"):
+            process_image_message(event, start_time)
+    except Shed:
+        reply_busy(event, start_time)
+
+
+def reply_busy(event, start_time):
+    """Fast degraded reply when admission control sheds an image."""
+    try:
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=BUSY_REPLY))
+        log_conversation(event.source.user_id, "[IMAGE] Busy", BUSY_REPLY, time.time() - start_time)
+    except Exception as e:
+        print(f"Error sending busy reply: {e}")
+
 
-    # Construct the image filename with timestamp and message_id
-    image_filename = f"{timestamp}_{message_id}.jpg"
-    image_path = os.path.join("images", image_filename)
+def process_image_message(event, start_time):
+    """Download, predict and reply (each stage behind admission control)."""
+    message_id = event.message.id
+    user_id = event.source.user_id
 
     try:
         # Download image from LINE server
-        message_content = line_bot_api.get_message_content(message_id)
-        
-        image_bytes = BytesIO()
+        with admission.stage("download"):
+            stage_start = time.perf_counter()
+            message_content = line_bot_api.get_message_content(message_id)
 
-        # Save to both disk and memory
-        with open(image_path, "wb") as img_file:
+            image_bytes = BytesIO()
             for chunk in message_content.iter_content(chunk_size=1024):
-                img_file.write(chunk)      # save to disk
-                image_bytes.write(chunk)   # keep in memory
+                image_bytes.write(chunk)
 
-        image_bytes.seek(0)
-        print(f"Image saved at: {image_path}")
+            image_bytes.seek(0)
+            metrics.STAGE_LATENCY.observe(time.perf_counter() - stage_start, stage="download")
 
         # Load image from memory
         image = Image.open(image_bytes).convert("RGB")
         
         # Predict top 3 classes and confidence scores
-        top3_predictions = predict_pil(image)
+        with admission.stage("inference"):
+            with metrics.STAGE_LATENCY.time(stage="inference"):
+                top3_predictions = predict_pil(image)
         
         print(f"Top 3 Predictions: {top3_predictions}")
         
@@ -289,18 +364,25 @@ def handle_image_message(event):
         full_reply = f"🐶 สายพันธ์น้องหมา\n📊มีความน่าจะเป็นดังนี้:\n{reply_text}"
         
         # Reply to the user
-        line_bot_api.reply_message(
-            event.reply_token, 
-            TextSendMessage(text=full_reply)
-        )
+        with metrics.STAGE_LATENCY.time(stage="reply"):
+            line_bot_api.reply_message(
+                event.reply_token, 
+                TextSendMessage(text=full_reply)
+            )
         
+        # Persist the photo in the background, after the user has their answer (see image_writer.py)
+        image_writer.submit(image_bytes.getvalue(), message_id, user_id, top3_predictions)
+
         # Calculate response time
         response_time = time.time() - start_time
         
         # Log conversation (use image filename as question)
-        log_conversation(user_id, f"[IMAGE] {image_filename}", full_reply, response_time)
+        log_conversation(user_id, f"[IMAGE] {message_id}", full_reply, response_time)
         
+    except Shed:
+        raise
     except Exception as e:
+        metrics.HANDLER_ERRORS.inc(type="image")
         print(f"Error in handle_image_message: {e}")
         import traceback
         traceback.print_exc()
@@ -1,4 +1,4 @@
-from flask import Flask, request
+from flask import Flask, request, Response
 from linebot import LineBotApi, WebhookHandler
 from linebot.models import MessageEvent, TextMessage, TextSendMessage, ImageMessage
 import os
@@ -11,7 +11,17 @@ import torch.nn as nn
 import torch.nn.functional as F
 from dotenv import load_dotenv
 from io import BytesIO
-import requests
+import metrics
+from event_guard import create_event_guard_from_env
+from singleflight import SingleFlight, request_key
+from llm_router import create_llm_router_from_env
+from faq_cache import create_faq_cache_from_env
+from intent_router import create_intent_router_from_env
+from image_store import create_image_store_from_env
+from image_writer import create_image_writer_from_env
+from inference_pool import create_pool_from_env
+from admission import Shed, create_admission_from_env
+from warmup import start_warmup_from_env
 import json
 import csv
 import time
@@ -33,17 +43,27 @@ load_dotenv()
 channel_secret = os.getenv("CHANNEL_SECRET")
 channel_access_token = os.getenv("CHANNEL_ACCESS_TOKEN")
 
-# Thai LLM API configuration
-thai_llm_url = os.getenv("THAI_LLM_URL", "http://thaillm.or.th/api/pathumma/v1/chat/completions")
-thai_llm_api_key = os.getenv("THAI_LLM_API_KEY", "Your API KEY")
+# Thai LLM API configuration (the LLM_BACKENDS endpoints themselves are read by llm_router.py)
 thai_llm_model = os.getenv("THAI_LLM_MODEL", "/model")
 
 if not channel_secret or not channel_access_token:
     raise ValueError("Missing CHANNEL_SECRET or CHANNEL_ACCESS_TOKEN environment variables.")
 
-line_bot_api = LineBotApi(channel_access_token)
+# LINE API endpoints (override only to point at a local stand-in for benchmarking)
+line_api_endpoint = os.getenv("LINE_API_ENDPOINT", "https://api.line.me")
+line_api_data_endpoint = os.getenv("LINE_API_DATA_ENDPOINT", "https://api-data.line.me")
+
+line_bot_api = LineBotApi(channel_access_token, endpoint=line_api_endpoint, data_endpoint=line_api_data_endpoint)
 handler = WebhookHandler(channel_secret)
 
+# Drop LINE redeliveries and per-user floods before any work is done (see event_guard.py)
+event_guard = create_event_guard_from_env()
+
+# Serve cached LLM answers for near-duplicate questions (see faq_cache.py)
+faq_cache = create_faq_cache_from_env(exclude_answers=[
+    "ขอโทษครับ ขณะนี้ระบบตอบคำถามไม่สามารถใช้งานได้ 🙏\n\nคุณสามารถส่งรูปน้องหมามาให้ผมทายสายพันธุ์ได้เลยครับ 🐶",
+])
+
 # Define class names for the prediction
 class_names = ['Afghan_hound', 'African_hunting_dog', 'Airedale', 'American_Staffordshire_terrier', 
                'Appenzeller', 'Australian_terrier', 'Bedlington_terrier', 'Bernese_mountain_dog', 
@@ -69,6 +89,9 @@ class_names = ['Afghan_hound', 'African_hunting_dog', 'Airedale', 'American_Staf
                'standard_poodle', 'standard_schnauzer', 'toy_poodle', 'toy_terrier', 'vizsla', 'whippet', 
                'wire-haired_fox_terrier']
 
+# Greetings, help and breed-name lookups answered locally (see intent_router.py / intents.json)
+intent_router = create_intent_router_from_env(class_names)
+
 # Load the trained model
 print("Loading dog breed model...")
 model_ft = models.resnet18(weights='IMAGENET1K_V1')
@@ -87,6 +110,14 @@ transform = transforms.Compose([
     transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
 ])
 
+# Optional: run predict_pil in worker processes (one model per core, images via shared memory)
+# Enable with INFERENCE_PROCESSES=<n>; default 0 keeps inference on the request thread
+inference_pool = create_pool_from_env(backend="torch")
+
+# Admission control: bounded in-flight work per image pipeline stage (see admission.py)
+admission = create_admission_from_env()
+BUSY_REPLY = "ขณะนี้มีผู้ใช้งานจำนวนมาก 🙏 กรุณาส่งรูปน้องหมาอีกครั้งในอีกสักครู่นะครับ 🐶"
+
 # Create logs directory if it doesn't exist
 if not os.path.exists("logs"):
     os.makedirs("logs")
@@ -129,11 +160,15 @@ def log_conversation(user_id, question, answer, response_time):
             
         print(f"Logged to {csv_filename}: {user_id} - {question[:30]}...")
     except Exception as e:
+        metrics.LOG_WRITE_FAILURES.inc()
         print(f"Error logging to CSV: {e}")
 
 
 def predict_pil(image):
     """Predict dog breed from PIL image."""
+    if inference_pool is not None:
+        return inference_pool.predict_pil(image)
+
     # Ensure image is in RGB mode
     if image.mode != 'RGB':
         image = image.convert('RGB')
@@ -163,9 +198,17 @@ def predict_pil(image):
     ]
 
 
+# Thai LLM first; LLM_BACKENDS can add fallbacks such as a local Ollama (see llm_router.py)
+llm_router = create_llm_router_from_env(default="thai_llm")
+
+# Identical Thai LLM requests in flight share one upstream call
+llm_flights = SingleFlight("thai_llm")
+
+
 def ask_thai_llm(user_message, max_tokens=2048, temperature=0.3):
     """
     Ask Thai LLM API a question
+    Identical requests already in flight share one upstream call (see singleflight.py).
     
     Args:
         user_message: User's question/message
@@ -175,76 +218,73 @@ def ask_thai_llm(user_message, max_tokens=2048, temperature=0.3):
     Returns:
         LLM response text or None if error
     """
-    try:
-        headers = {
-            "Content-Type": "application/json",
-            "apikey": thai_llm_api_key
-        }
-        
-        payload = {
-            "model": thai_llm_model,
-            "messages": [
-                {"role": "user", "content": user_message}
-            ],
-            "max_tokens": max_tokens,
-            "temperature": temperature
-        }
-        
-        print(f"Calling Thai LLM API for: {user_message[:50]}...")
-        
-        response = requests.post(
-            thai_llm_url,
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            
-            # Extract response from the API result
-            # API structure: response['choices'][0]['message']['content']
-            if 'choices' in result and len(result['choices']) > 0:
-                message_content = result['choices'][0]['message']['content']
-                print(f"Thai LLM response received: {message_content[:50]}...")
-                return message_content
-            else:
-                print(f"Unexpected API response structure: {result}")
-                return None
-        else:
-            print(f"Thai LLM API error: {response.status_code} - {response.text}")
-            return None
-            
-    except requests.exceptions.Timeout:
-        print("Thai LLM API timeout")
-        return None
-    except Exception as e:
-        print(f"Thai LLM error: {e}")
-        import traceback
-        traceback.print_exc()
+    key = request_key({
+        "model": thai_llm_model,
+        "messages": [{"role": "user", "content": user_message}],
+        "max_tokens": max_tokens,
+        "temperature": temperature
+    })
+    return llm_flights.do(key, call_thai_llm, user_message, max_tokens, temperature)
+
+
+def call_thai_llm(user_message, max_tokens=2048, temperature=0.3):
+    """Send one request to the LLM backends (use ask_thai_llm, which coalesces identical calls)."""
+    print(f"Calling Thai LLM API for: {user_message[:50]}...")
+    result = llm_router.complete(user_message, max_tokens, temperature)
+    if result is None:
         return None
+    print(f"LLM response received from {result.backend}: {result.text[:50]}...")
+    return result.text
+
+
+# Dummy predictions before serving, so the first user does not pay the cold start;
+# GET /ready reports the warm-up state (see warmup.py)
+readiness = start_warmup_from_env(predict_pil)
 
 
 app = Flask(__name__)
 
-# Ensure "images" folder exists
-if not os.path.exists("images"):
-    os.makedirs("images")
+# Store each unique photo once under images/ab/cd/<sha256>.jpg (see image_store.py),
+# written by a background thread after the reply has been sent
+image_store = create_image_store_from_env()
+image_writer = create_image_writer_from_env(image_store, class_names)
 
 @app.route("/", methods=["GET", "POST"])
 def home():
+    webhook_start = time.perf_counter()
+    metrics.QUEUE_DEPTH.inc(queue="webhook")
+    status = "ok"
     try:
         signature = request.headers["X-Line-Signature"]
         body = request.get_data(as_text=True)
         handler.handle(body, signature)
     except Exception as e:
+        status = "error"
         print("Error:", e)
+    finally:
+        metrics.QUEUE_DEPTH.dec(queue="webhook")
+        metrics.WEBHOOK_REQUESTS.inc(status=status)
+        metrics.WEBHOOK_LATENCY.observe(time.perf_counter() - webhook_start)
     
     return "Hello Line Chatbot"
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus-style metrics (counters, latency histograms, queue depths)."""
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+@app.route("/ready", methods=["GET"])
+def ready_endpoint():
+    """Readiness probe: 200 once startup warm-up is done, 503 while warming or if it failed."""
+    return Response(json.dumps(readiness.describe()), status=200 if readiness.ready else 503,
+                    mimetype="application/json")
+
 # Handle text messages
 @handler.add(MessageEvent, message=TextMessage)
 def handle_text_message(event):
+    if not event_guard.admit(event, "text"):
+        return
+    metrics.MESSAGES.inc(type="text")
     start_time = time.time()
     
     text = event.message.text
@@ -252,27 +292,28 @@ def handle_text_message(event):
     
     print(f"Received text from {user_id}: {text}")
 
-    # Predefined responses (optional - for quick replies)
-    quick_responses = {
-        "สวัสดี": "สวัสดีครับ ยินดีที่ได้รู้จักนะครับ 😊",
-        "ชื่ออะไร": "ผมชื่อไลน์บอทครับ สามารถส่งรูปน้องหมามาให้ผมทายสายพันธุ์ได้เลยครับ 🐶",
-    }
-
-    # Check if there's a quick response
-    if text in quick_responses:
-        reply_text = quick_responses[text]
+    # Resolve greetings, help and breed lookups locally, then try a cached answer to a near-duplicate question
+    intent = intent_router.route(text)
+    cached_answer = None if intent else faq_cache.lookup(text)
+    if intent:
+        reply_text = intent.reply
+    elif cached_answer is not None:
+        reply_text = cached_answer
     else:
         # Use Thai LLM API for general chat
-        llm_response = ask_thai_llm(text)
+        with metrics.STAGE_LATENCY.time(stage="llm"):
+            llm_response = ask_thai_llm(text)
         
         if llm_response:
             reply_text = llm_response
+            faq_cache.add(text, llm_response)
         else:
             # Fallback if LLM is not available
             reply_text = "ขอโทษครับ ขณะนี้ระบบตอบคำถามไม่สามารถใช้งานได้ 🙏\n\nคุณสามารถส่งรูปน้องหมามาให้ผมทายสายพันธุ์ได้เลยครับ 🐶"
     
     # Send reply
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
+    with metrics.STAGE_LATENCY.time(stage="reply"):
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
     
     # Calculate response time
     response_time = time.time() - start_time
@@ -283,38 +324,52 @@ def handle_text_message(event):
 # Handle image messages
 @handler.add(MessageEvent, message=ImageMessage)
 def handle_image_message(event):
+    if not event_guard.admit(event, "image"):
+        return
+    metrics.MESSAGES.inc(type="image")
     start_time = time.time()
-    
-    message_id = event.message.id
-    user_id = event.source.user_id
 
-    # Get current time in the format YYYY_MM_DD_HH_MM_SS
-    timestamp = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+    try:
+        with admission.stage("pipeline"):
+            process_image_message(event, start_time)
+    except Shed:
+        reply_busy(event, start_time)
+
 
-    # Construct the image filename with timestamp and message_id
-    image_filename = f"{timestamp}_{message_id}.jpg"
-    image_path = os.path.join("images", image_filename)
+def reply_busy(event, start_time):
+    """Fast degraded reply when admission control sheds an image."""
+    try:
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=BUSY_REPLY))
+        log_conversation(event.source.user_id, "[IMAGE] Busy", BUSY_REPLY, time.time() - start_time)
+    except Exception as e:
+        print(f"Error sending busy reply: {e}")
+
+
+def process_image_message(event, start_time):
+    """Download, predict and reply (each stage behind admission control)."""
+    message_id = event.message.id
+    user_id = event.source.user_id
 
     try:
         # Download image from LINE server
-        message_content = line_bot_api.get_message_content(message_id)
-        
-        image_bytes = BytesIO()
+        with admission.stage("download"):
+            stage_start = time.perf_counter()
+            message_content = line_bot_api.get_message_content(message_id)
 
-        # Save to both disk and memory
-        with open(image_path, "wb") as img_file:
+            image_bytes = BytesIO()
             for chunk in message_content.iter_content(chunk_size=1024):
-                img_file.write(chunk)      # save to disk
-                image_bytes.write(chunk)   # keep in memory
+                image_bytes.write(chunk)
 
-        image_bytes.seek(0)
-        print(f"Image saved at: {image_path}")
+            image_bytes.seek(0)
+            metrics.STAGE_LATENCY.observe(time.perf_counter() - stage_start, stage="download")
 
         # Load image from memory
         image = Image.open(image_bytes).convert("RGB")
         
         # Predict top 3 classes and confidence scores
-        top3_predictions = predict_pil(image)
+        with admission.stage("inference"):
+            with metrics.STAGE_LATENCY.time(stage="inference"):
+                top3_predictions = predict_pil(image)
         
         print(f"Top 3 Predictions: {top3_predictions}")
         
@@ -329,18 +384,25 @@ def handle_image_message(event):
         full_reply = f"🐶 สายพันธ์น้องหมา\n📊มีความน่าจะเป็นดังนี้:\n{reply_text}"
         
         # Reply to the user
-        line_bot_api.reply_message(
-            event.reply_token, 
-            TextSendMessage(text=full_reply)
-        )
+        with metrics.STAGE_LATENCY.time(stage="reply"):
+            line_bot_api.reply_message(
+                event.reply_token, 
+                TextSendMessage(text=full_reply)
+            )
         
+        # Persist the photo in the background, after the user has their answer (see image_writer.py)
+        image_writer.submit(image_bytes.getvalue(), message_id, user_id, top3_predictions)
+
         # Calculate response time
         response_time = time.time() - start_time
         
         # Log conversation (use image filename as question)
-        log_conversation(user_id, f"[IMAGE] {image_filename}", full_reply, response_time)
+        log_conversation(user_id, f"[IMAGE] {message_id}", full_reply, response_time)
         
+    except Shed:
+        raise
     except Exception as e:
+        metrics.HANDLER_ERRORS.inc(type="image")
         print(f"Error in handle_image_message: {e}")
         import traceback
         traceback.print_exc()
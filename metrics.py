@@ -0,0 +1,331 @@
+"""
+Lightweight in-process metrics for the LINE chatbot
+Exposes counters, gauges and latency histograms in Prometheus text format
+
+All aggregation happens in memory with one small lock per metric, so recording
+a sample costs a few microseconds. Scrape with: curl http://localhost:5000/metrics
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds (LLM calls can take up to the 30s timeout)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    """Escape a label value (backslash, double quote, newline)."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=None):
+    """Format label pairs as {a="x",b="y"}."""
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    """Format a sample value the way Prometheus expects."""
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Base class holding name, help text and label names."""
+
+    metric_type = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    metric_type = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be read from a callback at scrape time."""
+
+    metric_type = "gauge"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn, **labels):
+        """Read the value from fn() whenever /metrics is scraped (e.g. queue sizes)."""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = fn
+
+    def value(self, **labels):
+        key = self._key(labels)
+        if key in self._functions:
+            return self._functions[key]()
+        return self._values.get(key, 0)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, fn in functions.items():
+            try:
+                values[key] = fn()
+            except Exception:
+                continue
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Bucketed latency histogram with running sum and count."""
+
+    metric_type = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [per-bucket counts (+Inf last), sum, count]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Context manager that observes the elapsed wall time of its block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self, **labels):
+        """Return (sum, count) for one label set."""
+        series = self._series.get(self._key(labels))
+        if series is None:
+            return 0.0, 0
+        return series[1], series[2]
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted((key, ([*s[0]], s[1], s[2])) for key, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together on /metrics."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            existing = self._metrics.get(name)
+            if existing is not None:
+                return existing
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, labelnames, buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+render = REGISTRY.render
+
+
+# ============================================================
+# Metrics shared by all entry points
+# ============================================================
+WEBHOOK_REQUESTS = counter(
+    "whatdog_webhook_requests_total", "Webhook requests received, by outcome", ["status"])
+WEBHOOK_LATENCY = histogram(
+    "whatdog_webhook_duration_seconds", "Time spent handling one webhook request")
+MESSAGES = counter(
+    "whatdog_messages_total", "LINE message events handled, by message type", ["type"])
+HANDLER_ERRORS = counter(
+    "whatdog_handler_errors_total", "Exceptions raised inside message handlers", ["type"])
+STAGE_LATENCY = histogram(
+    "whatdog_stage_duration_seconds",
+    "Latency of pipeline stages (download, inference, llm, reply)", ["stage"])
+LLM_REQUESTS = counter(
+    "whatdog_llm_requests_total", "LLM calls by backend and outcome (success/timeout/error/cancelled)",
+    ["backend", "outcome"])
+LLM_LATENCY = histogram(
+    "whatdog_llm_duration_seconds", "LLM call latency by backend", ["backend"])
+LOG_WRITE_FAILURES = counter(
+    "whatdog_log_write_failures_total", "Failed writes to the CSV conversation log")
+QUEUE_DEPTH = gauge(
+    "whatdog_queue_depth", "Items currently waiting or in flight, by queue", ["queue"])
+INFERENCE_SLOTS_RECLAIMED = counter(
+    "whatdog_inference_slots_reclaimed_total", "Inference pool slots returned after a timeout or worker restart")
+SHED = counter(
+    "whatdog_shed_total", "Work rejected or degraded by admission control, by stage", ["stage"])
+DROPPED_EVENTS = counter(
+    "whatdog_dropped_events_total", "Message events dropped before handling (duplicate/rate_limited)",
+    ["reason"])
+LLM_COALESCED = counter(
+    "whatdog_llm_coalesced_total", "LLM requests answered by an identical call already in flight",
+    ["backend"])
+FAQ_LOOKUPS = counter(
+    "whatdog_faq_cache_lookups_total", "FAQ cache lookups by result (hit/miss)", ["result"])
+FAQ_EVICTIONS = counter(
+    "whatdog_faq_cache_evictions_total", "FAQ cache entries removed (lru/expired/replaced)", ["reason"])
+FAQ_ENTRIES = gauge(
+    "whatdog_faq_cache_entries", "Questions currently held in the FAQ cache")
+INTENTS = counter(
+    "whatdog_intents_total", "Text messages answered locally by the intent router", ["intent"])
+LLM_HEDGES = counter(
+    "whatdog_llm_hedges_total", "Hedged LLM requests sent to a backup backend, by backup backend",
+    ["backend"])
+LLM_CIRCUIT_REJECTIONS = counter(
+    "whatdog_llm_circuit_rejections_total", "LLM requests skipped because the backend circuit was open",
+    ["backend"])
+LLM_CIRCUIT_STATE = gauge(
+    "whatdog_llm_circuit_state", "LLM backend circuit state (0=closed, 1=half-open, 2=open)", ["backend"])
+LLM_ERROR_RATE = gauge(
+    "whatdog_llm_error_rate", "Share of recent LLM calls that failed, by backend", ["backend"])
+LLM_CIRCUIT_TRANSITIONS = counter(
+    "whatdog_llm_circuit_transitions_total", "LLM circuit breaker state changes, by backend and new state",
+    ["backend", "state"])
+LLM_TIMEOUT_SECONDS = gauge(
+    "whatdog_llm_timeout_seconds", "Current adaptive LLM request timeout, by backend", ["backend"])
+IMAGES_STORED = counter(
+    "whatdog_images_stored_total", "Images written to the image store (new) or deduplicated (duplicate)",
+    ["result"])
+IMAGE_STORE_BYTES = gauge(
+    "whatdog_image_store_bytes", "Bytes held by the content-addressed image store")
+IMAGES_REMOVED = counter(
+    "whatdog_images_removed_total", "Images deleted by retention sweeps (expired/evicted)", ["reason"])
+IMAGES_NOT_STORED = counter(
+    "whatdog_images_not_stored_total", "Images not persisted, by reason (sampled_out/too_large/queue_full/error)",
+    ["reason"])
+ACTIVE_LEARNING_RECORDS = counter(
+    "whatdog_active_learning_records_total", "Predictions recorded in the uncertainty index")
+CASCADE = counter(
+    "whatdog_cascade_images_total", "Images answered by each cascade stage (fast/full)", ["stage"])
+CASCADE_LATENCY = histogram(
+    "whatdog_cascade_stage_seconds", "Latency of each cascade stage (fast/full)", ["stage"])
+TTA = counter(
+    "whatdog_tta_images_total", "Test-time augmentation per image (skipped/applied/changed)", ["outcome"])
+TTA_LATENCY = histogram(
+    "whatdog_tta_seconds", "Extra latency of the batched augmented-views pass")
+READY = gauge(
+    "whatdog_ready", "1 once startup warm-up has finished (what /ready reports), else 0")
+WARMUP_SECONDS = gauge(
+    "whatdog_warmup_seconds", "Duration of the startup warm-up")
+MODEL_VERSION = gauge(
+    "whatdog_model_version", "Version of the serving model (starts at 1, +1 per hot reload)")
+MODELS_DRAINING = gauge(
+    "whatdog_models_draining", "Replaced models still finishing in-flight requests")
+MODEL_RELOADS = counter(
+    "whatdog_model_reloads_total", "Hot model reloads by result (success/error)", ["result"])
+MODEL_RELOAD_LATENCY = histogram(
+    "whatdog_model_reload_seconds", "Time to load and warm a reloaded model",
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+DOG_GATE = counter(
+    "whatdog_dog_gate_total", "Images checked by the is-this-a-dog gate (dog/not_dog)", ["result"])
+EMBEDDINGS_ADDED = counter(
+    "whatdog_embeddings_added_total", "Image embeddings appended to the similar-dogs index")
+EMBEDDINGS_STORED = gauge(
+    "whatdog_embeddings_stored", "Image embeddings held by the similar-dogs index")
+EMBEDDING_SEARCH_LATENCY = histogram(
+    "whatdog_embedding_search_seconds", "Similar-dogs search latency (exact/ivf)", ["mode"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
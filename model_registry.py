@@ -0,0 +1,232 @@
+"""
+Hot model reload
+Replacing resnet18_best.pth or dog_breed_model.onnx used to need a restart: a full cold
+start during which image messages failed. ModelRegistry owns the serving model instead:
+
+- reload() loads the new file and warms it with a dummy batch in the calling (background)
+  thread, while requests keep using the current model
+- the new model is swapped in atomically; requests that started before the swap finish
+  on the old one, which is only dropped once its last in-flight request is done
+- a model that fails to load or warm is rejected and the current one keeps serving
+
+Reloads are triggered by either:
+    MODEL_WATCH_INTERVAL=<seconds>   poll the model file; reload once a changed file has
+                                     been stable (same size and mtime) for one interval
+    POST /admin/reload-model         with "Authorization: Bearer $ADMIN_TOKEN"
+                                     (the admin endpoints are disabled without ADMIN_TOKEN)
+
+Copy the new file next to the old one and `mv` it into place, so a half-written model is
+never read; a half-written file is rejected anyway and retried on its next change.
+
+Only this registry's model is reloaded: the INFERENCE_PROCESSES workers and the cascade's
+int8 model keep theirs until a restart (warn_not_reloaded logs this at startup).
+
+Configuration (environment variables):
+    MODEL_WATCH_INTERVAL=0     # seconds between file checks (0 = no watcher)
+    ADMIN_TOKEN=               # enables /admin/reload-model and /admin/model
+"""
+
+import hmac
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+
+class _Version:
+    """One loaded model and the requests currently using it."""
+
+    def __init__(self, number, model, path, signature):
+        self.number = number
+        self.model = model
+        self.path = path
+        self.signature = signature
+        self.loaded_at = time.time()
+        self.in_flight = 0
+
+
+def file_signature(path):
+    """(mtime_ns, size) of the model file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ModelRegistry:
+    """Serving model with background reload, atomic swap and draining of the old version."""
+
+    def __init__(self, path, loader, warm=None, model=None):
+        """
+        Args:
+            loader: loader(path) -> model
+            warm: warm(model), run on every new model before it serves; raise to reject it
+            model: an already loaded model for `path` (otherwise loaded here)
+        """
+        self.path = path
+        self.loader = loader
+        self.warm = warm
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._swap_callbacks = []
+        self._draining = []
+        self._watcher = None
+        self._stop = threading.Event()
+        self.last_error = None
+        # Signature of the last file that failed to load or warm; the watcher skips it
+        self._rejected_signature = None
+
+        signature = file_signature(path)
+        if model is None:
+            model = loader(path)
+        self._current = _Version(1, model, path, signature)
+        metrics.MODEL_VERSION.set_function(lambda: self._current.number)
+        metrics.MODELS_DRAINING.set_function(lambda: len(self._draining))
+
+    @property
+    def current(self):
+        return self._current.model
+
+    @property
+    def version(self):
+        return self._current.number
+
+    def on_swap(self, callback):
+        """Call callback(new_model) after every swap (e.g. to re-attach hooks)."""
+        self._swap_callbacks.append(callback)
+
+    @contextmanager
+    def acquire(self):
+        """Use the current model for one request; a swap meanwhile does not affect it."""
+        with self._lock:
+            version = self._current
+            version.in_flight += 1
+        try:
+            yield version.model
+        finally:
+            with self._lock:
+                version.in_flight -= 1
+                drained = version is not self._current and version.in_flight == 0 and version in self._draining
+                if drained:
+                    self._draining.remove(version)
+            if drained:
+                print(f"Model v{version.number} drained and released")
+
+    def reload(self, path=None):
+        """
+        Load, warm and swap in the model at `path` (default: the current path).
+        Blocks the calling thread; concurrent calls are skipped.
+
+        Returns:
+            bool: True if a new model is now serving
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            print("Model reload already in progress, skipped")
+            return False
+        try:
+            path = path or self.path
+            signature = file_signature(path)
+            start = time.perf_counter()
+            try:
+                model = self.loader(path)
+                if self.warm is not None:
+                    self.warm(model)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                if path == self.path:
+                    self._rejected_signature = signature
+                metrics.MODEL_RELOADS.inc(result="error")
+                print(f"⚠️  Model reload from {path} failed, keeping v{self.version}: {self.last_error}")
+                return False
+
+            with self._lock:
+                old = self._current
+                self._current = _Version(old.number + 1, model, path, signature)
+                self.path = path
+                if old.in_flight:
+                    self._draining.append(old)
+            self.last_error = None
+            self._rejected_signature = None
+            for callback in self._swap_callbacks:
+                callback(model)
+            metrics.MODEL_RELOADS.inc(result="success")
+            metrics.MODEL_RELOAD_LATENCY.observe(time.perf_counter() - start)
+            print(f"Model v{self.version} serving from {path} ({time.perf_counter() - start:.1f}s to load and warm)"
+                  + (f", v{old.number} draining {old.in_flight} in-flight request(s)" if old.in_flight else ""))
+            return True
+        finally:
+            self._reload_lock.release()
+
+    def reload_in_background(self, path=None):
+        """Start reload() in a daemon thread; False if a reload is already running."""
+        if self._reload_lock.locked():
+            return False
+        threading.Thread(target=self.reload, args=(path,), name="model-reload", daemon=True).start()
+        return True
+
+    def watch(self, interval):
+        """Poll the model file every `interval` seconds and reload when it changes."""
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="model-watch", daemon=True)
+        self._watcher.start()
+
+    def _watch(self, interval):
+        pending = None
+        while not self._stop.wait(interval):
+            signature = file_signature(self.path)
+            # A rejected file is not retried until it changes again
+            if signature is None or signature in (self._current.signature, self._rejected_signature):
+                pending = None
+            elif signature != pending:
+                # Changed since the last check: wait one more interval for the copy to finish
+                pending = signature
+            else:
+                self.reload()
+                pending = None
+
+    def close(self):
+        self._stop.set()
+
+    def describe(self):
+        with self._lock:
+            current = self._current
+            return {
+                "version": current.number,
+                "path": current.path,
+                "loaded_at": current.loaded_at,
+                "in_flight": current.in_flight,
+                "draining": [{"version": v.number, "in_flight": v.in_flight} for v in self._draining],
+                "reloading": self._reload_lock.locked(),
+                "last_error": self.last_error,
+            }
+
+
+def admin_authorized(authorization_header):
+    """True if ADMIN_TOKEN is set and the header is "Bearer <ADMIN_TOKEN>"."""
+    token = os.getenv("ADMIN_TOKEN", "")
+    if not token or not authorization_header:
+        return False
+    return hmac.compare_digest(authorization_header.encode(), f"Bearer {token}".encode())
+
+
+def reload_enabled():
+    """True if the model can be reloaded at runtime (watcher or admin endpoint configured)."""
+    return float(os.getenv("MODEL_WATCH_INTERVAL", "0")) > 0 or bool(os.getenv("ADMIN_TOKEN", ""))
+
+
+def warn_not_reloaded(description):
+    """Startup warning for a model copy that a reload does not reach (only if reloads are enabled)."""
+    if reload_enabled():
+        print(f"⚠️  Model reload does not reach {description}; restart to pick up a new model file")
+
+
+def create_model_registry_from_env(path, loader, warm=None, model=None):
+    """ModelRegistry for `path`, watching the file when MODEL_WATCH_INTERVAL > 0."""
+    registry = ModelRegistry(path, loader, warm=warm, model=model)
+    interval = float(os.getenv("MODEL_WATCH_INTERVAL", "0"))
+    if interval > 0:
+        registry.watch(interval)
+        print(f"Model registry: watching {path} every {interval:g}s")
+    return registry
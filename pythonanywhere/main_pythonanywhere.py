@@ -14,7 +14,7 @@ Requirements:
 Total: ~100-150MB instead of ~1.1GB
 """
 
-from flask import Flask, request
+from flask import Flask, request, Response
 from linebot import LineBotApi, WebhookHandler
 from linebot.models import MessageEvent, TextMessage, TextSendMessage, ImageMessage
 import os
@@ -23,7 +23,20 @@ import numpy as np
 from PIL import Image
 from dotenv import load_dotenv
 from io import BytesIO
-import requests
+import metrics
+from event_guard import create_event_guard_from_env
+from singleflight import SingleFlight, request_key
+from llm_router import create_llm_router_from_env
+from faq_cache import create_faq_cache_from_env
+from intent_router import create_intent_router_from_env
+from image_store import create_image_store_from_env
+from image_writer import create_image_writer_from_env
+from dog_gate import create_dog_gate_from_env
+from cascade import create_cascade_from_env
+from model_registry import admin_authorized, create_model_registry_from_env, warn_not_reloaded
+from warmup import batch_sizes_from_env, start_warmup_from_env, warm_forward, warm_rounds
+from tta import create_tta_from_env
+from admission import Shed, create_admission_from_env
 import json
 import csv
 import time
@@ -38,17 +51,27 @@ load_dotenv()
 channel_secret = os.getenv("CHANNEL_SECRET")
 channel_access_token = os.getenv("CHANNEL_ACCESS_TOKEN")
 
-# Thai LLM API configuration
-thai_llm_url = os.getenv("THAI_LLM_URL", "http://thaillm.or.th/api/pathumma/v1/chat/completions")
-thai_llm_api_key = os.getenv("THAI_LLM_API_KEY", "Your API KEY")
+# Thai LLM API configuration (the LLM_BACKENDS endpoints themselves are read by llm_router.py)
 thai_llm_model = os.getenv("THAI_LLM_MODEL", "/model")
 
 if not channel_secret or not channel_access_token:
     raise ValueError("Missing CHANNEL_SECRET or CHANNEL_ACCESS_TOKEN environment variables.")
 
-line_bot_api = LineBotApi(channel_access_token)
+# LINE API endpoints (override only to point at a local stand-in for benchmarking)
+line_api_endpoint = os.getenv("LINE_API_ENDPOINT", "https://api.line.me")
+line_api_data_endpoint = os.getenv("LINE_API_DATA_ENDPOINT", "https://api-data.line.me")
+
+line_bot_api = LineBotApi(channel_access_token, endpoint=line_api_endpoint, data_endpoint=line_api_data_endpoint)
 handler = WebhookHandler(channel_secret)
 
+# Drop LINE redeliveries and per-user floods before any work is done (see event_guard.py)
+event_guard = create_event_guard_from_env()
+
+# Serve cached LLM answers for near-duplicate questions (see faq_cache.py)
+faq_cache = create_faq_cache_from_env(exclude_answers=[
+    "ขอโทษครับ ขณะนี้ระบบตอบคำถามไม่สามารถใช้งานได้ 🙏\n\nคุณสามารถส่งรูปน้องหมามาให้ผมทายสายพันธุ์ได้เลยครับ 🐶",
+])
+
 # Define class names for the prediction
 class_names = ['Afghan_hound', 'African_hunting_dog', 'Airedale', 'American_Staffordshire_terrier', 
                'Appenzeller', 'Australian_terrier', 'Bedlington_terrier', 'Bernese_mountain_dog', 
@@ -74,14 +97,38 @@ class_names = ['Afghan_hound', 'African_hunting_dog', 'Airedale', 'American_Staf
                'standard_poodle', 'standard_schnauzer', 'toy_poodle', 'toy_terrier', 'vizsla', 'whippet', 
                'wire-haired_fox_terrier']
 
+# Greetings, help and breed-name lookups answered locally (see intent_router.py / intents.json)
+intent_router = create_intent_router_from_env(class_names)
+
 # Load ONNX model
 print("Loading ONNX model...")
 onnx_model_path = "dog_breed_model.onnx"
 
-# Create ONNX Runtime session
-ort_session = ort.InferenceSession(onnx_model_path)
+def warm_session(ort_session):
+    """Dummy batches before a reloaded session serves; rejects models with the wrong classes."""
+    outputs = ort_session.run(None, {'input': np.zeros((1, 3, 224, 224), dtype=np.float32)})[0]
+    if outputs.shape != (1, len(class_names)):
+        raise ValueError(f"model outputs {outputs.shape}, expected (1, {len(class_names)})")
+    # Only called on reload, so tta (set up below) exists by then
+    batch_sizes = batch_sizes_from_env(tta.batch_size if tta is not None else 0)
+    warm_forward(lambda batch: ort_session.run(None, {'input': batch})[0], batch_sizes, warm_rounds())
+
+# Create ONNX Runtime session, replaceable without a restart (see model_registry.py)
+model_registry = create_model_registry_from_env(onnx_model_path, ort.InferenceSession, warm=warm_session)
 print("ONNX model loaded successfully!")
 
+def full_forward(batch):
+    with model_registry.acquire() as ort_session:
+        return ort_session.run(None, {'input': batch})[0]
+
+# Optional (CASCADE=1): int8 copy of this model first, fp32 only when it is unsure (see cascade.py)
+cascade = create_cascade_from_env(full_forward, onnx_model_path)
+if cascade is not None:
+    warn_not_reloaded("the cascade's int8 fast model (CASCADE=1)")
+
+# Optional (TTA=1): flipped / cropped views in one batch when the first pass is unsure (see tta.py)
+tta = create_tta_from_env(full_forward, first_pass=cascade.predict_probs if cascade else None)
+
 # ImageNet normalization values (same as PyTorch)
 IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
 IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
@@ -187,6 +234,7 @@ def log_conversation(user_id, question, answer, response_time, thinking_content=
             
         print(f"Logged to {csv_filename}: {user_id} - {question[:30]}...")
     except Exception as e:
+        metrics.LOG_WRITE_FAILURES.inc()
         print(f"Error logging to CSV: {e}")
 
 
@@ -200,6 +248,11 @@ def predict_pil(image):
     Returns:
         List of tuples: [(breed_name, confidence), ...]
     """
+    if tta is not None:
+        return tta.predict_pil(image)
+    if cascade is not None:
+        return cascade.predict_pil(image)
+
     # Ensure image is in RGB mode
     if image.mode != 'RGB':
         image = image.convert('RGB')
@@ -208,7 +261,8 @@ def predict_pil(image):
     input_tensor = preprocess_image(image)
     
     # Run inference with ONNX Runtime
-    outputs = ort_session.run(None, {'input': input_tensor.astype(np.float32)})
+    with model_registry.acquire() as ort_session:
+        outputs = ort_session.run(None, {'input': input_tensor.astype(np.float32)})
     
     # Apply softmax to get probabilities
     probs = softmax(outputs[0])
@@ -224,9 +278,17 @@ def predict_pil(image):
     ]
 
 
+# Thai LLM first; LLM_BACKENDS can add fallbacks (see llm_router.py)
+llm_router = create_llm_router_from_env(default="thai_llm")
+
+# Identical Thai LLM requests in flight share one upstream call
+llm_flights = SingleFlight("thai_llm")
+
+
 def ask_thai_llm(user_message, max_tokens=2048, temperature=0.3):
     """
     Ask Thai LLM API a question
+    Identical requests already in flight share one upstream call (see singleflight.py).
     
     Args:
         user_message: User's question/message
@@ -236,61 +298,31 @@ def ask_thai_llm(user_message, max_tokens=2048, temperature=0.3):
     Returns:
         tuple: (full_response_with_think, thinking_content, clean_response) or (None, None, None) if error
     """
-    try:
-        headers = {
-            "Content-Type": "application/json",
-            "apikey": thai_llm_api_key
-        }
-        
-        payload = {
-            "model": thai_llm_model,
-            "messages": [
-                {"role": "user", "content": user_message}
-            ],
-            "max_tokens": max_tokens,
-            "temperature": temperature
-        }
-        
-        print(f"Calling Thai LLM API for: {user_message[:50]}...")
-        
-        response = requests.post(
-            thai_llm_url,
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            
-            # Extract response from the API result
-            if 'choices' in result and len(result['choices']) > 0:
-                full_message = result['choices'][0]['message']['content']
-                
-                # Extract thinking and clean text
-                thinking_content, clean_text = extract_think_tags(full_message)
-                
-                print(f"Thai LLM response received: {clean_text[:50]}...")
-                if thinking_content:
-                    print(f"Thinking process captured: {thinking_content[:50]}...")
-                
-                return full_message, thinking_content, clean_text
-            else:
-                print(f"Unexpected API response structure: {result}")
-                return None, None, None
-        else:
-            print(f"Thai LLM API error: {response.status_code} - {response.text}")
-            return None, None, None
-            
-    except requests.exceptions.Timeout:
-        print("Thai LLM API timeout")
-        return None, None, None
-    except Exception as e:
-        print(f"Thai LLM error: {e}")
-        import traceback
-        traceback.print_exc()
+    key = request_key({
+        "model": thai_llm_model,
+        "messages": [{"role": "user", "content": user_message}],
+        "max_tokens": max_tokens,
+        "temperature": temperature
+    })
+    return llm_flights.do(key, call_thai_llm, user_message, max_tokens, temperature)
+
+
+def call_thai_llm(user_message, max_tokens=2048, temperature=0.3):
+    """Send one request to the LLM backends (use ask_thai_llm, which coalesces identical calls)."""
+    print(f"Calling Thai LLM API for: {user_message[:50]}...")
+    result = llm_router.complete(user_message, max_tokens, temperature)
+    if result is None:
         return None, None, None
 
+    # Extract thinking and clean text
+    thinking_content, clean_text = extract_think_tags(result.text)
+
+    print(f"LLM response received from {result.backend}: {clean_text[:50]}...")
+    if thinking_content:
+        print(f"Thinking process captured: {thinking_content[:50]}...")
+
+    return result.text, thinking_content, clean_text
+
 
 def get_dog_breed_info(breed_name, top3_breeds):
     """
@@ -336,26 +368,79 @@ def get_dog_breed_info(breed_name, top3_breeds):
         return None, None
 
 
+# Dummy batches of the served sizes, then predict_pil, before serving; GET /ready reports
+# the warm-up state (see warmup.py)
+readiness = start_warmup_from_env(
+    predict_pil, forward=full_forward, extra_batch_sizes=(tta.batch_size,) if tta is not None else ())
+
+
 app = Flask(__name__)
 
-# Ensure "images" folder exists
-if not os.path.exists("images"):
-    os.makedirs("images")
+# Store each unique photo once under images/ab/cd/<sha256>.jpg (see image_store.py),
+# written by a background thread after the reply has been sent
+image_store = create_image_store_from_env()
+image_writer = create_image_writer_from_env(image_store, class_names)
+
+# Photos that may not be dogs get a caveat and skip the LLM call (see dog_gate.py)
+dog_gate = create_dog_gate_from_env()
+NOT_A_DOG_CAVEAT = "🤔 รูปนี้อาจไม่ใช่น้องหมานะครับ ผลทายด้านล่างจึงอาจไม่แม่นยำ"
+
+# Admission control: bounded in-flight work per image pipeline stage (see admission.py)
+admission = create_admission_from_env()
+BUSY_REPLY = "ขณะนี้มีผู้ใช้งานจำนวนมาก 🙏 กรุณาส่งรูปน้องหมาอีกครั้งในอีกสักครู่นะครับ 🐶"
 
 @app.route("/", methods=["GET", "POST"])
 def home():
+    webhook_start = time.perf_counter()
+    metrics.QUEUE_DEPTH.inc(queue="webhook")
+    status = "ok"
     try:
         signature = request.headers["X-Line-Signature"]
         body = request.get_data(as_text=True)
         handler.handle(body, signature)
     except Exception as e:
+        status = "error"
         print("Error:", e)
+    finally:
+        metrics.QUEUE_DEPTH.dec(queue="webhook")
+        metrics.WEBHOOK_REQUESTS.inc(status=status)
+        metrics.WEBHOOK_LATENCY.observe(time.perf_counter() - webhook_start)
     
     return "Hello Line Chatbot - PythonAnywhere Edition"
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus-style metrics (counters, latency histograms, queue depths)."""
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+@app.route("/ready", methods=["GET"])
+def ready_endpoint():
+    """Readiness probe: 200 once startup warm-up is done, 503 while warming or if it failed."""
+    return Response(json.dumps(readiness.describe()), status=200 if readiness.ready else 503,
+                    mimetype="application/json")
+
+@app.route("/admin/reload-model", methods=["POST"])
+def reload_model_endpoint():
+    """Load, warm and swap in dog_breed_model.onnx in the background (requires ADMIN_TOKEN)."""
+    if not admin_authorized(request.headers.get("Authorization")):
+        return Response("Forbidden", status=403)
+    started = model_registry.reload_in_background()
+    return Response(json.dumps({"reloading": True, "started": started, "version": model_registry.version}),
+                    status=202, mimetype="application/json")
+
+@app.route("/admin/model", methods=["GET"])
+def model_status_endpoint():
+    """Serving model version, draining versions and the last reload error."""
+    if not admin_authorized(request.headers.get("Authorization")):
+        return Response("Forbidden", status=403)
+    return Response(json.dumps(model_registry.describe()), mimetype="application/json")
+
 # Handle text messages
 @handler.add(MessageEvent, message=TextMessage)
 def handle_text_message(event):
+    if not event_guard.admit(event, "text"):
+        return
+    metrics.MESSAGES.inc(type="text")
     start_time = time.time()
     
     text = event.message.text
@@ -363,30 +448,31 @@ def handle_text_message(event):
     
     print(f"Received text from {user_id}: {text}")
 
-    # Predefined responses (optional - for quick replies)
-    quick_responses = {
-        "สวัสดี": "สวัสดีครับ ยินดีที่ได้รู้จักนะครับ 😊",
-        "ชื่ออะไร": "ผมชื่อไลน์บอทครับ สามารถส่งรูปน้องหมามาให้ผมทายสายพันธุ์ได้เลยครับ 🐶",
-    }
-
     thinking_content = ''
     
-    # Check if there's a quick response
-    if text in quick_responses:
-        reply_text = quick_responses[text]
+    # Resolve greetings, help and breed lookups locally, then try a cached answer to a near-duplicate question
+    intent = intent_router.route(text)
+    cached_answer = None if intent else faq_cache.lookup(text)
+    if intent:
+        reply_text = intent.reply
+    elif cached_answer is not None:
+        reply_text = cached_answer
     else:
         # Use Thai LLM API for general chat
-        full_response, thinking, clean_response = ask_thai_llm(text)
+        with metrics.STAGE_LATENCY.time(stage="llm"):
+            full_response, thinking, clean_response = ask_thai_llm(text)
         
         if clean_response:
             reply_text = clean_response
+            faq_cache.add(text, clean_response)
             thinking_content = thinking or ''
         else:
             # Fallback if LLM is not available
             reply_text = "ขอโทษครับ ขณะนี้ระบบตอบคำถามไม่สามารถใช้งานได้ 🙏\n\nคุณสามารถส่งรูปน้องหมามาให้ผมทายสายพันธุ์ได้เลยครับ 🐶"
     
     # Send reply (without <think> tags)
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
+    with metrics.STAGE_LATENCY.time(stage="reply"):
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
     
     # Calculate response time
     response_time = time.time() - start_time
@@ -397,38 +483,52 @@ def handle_text_message(event):
 # Handle image messages
 @handler.add(MessageEvent, message=ImageMessage)
 def handle_image_message(event):
+    if not event_guard.admit(event, "image"):
+        return
+    metrics.MESSAGES.inc(type="image")
     start_time = time.time()
-    
-    message_id = event.message.id
-    user_id = event.source.user_id
 
-    # Get current time in the format YYYY_MM_DD_HH_MM_SS
-    timestamp = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+    try:
+        with admission.stage("pipeline"):
+            process_image_message(event, start_time)
+    except Shed:
+        reply_busy(event, start_time)
 
-    # Construct the image filename with timestamp and message_id
-    image_filename = f"{timestamp}_{message_id}.jpg"
-    image_path = os.path.join("images", image_filename)
+
+def reply_busy(event, start_time):
+    """Fast degraded reply when admission control sheds an image."""
+    try:
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=BUSY_REPLY))
+        log_conversation(event.source.user_id, "[IMAGE] Busy", BUSY_REPLY, time.time() - start_time)
+    except Exception as e:
+        print(f"Error sending busy reply: {e}")
+
+
+def process_image_message(event, start_time):
+    """Download, predict, ask the LLM and reply (each stage behind admission control)."""
+    message_id = event.message.id
+    user_id = event.source.user_id
 
     try:
         # Download image from LINE server
-        message_content = line_bot_api.get_message_content(message_id)
-        
-        image_bytes = BytesIO()
+        with admission.stage("download"):
+            stage_start = time.perf_counter()
+            message_content = line_bot_api.get_message_content(message_id)
 
-        # Save to both disk and memory
-        with open(image_path, "wb") as img_file:
+            image_bytes = BytesIO()
             for chunk in message_content.iter_content(chunk_size=1024):
-                img_file.write(chunk)      # save to disk
-                image_bytes.write(chunk)   # keep in memory
+                image_bytes.write(chunk)
 
-        image_bytes.seek(0)
-        print(f"Image saved at: {image_path}")
+            image_bytes.seek(0)
+            metrics.STAGE_LATENCY.observe(time.perf_counter() - stage_start, stage="download")
 
         # Load image from memory
         image = Image.open(image_bytes).convert("RGB")
         
         # Predict top 3 classes and confidence scores
-        top3_predictions = predict_pil(image)
+        with admission.stage("inference"):
+            with metrics.STAGE_LATENCY.time(stage="inference"):
+                top3_predictions = predict_pil(image)
         
         print(f"Top 3 Predictions: {top3_predictions}")
         
@@ -443,9 +543,19 @@ def handle_image_message(event):
         
         print(f"Prediction results:\n{prediction_text}")
         
-        # Get detailed information from LLM about the breeds
-        print("Getting breed information from Thai LLM...")
-        breed_info, thinking_content = get_dog_breed_info(top3_predictions[0][0], top3_predictions)
+        # Get detailed information from LLM about the breeds (photos that may not be dogs skip it,
+        # and so does everyone while the LLM stage is saturated: prediction only)
+        breed_info, thinking_content = None, None
+        if dog_gate.is_dog(top3_predictions):
+            with admission.try_stage("llm") as admitted:
+                if admitted:
+                    print("Getting breed information from Thai LLM...")
+                    with metrics.STAGE_LATENCY.time(stage="llm"):
+                        breed_info, thinking_content = get_dog_breed_info(top3_predictions[0][0], top3_predictions)
+                else:
+                    print("LLM stage saturated, replying with the prediction only")
+        else:
+            initial_reply = f"{NOT_A_DOG_CAVEAT}\n\n{initial_reply}"
         
         # Combine prediction and breed info
         if breed_info:
@@ -454,24 +564,31 @@ def handle_image_message(event):
             full_reply = initial_reply
         
         # Reply to the user
-        line_bot_api.reply_message(
-            event.reply_token, 
-            TextSendMessage(text=full_reply)
-        )
+        with metrics.STAGE_LATENCY.time(stage="reply"):
+            line_bot_api.reply_message(
+                event.reply_token, 
+                TextSendMessage(text=full_reply)
+            )
         
+        # Persist the photo in the background, after the user has their answer (see image_writer.py)
+        image_writer.submit(image_bytes.getvalue(), message_id, user_id, top3_predictions)
+
         # Calculate response time
         response_time = time.time() - start_time
         
         # Log conversation (with thinking process if available)
         log_conversation(
             user_id, 
-            f"[IMAGE] {image_filename}", 
+            f"[IMAGE] {message_id}", 
             full_reply, 
             response_time,
             thinking_content or ''
         )
         
+    except Shed:
+        raise
     except Exception as e:
+        metrics.HANDLER_ERRORS.inc(type="image")
         print(f"Error in handle_image_message: {e}")
         import traceback
         traceback.print_exc()
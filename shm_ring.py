@@ -0,0 +1,101 @@
+"""
+Shared-memory slot ring for passing tensors between processes
+One shared-memory block holds a fixed number of slots. Each slot has room for a
+preprocessed input batch (max_batch, 3, 224, 224) and its logits (max_batch, num_classes).
+The web side copies a batch into a free slot and passes only a small SlotHandle
+(slot index + batch size) to the model side, which reads the input and writes the logits
+in place. Handing an image to the model is a memcpy, not a pickle round trip.
+
+Example:
+    ring = SlotRing(num_slots=8, max_batch=8, input_shape=(3, 224, 224), num_classes=120)
+    slot = ring.acquire()
+    handle = ring.write_input(slot, batch)          # -> SlotHandle(slot, batch_size)
+    ...                                             # send handle to another process
+    logits = ring.read_output(handle)
+    ring.release(slot)
+
+    # in the other process
+    ring = SlotRing.attach(spec)                    # spec = ring.spec()
+    ring.output_view(handle)[:] = model(ring.input_view(handle))
+"""
+
+import queue
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+SlotHandle = namedtuple("SlotHandle", ["slot", "batch_size"])
+
+
+class SlotRing:
+    """Fixed-size float32 input/output slots in a single shared-memory block."""
+
+    def __init__(self, num_slots, max_batch, input_shape, num_classes, name=None):
+        self.num_slots = num_slots
+        self.max_batch = max_batch
+        self.input_shape = tuple(input_shape)
+        self.num_classes = num_classes
+        self.owner = name is None
+
+        input_bytes = num_slots * max_batch * int(np.prod(self.input_shape)) * 4
+        output_bytes = num_slots * max_batch * num_classes * 4
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=input_bytes + output_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self.inputs = np.ndarray((num_slots, max_batch) + self.input_shape, dtype=np.float32,
+                                 buffer=self.shm.buf)
+        self.outputs = np.ndarray((num_slots, max_batch, num_classes), dtype=np.float32,
+                                  buffer=self.shm.buf, offset=input_bytes)
+
+        # Only the creating process hands out slots
+        self._free = queue.Queue()
+        if self.owner:
+            for slot in range(num_slots):
+                self._free.put(slot)
+
+    def spec(self):
+        """Picklable description used by SlotRing.attach in another process."""
+        return {"name": self.shm.name, "num_slots": self.num_slots, "max_batch": self.max_batch,
+                "input_shape": self.input_shape, "num_classes": self.num_classes}
+
+    @classmethod
+    def attach(cls, spec):
+        return cls(spec["num_slots"], spec["max_batch"], spec["input_shape"], spec["num_classes"],
+                   name=spec["name"])
+
+    def free_slots(self):
+        return self._free.qsize()
+
+    def acquire(self, timeout=None):
+        """Take a free slot index, blocking until one is available (queue.Empty on timeout)."""
+        return self._free.get(timeout=timeout)
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def write_input(self, slot, batch):
+        """Copy a (N, *input_shape) batch into the slot and return its handle."""
+        batch_size = batch.shape[0]
+        if batch_size > self.max_batch:
+            raise ValueError(f"batch of {batch_size} does not fit a slot of {self.max_batch}")
+        self.inputs[slot, :batch_size] = batch
+        return SlotHandle(slot, batch_size)
+
+    def input_view(self, handle):
+        return self.inputs[handle.slot, :handle.batch_size]
+
+    def output_view(self, handle):
+        return self.outputs[handle.slot, :handle.batch_size]
+
+    def read_output(self, handle):
+        """Copy the logits out so the slot can be reused."""
+        return self.output_view(handle).copy()
+
+    def close(self):
+        del self.inputs, self.outputs
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
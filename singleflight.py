@@ -0,0 +1,127 @@
+"""
+Single-flight coalescing for LLM calls
+When several users send the same breed photo or the same popular question at the same
+time, identical LLM requests would otherwise go upstream concurrently. A SingleFlight
+group lets the first caller (the leader) make the upstream call while identical callers
+that arrive before it finishes wait for, and share, the leader's result.
+
+Only requests that are in flight at the same moment are merged - nothing is cached.
+
+Example:
+    llm_flights = SingleFlight("thai_llm")
+    key = request_key(payload)                     # model, messages, max_tokens, temperature
+    result = llm_flights.do(key, post_to_llm, headers, payload)
+
+    # asyncio version (main_async.py)
+    llm_flights = AsyncSingleFlight("thai_llm")
+    result = await llm_flights.do(key, post_to_llm, session, headers, payload)
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+
+import metrics
+
+LLM_KEY_FIELDS = ("model", "messages", "max_tokens", "temperature")
+
+
+def request_key(payload, fields=LLM_KEY_FIELDS):
+    """Stable hash of the payload fields that determine the LLM answer."""
+    subset = {field: payload.get(field) for field in fields}
+    encoded = json.dumps(subset, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    """One upstream call shared by its leader and any followers."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Thread-based single-flight group (Flask / Waitress entry points)."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.LLM_COALESCED.inc(backend=self.backend)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        return len(self._calls)
+
+
+class _AsyncCall:
+    """One upstream task shared by every caller awaiting it."""
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """asyncio single-flight group (main_async.py); must be used from one event loop."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._calls = {}
+
+    async def do(self, key, coro_fn, *args, **kwargs):
+        call = self._calls.get(key)
+        if call is None:
+            # The upstream call runs in its own task, so cancelling the caller that started
+            # it (e.g. its webhook timed out) does not cancel it for everyone else
+            call = self._calls[key] = _AsyncCall(asyncio.ensure_future(coro_fn(*args, **kwargs)))
+            call.task.add_done_callback(lambda task: self._finished(key, call))
+        else:
+            metrics.LLM_COALESCED.inc(backend=self.backend)
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            # Nobody left to use the result: stop the upstream call
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _finished(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Mark the exception as retrieved even when every caller was cancelled
+        if not call.task.cancelled():
+            call.task.exception()
+
+    def in_flight(self):
+        return len(self._calls)
@@ -0,0 +1,59 @@
+"""Unit tests for active_learning: the uncertainty index and incremental selection."""
+
+import numpy as np
+import pytest
+
+from active_learning import UncertaintyIndex, uncertainty
+
+A, B, C = "aa" * 32, "bb" * 32, "cc" * 32
+
+
+def make_index(tmp_path):
+    index = UncertaintyIndex(str(tmp_path / "uncertainty.bin"), class_names=["pug", "boxer", "bulldog"])
+    # A is sent twice: once confidently, once close to a tie
+    index.append("1", A, [("pug", 0.9), ("boxer", 0.05), ("bulldog", 0.03)])
+    index.append("2", A, [("pug", 0.4), ("boxer", 0.35), ("bulldog", 0.2)])
+    index.append("3", B, [("pug", 0.5), ("boxer", 0.1), ("bulldog", 0.1)])
+    index.append("4", C, [("pug", 0.34), ("boxer", 0.33), ("bulldog", 0.33)])
+    return index
+
+
+def hashes(records):
+    return [record["sha256"].tobytes().hex() for record in records]
+
+
+def test_uncertainty_counts_the_remaining_mass():
+    entropy, margin = uncertainty([0.5, 0.5, 0.0])
+    assert entropy == pytest.approx(np.log(2))
+    assert margin == 0
+    entropy, _ = uncertainty([0.5, 0.25, 0.0])
+    assert entropy == pytest.approx(-0.5 * np.log(0.5) - 2 * 0.25 * np.log(0.25))
+
+
+def test_select_returns_one_record_per_image_ranked(tmp_path):
+    index = make_index(tmp_path)
+    assert index.stats()["records"] == 4 and index.stats()["unique_images"] == 3
+
+    by_entropy = index.select(top=10, by="entropy", mark=False)
+    assert hashes(by_entropy) == [A, B, C]
+    # The resend's most uncertain record stands for the image
+    assert by_entropy[0]["message_id"] == 2
+    assert index.describe(by_entropy[0]) == "pug 40%, boxer 35%, bulldog 20%"
+
+    by_margin = index.select(top=10, by="margin", mark=False)
+    assert hashes(by_margin) == [C, A, B]
+    assert index.stats()["selected"] == 0
+
+
+def test_second_select_skips_images_handed_out(tmp_path):
+    index = make_index(tmp_path)
+    assert hashes(index.select(top=1)) == [A]
+    # Both records of A are flagged, so A never comes back
+    assert index.stats()["selected"] == 2
+    assert hashes(index.select(top=10)) == [B, C]
+    assert len(index.select(top=10)) == 0
+
+
+def test_unknown_ranking_is_an_error(tmp_path):
+    with pytest.raises(ValueError):
+        make_index(tmp_path).select(by="confidence")
@@ -0,0 +1,175 @@
+"""Unit tests for admission.StageLimiter and AdmissionController."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, Shed, StageLimiter
+
+
+def test_limiter_admits_up_to_max_in_flight_then_sheds_without_queue():
+    limiter = StageLimiter("test_no_queue", max_in_flight=2, max_queue=0, queue_timeout=1)
+    assert limiter.acquire() and limiter.acquire()
+    assert not limiter.acquire()
+    assert limiter.shed == 1
+    limiter.release()
+    assert limiter.acquire()
+
+
+def test_waiter_is_admitted_when_a_place_frees_up():
+    limiter = StageLimiter("test_wait", max_in_flight=1, max_queue=1, queue_timeout=5)
+    assert limiter.acquire()
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(limiter.acquire()))
+    waiter.start()
+    while limiter.waiting == 0:
+        time.sleep(0.01)
+    limiter.release()
+    waiter.join(timeout=5)
+    assert results == [True]
+    assert limiter.in_flight == 1 and limiter.waiting == 0
+
+
+def test_waiter_is_shed_after_queue_timeout():
+    limiter = StageLimiter("test_timeout", max_in_flight=1, max_queue=1, queue_timeout=0.05)
+    assert limiter.acquire()
+    start = time.perf_counter()
+    assert not limiter.acquire()
+    assert time.perf_counter() - start >= 0.05
+    assert limiter.waiting == 0 and limiter.shed == 1
+
+
+def test_full_queue_sheds_immediately():
+    limiter = StageLimiter("test_full_queue", max_in_flight=1, max_queue=1, queue_timeout=5)
+    assert limiter.acquire()
+    waiter = threading.Thread(target=limiter.acquire)
+    waiter.start()
+    while limiter.waiting == 0:
+        time.sleep(0.01)
+    start = time.perf_counter()
+    assert not limiter.acquire()
+    assert time.perf_counter() - start < 1
+    limiter.release()
+    waiter.join(timeout=5)
+
+
+def test_zero_limit_means_unlimited():
+    limiter = StageLimiter("test_unlimited", max_in_flight=0, max_queue=0, queue_timeout=0)
+    assert all(limiter.acquire() for _ in range(100))
+
+
+def test_stage_raises_shed_and_releases_on_exit():
+    admission = AdmissionController({"test_stage": 1}, max_queue=0)
+    with admission.stage("test_stage"):
+        with pytest.raises(Shed) as excinfo:
+            with admission.stage("test_stage"):
+                pass
+        assert excinfo.value.stage == "test_stage"
+    with admission.stage("test_stage"):
+        pass
+    assert admission.limiters["test_stage"].in_flight == 0
+
+
+def test_try_stage_yields_false_when_saturated():
+    admission = AdmissionController({"test_try": 1}, max_queue=0)
+    with admission.try_stage("test_try") as first:
+        with admission.try_stage("test_try") as second:
+            assert first and not second
+    assert admission.limiters["test_try"].in_flight == 0
+    assert admission.shed_counts() == {"test_try": 1}
+
+
+def test_unknown_stage_is_not_limited():
+    admission = AdmissionController({})
+    with admission.stage("download"):
+        pass
+    with admission.try_stage("llm") as admitted:
+        assert admitted
+
+
+def test_async_stage_waits_off_the_event_loop():
+    admission = AdmissionController({"test_async": 1}, max_queue=1, queue_timeout=5)
+
+    async def main():
+        ticks = 0
+
+        async def holder():
+            async with admission.stage_async("test_async"):
+                await asyncio.sleep(0.1)
+
+        async def ticker():
+            nonlocal ticks
+            for _ in range(5):
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        async def waiter():
+            await asyncio.sleep(0.01)
+            async with admission.try_stage_async("test_async") as admitted:
+                return admitted
+
+        _, _, admitted = await asyncio.gather(holder(), ticker(), waiter())
+        return ticks, admitted
+
+    ticks, admitted = asyncio.run(main())
+    # The loop kept running while the waiter was queued, and the waiter got in
+    assert ticks == 5 and admitted
+    assert admission.limiters["test_async"].in_flight == 0
+
+
+def test_async_stage_raises_shed():
+    admission = AdmissionController({"test_async_shed": 1}, max_queue=0)
+
+    async def main():
+        async with admission.stage_async("test_async_shed"):
+            with pytest.raises(Shed):
+                async with admission.stage_async("test_async_shed"):
+                    pass
+
+    asyncio.run(main())
+    assert admission.limiters["test_async_shed"].in_flight == 0
+
+
+def test_async_waiter_is_shed_after_queue_timeout_without_a_thread():
+    limiter = StageLimiter("test_async_timeout", max_in_flight=1, max_queue=1, queue_timeout=0.05)
+    assert limiter.acquire()
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        loop.run_in_executor = None  # any executor hop would fail
+        return await limiter.acquire_async()
+
+    assert asyncio.run(main()) is False
+    assert (limiter.in_flight, limiter.waiting, limiter.shed) == (1, 0, 1)
+
+
+def test_release_from_a_thread_hands_the_place_to_a_queued_coroutine():
+    limiter = StageLimiter("test_async_handoff", max_in_flight=1, max_queue=1, queue_timeout=5)
+    assert limiter.acquire()
+
+    async def main():
+        threading.Timer(0.05, limiter.release).start()
+        return await limiter.acquire_async()
+
+    assert asyncio.run(main())
+    assert (limiter.in_flight, limiter.waiting) == (1, 0)
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    limiter = StageLimiter("test_async_cancel", max_in_flight=1, max_queue=1, queue_timeout=5)
+    assert limiter.acquire()
+
+    async def main():
+        task = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        assert limiter.waiting == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert (limiter.in_flight, limiter.waiting) == (1, 0)
+    limiter.release()
+    assert limiter.in_flight == 0
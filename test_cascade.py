@@ -0,0 +1,103 @@
+"""Unit tests for cascade: escalation of unsure rows and the static int8 fast model."""
+
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import dog_model
+from cascade import CascadeClassifier, load_fast_forward
+
+
+def logits(*rows):
+    return np.log(np.array(rows, dtype=np.float32))
+
+
+def test_only_unsure_rows_reach_the_full_model():
+    full_batches = []
+
+    def full_forward(batch):
+        full_batches.append(batch)
+        return logits(*[[0.1, 0.9]] * len(batch))
+
+    cascade = CascadeClassifier(lambda batch: logits([0.95, 0.05], [0.6, 0.4]), full_forward, min_confidence=0.8)
+    probs = cascade.predict_probs(np.arange(2, dtype=np.float32).reshape(2, 1))
+    assert [batch.tolist() for batch in full_batches] == [[[1.0]]]
+    assert np.allclose(probs, [[0.95, 0.05], [0.1, 0.9]])
+
+
+def test_margin_escalates_close_calls():
+    cascade = CascadeClassifier(None, None, min_confidence=0.5, min_margin=0.3)
+    assert cascade.confident(np.array([0.7, 0.2, 0.1]))
+    assert not cascade.confident(np.array([0.55, 0.45, 0.0]))
+
+
+def tiny_onnx_model(path):
+    """Conv -> Relu -> GlobalAveragePool -> Gemm, with the served input name and shape."""
+    onnx = pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(0)
+    weights = [
+        numpy_helper.from_array(rng.normal(size=(8, 3, 3, 3)).astype(np.float32), "conv_w"),
+        numpy_helper.from_array(np.zeros(8, np.float32), "conv_b"),
+        numpy_helper.from_array(rng.normal(size=(8, 5)).astype(np.float32), "fc_w"),
+        numpy_helper.from_array(np.zeros(5, np.float32), "fc_b"),
+    ]
+    nodes = [
+        helper.make_node("Conv", ["input", "conv_w", "conv_b"], ["conv"], pads=[1, 1, 1, 1]),
+        helper.make_node("Relu", ["conv"], ["relu"]),
+        helper.make_node("GlobalAveragePool", ["relu"], ["pool"]),
+        helper.make_node("Flatten", ["pool"], ["flat"]),
+        helper.make_node("Gemm", ["flat", "fc_w", "fc_b"], ["output"]),
+    ]
+    graph = helper.make_graph(
+        nodes, "tiny",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, ["batch_size", 3, 224, 224])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, ["batch_size", 5])],
+        weights)
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)], ir_version=7), path)
+    return path
+
+
+def photos(directory, count=4):
+    os.makedirs(directory)
+    rng = np.random.default_rng(1)
+    for index in range(count):
+        pixels = rng.integers(0, 255, (64, 64, 3), dtype=np.uint8)
+        Image.fromarray(pixels, "RGB").save(os.path.join(directory, f"{index}.jpg"))
+    return directory
+
+
+def test_fast_model_is_statically_quantized(tmp_path):
+    source = tiny_onnx_model(str(tmp_path / "model.onnx"))
+    target = str(tmp_path / "model.int8.onnx")
+    forward = load_fast_forward(target, source, calibration_dir=photos(str(tmp_path / "images")))
+
+    import onnx
+
+    ops = {node.op_type for node in onnx.load(target).graph.node}
+    assert {"QuantizeLinear", "DequantizeLinear"} <= ops
+    assert "ConvInteger" not in ops
+    batch = dog_model.preprocess_batch([Image.new("RGB", (64, 64))] * 2)
+    assert forward(batch).shape == (2, 5)
+
+
+def test_fast_model_is_rebuilt_when_the_checkpoint_is_newer(tmp_path):
+    source = tiny_onnx_model(str(tmp_path / "model.onnx"))
+    target = str(tmp_path / "model.int8.onnx")
+    calibration_dir = photos(str(tmp_path / "images"))
+    load_fast_forward(target, source, calibration_dir=calibration_dir)
+    built = os.path.getmtime(target)
+
+    os.utime(source, (built + 10, built + 10))
+    load_fast_forward(target, source, calibration_dir=calibration_dir)
+    assert os.path.getmtime(target) > built
+
+
+def test_no_calibration_photos_is_an_error(tmp_path):
+    source = tiny_onnx_model(str(tmp_path / "model.onnx"))
+    with pytest.raises(ValueError):
+        load_fast_forward(str(tmp_path / "model.int8.onnx"), source, calibration_dir=str(tmp_path / "none"))
@@ -0,0 +1,195 @@
+"""Unit tests for circuit_breaker (closed / open / half-open, adaptive timeout) and LLM router failover."""
+
+import asyncio
+
+import pytest
+
+import circuit_breaker
+from circuit_breaker import AdaptiveTimeout, CircuitBreaker
+from llm_router import LLMBackend, LLMRouter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    return clock
+
+
+def open_breaker(clock, **kwargs):
+    breaker = CircuitBreaker("test", failure_threshold=2, cooldown=10, max_cooldown=40, **kwargs)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == "open"
+    return breaker
+
+
+def test_consecutive_failures_open_the_circuit(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_half_open_after_cooldown_limits_trials(clock):
+    breaker = open_breaker(clock, half_open_max_calls=1)
+    clock.now += 9
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # Only one trial at a time
+    assert not breaker.allow()
+
+
+def test_successful_trials_close_the_circuit(clock):
+    breaker = open_breaker(clock, success_threshold=2)
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.cooldown == 10
+
+
+def test_failed_trial_reopens_with_doubled_cooldown(clock):
+    breaker = open_breaker(clock)
+    for expected in (20, 40, 40):
+        clock.now += breaker.cooldown
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == "open"
+        assert breaker.cooldown == expected
+    clock.now += 39
+    assert not breaker.allow()
+
+
+def test_adaptive_timeout_follows_latency_within_bounds():
+    timeout = AdaptiveTimeout(max_timeout=30, min_timeout=5, percentile=99, multiplier=2, min_samples=3)
+    timeout.observe(4)
+    timeout.observe(4)
+    assert timeout.current() == 30
+    timeout.observe(4)
+    assert timeout.current() == 8
+    for _ in range(10):
+        timeout.observe(0.1)
+    assert timeout.current() == 8  # p99 still includes the 4 s calls
+    assert AdaptiveTimeout(min_samples=0, enabled=False).current() == 30
+
+
+class FakeBackend(LLMBackend):
+    def __init__(self, name, answer, delay=0.0, breaker=None):
+        super().__init__(name, timeout=AdaptiveTimeout(),
+                         breaker=breaker or CircuitBreaker(name, failure_threshold=1))
+        self.answer = answer
+        self.delay = delay
+        self.calls = 0
+
+    def _request(self, prompt, max_tokens, temperature, timeout):
+        self.calls += 1
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
+
+    async def _request_async(self, session, prompt, max_tokens, temperature, timeout):
+        await asyncio.sleep(self.delay)
+        return self._request(prompt, max_tokens, temperature, timeout)
+
+
+def test_router_fails_over_and_skips_open_circuits(clock):
+    primary = FakeBackend("test_primary", RuntimeError("down"))
+    secondary = FakeBackend("test_secondary", "คำตอบ")
+    router = LLMRouter([primary, secondary], hedge=False)
+    try:
+        assert router.complete("สวัสดี") == ("คำตอบ", "test_secondary")
+        assert primary.breaker.state == "open"
+        # The open primary is skipped without a call
+        assert router.complete("สวัสดี") == ("คำตอบ", "test_secondary")
+        assert primary.calls == 1
+    finally:
+        router.close()
+
+
+def test_router_returns_none_when_every_circuit_is_open(clock):
+    backend = FakeBackend("test_only", RuntimeError("down"))
+    router = LLMRouter([backend])
+    assert router.complete("สวัสดี") is None
+    assert router.complete("สวัสดี") is None
+    assert backend.calls == 1
+
+
+# The async tests use the real clock: the event loop's timers run on time.monotonic too
+
+
+def test_async_router_fails_over_and_shares_the_breaker():
+    primary = FakeBackend("test_async_primary", RuntimeError("down"))
+    secondary = FakeBackend("test_async_secondary", "คำตอบ")
+    router = LLMRouter([primary, secondary], hedge=False)
+
+    async def main():
+        return [await router.complete_async(None, "สวัสดี") for _ in range(2)]
+
+    try:
+        assert asyncio.run(main()) == [("คำตอบ", "test_async_secondary")] * 2
+        # Opened by the async call, so the threaded path skips it as well
+        assert primary.breaker.state == "open" and primary.calls == 1
+        assert router.complete("สวัสดี") == ("คำตอบ", "test_async_secondary")
+        assert primary.calls == 1
+    finally:
+        router.close()
+
+
+def test_async_router_hedges_a_slow_backend():
+    primary = FakeBackend("test_async_slow", "ช้า", delay=1.0)
+    secondary = FakeBackend("test_async_fast", "เร็ว")
+    router = LLMRouter([primary, secondary], hedge_min_samples=1)
+    primary.stats.record(0.01, True)
+
+    async def main():
+        start = asyncio.get_running_loop().time()
+        result = await router.complete_async(None, "สวัสดี")
+        return result, asyncio.get_running_loop().time() - start
+
+    try:
+        result, elapsed = asyncio.run(main())
+        assert result == ("เร็ว", "test_async_fast")
+        assert elapsed < 0.5
+    finally:
+        router.close()
+
+
+def test_cancelled_async_call_frees_the_half_open_trial():
+    breaker = CircuitBreaker("test_async_trial", failure_threshold=1, cooldown=0.01)
+    backend = FakeBackend("test_async_trial", "คำตอบ", delay=5.0, breaker=breaker)
+    breaker.record_failure()
+    router = LLMRouter([backend])
+
+    async def main():
+        await asyncio.sleep(0.02)
+        call = asyncio.ensure_future(router.complete_async(None, "สวัสดี"))
+        await asyncio.sleep(0.01)
+        assert breaker.state == "half_open" and not breaker.allow()
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+
+    asyncio.run(main())
+    # Neither a failure (the circuit stays half-open) nor a leaked trial slot
+    assert breaker.state == "half_open"
+    assert breaker.allow()
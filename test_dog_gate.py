@@ -0,0 +1,34 @@
+"""Unit tests for dog_gate: OOD scores, the env default and threshold calibration."""
+
+import pytest
+
+from dog_gate import DogGate, calibrate, create_dog_gate_from_env
+
+DOG = [("pug", 0.6), ("boxer", 0.2), ("bulldog", 0.1)]
+CAT = [("pug", 0.1), ("chihuahua", 0.08), ("papillon", 0.05)]
+
+
+def test_scores():
+    assert DogGate("top3").score(DOG) == pytest.approx(0.9)
+    assert DogGate("msp").score(DOG) == pytest.approx(0.6)
+
+
+def test_gate_rejects_low_scores():
+    gate = DogGate("top3", threshold=0.4)
+    assert gate.is_dog(DOG)
+    assert not gate.is_dog(CAT)
+
+
+def test_gate_is_off_unless_configured(monkeypatch):
+    monkeypatch.delenv("DOG_GATE", raising=False)
+    assert create_dog_gate_from_env().is_dog(CAT)
+    monkeypatch.setenv("DOG_GATE", "top3")
+    assert not create_dog_gate_from_env().is_dog(CAT)
+
+
+def test_calibrate_keeps_the_requested_recall():
+    dogs = [[("pug", score)] for score in (0.3, 0.5, 0.7, 0.9)]
+    result = calibrate(dogs, [CAT], method="msp", recall=0.75)
+    assert result["threshold"] == 0.5
+    assert result["dog_recall"] == 0.75
+    assert result["other_rejected"] == 1.0
@@ -0,0 +1,47 @@
+"""Unit tests for embedding_index: the per-thread embedding capture and exact search."""
+
+import numpy as np
+import pytest
+
+from embedding_index import DIM, EmbeddingIndex, TorchEmbeddingCapture
+
+
+def test_capture_keeps_the_unaugmented_row():
+    torch = pytest.importorskip("torch")
+
+    class Net(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.fc = torch.nn.Linear(4, 2)
+
+        def forward(self, x):
+            return self.fc(x)
+
+    model = Net()
+    capture = TorchEmbeddingCapture(model)
+    original, views = torch.rand(1, 4), torch.rand(3, 4)
+    capture.reset()
+    # TTA: first pass on the photo, then one batch of augmented views
+    model(original)
+    model(views)
+    assert np.allclose(capture.pop(), original[0].numpy())
+    assert capture.pop() is None
+
+    # A forward pass of a failed prediction does not leak into the next one
+    model(views)
+    capture.reset()
+    assert capture.pop() is None
+
+
+def test_exact_search_skips_resends_and_weak_matches(tmp_path):
+    index = EmbeddingIndex(str(tmp_path), class_names=["pug", "shiba"])
+    rng = np.random.default_rng(0)
+    query = rng.normal(size=DIM).astype(np.float32)
+    index.add(query, "1", sha256="00" * 32, breed="pug")
+    index.add(query + 0.3 * rng.normal(size=DIM), "2", sha256="11" * 32, breed="shiba")
+    index.add(rng.normal(size=DIM), "3", sha256="22" * 32, breed="pug")
+
+    matches = index.search(query, k=3, min_similarity=0.8)
+    # Message 1 is the same photo sent again; message 3 is unrelated
+    assert [(match.message_id, match.breed) for match in matches] == [(2, "shiba")]
+    index.close()
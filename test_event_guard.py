@@ -0,0 +1,102 @@
+"""Unit tests for event_guard: TTL dedup, per-user token buckets and EventGuard.admit."""
+
+from types import SimpleNamespace
+
+import pytest
+
+import event_guard
+from event_guard import EventGuard, TokenBucketLimiter, TTLSeenSet
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(event_guard.time, "monotonic", clock)
+    return clock
+
+
+def event(message_id, user_id="U1", webhook_event_id=None):
+    return SimpleNamespace(
+        webhook_event_id=webhook_event_id,
+        message=SimpleNamespace(id=message_id),
+        source=SimpleNamespace(user_id=user_id),
+    )
+
+
+def test_seen_set_drops_keys_within_ttl_and_forgets_them_after(clock):
+    seen = TTLSeenSet(ttl=10)
+    assert not seen.check_and_add("a")
+    clock.now += 9
+    assert seen.check_and_add("a")
+    clock.now += 2
+    assert not seen.check_and_add("a")
+
+
+def test_seen_set_matches_any_key_and_remembers_all(clock):
+    seen = TTLSeenSet(ttl=10)
+    assert not seen.check_and_add("event:1", "message:1")
+    # A redelivery with a new webhook event ID still carries the same message ID
+    assert seen.check_and_add("event:2", "message:1")
+    assert seen.check_and_add("event:1")
+
+
+def test_seen_set_is_bounded(clock):
+    seen = TTLSeenSet(ttl=10, max_size=3)
+    for key in "abcde":
+        seen.check_and_add(key)
+    assert len(seen) <= 3
+    # The oldest keys were evicted first
+    assert not seen.check_and_add("a")
+
+
+def test_bucket_allows_burst_then_refills_at_rate(clock):
+    bucket = TokenBucketLimiter(rate=1.0, burst=3)
+    assert [bucket.allow("U1") for _ in range(4)] == [True, True, True, False]
+    clock.now += 1
+    assert bucket.allow("U1")
+    assert not bucket.allow("U1")
+    # Refill never exceeds the burst
+    clock.now += 100
+    assert [bucket.allow("U1") for _ in range(4)] == [True, True, True, False]
+
+
+def test_buckets_are_per_key(clock):
+    bucket = TokenBucketLimiter(rate=1.0, burst=1)
+    assert bucket.allow("U1")
+    assert not bucket.allow("U1")
+    assert bucket.allow("U2")
+
+
+def test_zero_rate_is_unlimited(clock):
+    bucket = TokenBucketLimiter(rate=0, burst=1)
+    assert all(bucket.allow("U1") for _ in range(100))
+
+
+def test_prune_keeps_partially_drained_buckets(clock):
+    bucket = TokenBucketLimiter(rate=1.0, burst=2, max_keys=2)
+    bucket.allow("U1")
+    bucket.allow("U1")
+    clock.now += 10
+    bucket.allow("U2")
+    clock.now += 0.5
+    # Hitting max_keys prunes U1 (refilled) but keeps U2 (still short of its burst)
+    bucket.allow("U3")
+    assert set(bucket._buckets) == {"U2", "U3"}
+
+
+def test_guard_drops_redelivery_and_rate_limited_users(clock):
+    guard = EventGuard(TTLSeenSet(ttl=60), {"image": TokenBucketLimiter(rate=1.0, burst=1)})
+    assert guard.admit(event("m1", webhook_event_id="e1"), "image")
+    assert not guard.admit(event("m1", webhook_event_id="e1"), "image")
+    assert not guard.admit(event("m2"), "image")
+    # Another user has their own bucket; text has no limiter here
+    assert guard.admit(event("m3", user_id="U2"), "image")
+    assert guard.admit(event("m4"), "text")
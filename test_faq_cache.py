@@ -0,0 +1,99 @@
+"""Unit tests for faq_cache: Thai normalization, near-duplicate matching and near-miss guards."""
+
+import csv
+
+import pytest
+
+import faq_cache
+from faq_cache import FAQCache, normalize_thai, question_guard
+
+
+@pytest.fixture
+def cache():
+    return FAQCache(threshold=0.95, max_entries=100)
+
+
+@pytest.mark.parametrize("question", [
+    "สุนัขพันธุ์ไหนเลี้ยงง่ายครับ",
+    "สุนัขพันธุ์ไหน เลี้ยงง่าย??",
+    "สุนัขพันธุ์ไหนเลี้ยงง่ายครับบบบ 🐶",
+    "สุนัขพันธุ์​ไหนเลี้ยงง่ายนะคะ",
+])
+def test_normalization_folds_variants_to_one_key(question):
+    assert normalize_thai(question) == "สุนัขพันธุ์ไหนเลี้ยงง่าย"
+
+
+def test_normalization_keeps_repeated_digits():
+    assert normalize_thai("อายุ 1000 วัน") != normalize_thai("อายุ 10 วัน")
+
+
+def test_question_guard():
+    assert question_guard("กินอะไรไม่ได้บ้าง") == (("ไม่",), ())
+    # "อย่าง" (how) is not the negation "อย่า"
+    assert question_guard("เลี้ยงอย่างไรดี") == ((), ())
+    assert question_guard("อย่าให้ลูกหมาอายุ ๓ เดือนกินอะไร") == (("อย่า",), (3,))
+
+
+def test_near_duplicate_is_served(cache):
+    cache.add("สุนัขพันธุ์ไหนเลี้ยงง่ายครับ", "ชิสุห์ครับ")
+    assert cache.lookup("สุนัขพันธุ์ไหน เลี้ยงง่าย??") == "ชิสุห์ครับ"
+    assert cache.hits == 1
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("สุนัขพันธุ์โกลเด้นกินอะไรได้บ้าง", "สุนัขพันธุ์โกลเด้นกินอะไรไม่ได้บ้าง"),
+    ("สุนัขพันธุ์โกลเด้นกินอะไรไม่ได้บ้าง", "สุนัขพันธุ์โกลเด้นกินอะไรได้บ้าง"),
+    ("ควรอาบน้ำลูกหมาบ่อยแค่ไหน", "ห้ามอาบน้ำลูกหมาบ่อยแค่ไหน"),
+    ("ลูกหมาอายุ 2 เดือนกินอะไรได้บ้าง", "ลูกหมาอายุ 3 เดือนกินอะไรได้บ้าง"),
+    ("ลูกหมาอายุ 2 เดือนกินอะไรได้บ้าง", "ลูกหมาอายุ 12 เดือนกินอะไรได้บ้าง"),
+])
+def test_near_miss_is_not_served_even_at_low_threshold(cached, asked):
+    cache = FAQCache(threshold=0.5, max_entries=100)
+    cache.add(cached, "cached answer")
+    assert cache.lookup(asked) is None
+
+
+def test_guard_skips_to_a_compatible_entry(cache):
+    cache.add("สุนัขพันธุ์โกลเด้นกินอะไรได้บ้าง", "can eat")
+    cache.add("สุนัขพันธุ์โกลเด้นกินอะไรไม่ได้บ้างครับ", "cannot eat")
+    assert cache.lookup("สุนัขพันธุ์โกลเด้นกินอะไรไม่ได้บ้าง") == "cannot eat"
+    assert cache.lookup("สุนัขพันธุ์โกลเด้น กินอะไรได้บ้าง") == "can eat"
+
+
+def test_default_threshold_rejects_a_different_question(cache):
+    cache.add("สุนัขพันธุ์ไหนเลี้ยงง่าย", "ชิสุห์ครับ")
+    assert cache.lookup("สุนัขพันธุ์ไหนเลี้ยงยาก") is None
+
+
+def test_excluded_answers_are_never_cached(cache):
+    cache.exclude_answers.add("ขอโทษครับ")
+    cache.add("หมากินองุ่นได้ไหม", "ขอโทษครับ")
+    assert len(cache) == 0
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    cache = FAQCache(max_entries=2, ttl=60)
+    cache.add("คำถามที่หนึ่ง", "a")
+    cache.add("คำถามที่สอง", "b")
+    cache.lookup("คำถามที่หนึ่ง")
+    cache.add("คำถามที่สาม", "c")
+    # "สอง" was the least recently used
+    assert cache.lookup("คำถามที่สอง") is None
+    assert cache.lookup("คำถามที่หนึ่ง") == "a"
+
+    now = faq_cache.time.time()
+    monkeypatch.setattr(faq_cache.time, "time", lambda: now + 61)
+    assert cache.lookup("คำถามที่หนึ่ง") is None
+    assert len(cache) == 1
+
+
+def test_load_logs_skips_images_and_excluded_answers(tmp_path):
+    with open(tmp_path / "chat.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["question", "answer_reply"])
+        writer.writeheader()
+        writer.writerow({"question": "หมากินองุ่นได้ไหม", "answer_reply": "ไม่ได้ครับ"})
+        writer.writerow({"question": "[IMAGE] 123", "answer_reply": "Golden retriever"})
+        writer.writerow({"question": "หมาชอบอะไร", "answer_reply": "fallback"})
+    cache = FAQCache(exclude_answers=["fallback"])
+    assert cache.load_logs(str(tmp_path)) == 1
+    assert cache.lookup("หมากินองุ่นได้ไหมครับ") == "ไม่ได้ครับ"
@@ -0,0 +1,61 @@
+"""Unit tests for image_store.ImageStore: deduplication and compaction tiers."""
+
+import os
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from image_store import ImageStore, sniff_extension
+
+
+def encoded(format, size=(256, 256), seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 255, (*size, 3), dtype=np.uint8)
+    out = BytesIO()
+    Image.fromarray(pixels, "RGB").save(out, format=format)
+    return out.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ImageStore(str(tmp_path / "images"))
+    yield store
+    store.close()
+
+
+def test_same_photo_is_stored_once(store):
+    data = encoded("JPEG")
+    sha256, relative, is_new = store.put(data, "m1", user_id="U1")
+    assert is_new and relative.endswith(f"{sha256}.jpg")
+    assert store.put(data, "m2", user_id="U2") == (sha256, relative, False)
+    assert store.path_for("m1") == store.path_for("m2") == os.path.join(store.root, relative)
+    assert store.stats()["blobs"] == 1 and store.stats()["messages"] == 2
+
+
+@pytest.mark.parametrize("format", ["PNG", "WEBP"])
+def test_recompressed_blob_moves_to_jpg(store, format):
+    data = encoded(format)
+    sha256, relative, _ = store.put(data, "m1", received_at=1.0)
+    old_path = os.path.join(store.root, relative)
+
+    result = store.compact(recompress_after_days=1, quality=60)
+    assert result["recompressed"] == 1
+
+    path = store.path_for("m1")
+    assert path.endswith(f"{sha256}.jpg")
+    assert not os.path.exists(old_path)
+    with open(path, "rb") as f:
+        assert sniff_extension(f.read(8)) == "jpg"
+    assert store.path_for_hash(sha256) == path
+    # A re-upload of the original bytes is still a duplicate of the compacted blob
+    assert store.put(data, "m2")[2] is False
+
+
+def test_blob_that_cannot_shrink_keeps_its_file(store):
+    data = encoded("JPEG", size=(32, 32))
+    _, relative, _ = store.put(data, "m1", received_at=1.0)
+    result = store.compact(recompress_after_days=1, quality=100)
+    assert result["recompressed"] == 0
+    assert store.path_for("m1") == os.path.join(store.root, relative)
+    assert store.stats()["tiers"] == {"recompressed": 1}
@@ -0,0 +1,109 @@
+"""
+InferencePool tests with real worker processes and a fake model.
+The first pixel of each image tells the fake model what to do (see fake_load_forward).
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from inference_pool import InferenceError, InferencePool
+
+CRASH = -1.0
+HANG = -2.0
+SLOW = -3.0
+
+
+def fake_load_forward(backend, model_path, num_threads=1):
+    """Logits with the image's first pixel in column 0; markers crash, hang or slow the worker."""
+    def forward(batch):
+        marker = float(batch[0, 0, 0, 0])
+        if marker == CRASH:
+            os._exit(1)
+        if marker == HANG:
+            time.sleep(3600)
+        if marker == SLOW:
+            time.sleep(2)
+        logits = np.zeros((len(batch), 120), dtype=np.float32)
+        logits[:, 0] = batch[:, 0, 0, 0]
+        return logits
+    return forward
+
+
+def images(*first_pixels):
+    batch = np.zeros((len(first_pixels), 3, 224, 224), dtype=np.float32)
+    batch[:, 0, 0, 0] = first_pixels
+    return batch
+
+
+def wait_for(condition, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.05)
+
+
+def make_pool(num_slots, timeout):
+    return InferencePool(1, backend="fake", model_path="-", max_batch=4, num_slots=num_slots,
+                         pin_cores=False, timeout=timeout, load_forward=fake_load_forward)
+
+
+@pytest.fixture
+def pool():
+    pool = make_pool(num_slots=1, timeout=1)
+    yield pool
+    pool.close()
+
+
+def test_batches_are_split_and_returned_in_order(pool):
+    logits = pool.predict_logits(images(*range(1, 7)))
+    assert logits[:, 0].tolist() == [1, 2, 3, 4, 5, 6]
+    assert pool.ring.free_slots() == 1
+
+
+def test_hung_worker_is_restarted_and_its_slot_reclaimed(pool):
+    with pytest.raises(InferenceError, match="timed out"):
+        pool.predict_logits(images(HANG))
+    # The only slot is held by the hung worker: waiting for a slot times out instead of blocking
+    with pytest.raises(InferenceError, match="no free inference slot"):
+        pool.predict_logits(images(1))
+
+    wait_for(lambda: pool.ring.free_slots() == 1)
+    pool.timeout = 60  # the restarted worker still has to start up
+    assert pool.predict_logits(images(5))[0, 0] == 5
+
+
+def test_crashed_worker_fails_only_its_request(pool):
+    pool.timeout = 60
+    with pytest.raises(InferenceError, match="crashed"):
+        pool.predict_logits(images(CRASH))
+    assert pool.ring.free_slots() == 1
+    assert pool.predict_logits(images(3))[0, 0] == 3
+
+
+def test_timed_out_queued_task_is_skipped_and_its_slot_reused():
+    pool = make_pool(num_slots=2, timeout=1)
+    try:
+        def run_slow():
+            with pytest.raises(InferenceError, match="timed out"):
+                pool.predict_logits(images(SLOW))
+
+        slow = threading.Thread(target=run_slow)
+        slow.start()
+        time.sleep(0.2)
+        # Queued behind the slow batch: times out while no worker holds its slot
+        with pytest.raises(InferenceError, match="timed out"):
+            pool.predict_logits(images(7))
+        assert pool.ring.free_slots() == 1
+        slow.join()
+
+        pool.timeout = 60
+        # The worker skips the stale task, so this result is not mixed up with it
+        assert pool.predict_logits(images(8))[0, 0] == 8
+        wait_for(lambda: pool.ring.free_slots() == 2)
+    finally:
+        pool.close()
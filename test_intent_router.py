@@ -0,0 +1,129 @@
+"""Unit tests for intent_router: the Aho-Corasick automaton and IntentRouter resolution."""
+
+import pytest
+
+from intent_router import DEFAULT_CONFIG, Automaton, IntentRouter, create_intent_router_from_env
+
+
+def automaton(*patterns):
+    machine = Automaton()
+    for pattern in patterns:
+        machine.add(pattern, ("keywords", pattern, len(pattern)))
+    machine.build()
+    return machine
+
+
+def found(machine, text):
+    return sorted(value[1] for value in machine.search(text))
+
+
+def test_search_finds_overlapping_and_nested_patterns():
+    machine = automaton("he", "she", "his", "hers")
+    assert found(machine, "ushers") == ["he", "hers", "she"]
+    assert found(machine, "ahishers") == ["he", "hers", "his", "she"]
+
+
+def test_search_follows_failure_links_after_a_partial_match():
+    machine = automaton("abcd", "bce")
+    # "abc" is a dead end for "abcd"; the failure link continues at "bc" of "bce"
+    assert found(machine, "abce") == ["bce"]
+
+
+def test_search_reports_repeated_occurrences():
+    assert found(automaton("aa"), "aaaa") == ["aa", "aa", "aa"]
+
+
+def test_search_on_thai_text():
+    machine = automaton("ชื่ออะไร", "กินอะไร")
+    assert found(machine, "บอทชื่ออะไรเหรอ") == ["ชื่ออะไร"]
+    assert found(machine, "ไม่มีคำที่ตรง") == []
+
+
+def test_prefixes_only_match_at_the_start():
+    machine = automaton("สวัสดี", "สวัส", "ดี")
+    assert sorted(value[1] for value in machine.prefixes("สวัสดีครับ")) == ["สวัส", "สวัสดี"]
+    assert list(machine.prefixes("หวัดดี")) == []
+
+
+def test_empty_automaton_matches_nothing():
+    machine = automaton()
+    assert list(machine.search("anything")) == []
+    assert list(machine.prefixes("anything")) == []
+
+
+CONFIG = {
+    "lookup_strip": {"prefixes": ["สุนัขพันธุ์", "สุนัข"], "suffixes": ["คืออะไร"]},
+    "intents": [
+        {"name": "greeting", "exact": ["สวัสดี"], "prefix": ["สวัสดี", "สวัส"], "max_length": 16,
+         "reply": "greeting"},
+        {"name": "bot_name", "keywords": ["ชื่ออะไร"], "max_length": 20, "reply": "bot_name"},
+        {"name": "help", "keywords": ["ช่วย", "ทำอะไรได้"], "reply": "help"},
+        {"name": "thanks", "regex": ["^thank(s| you)"], "reply": "thanks"},
+        {"name": "good_morning", "prefix": ["สวัสดีตอนเช้า"], "reply": "good_morning"},
+    ],
+    "breeds": {
+        "entries": {
+            "golden_retriever": {"aliases": ["โกลเด้น"], "info": "ขนยาวสีทอง"},
+            "not_a_class": {"info": "skipped"},
+        },
+        "reply_template": "{display_name}: {info}",
+    },
+}
+
+
+@pytest.fixture
+def router():
+    return IntentRouter(CONFIG, class_names=["golden_retriever"])
+
+
+@pytest.mark.parametrize("text, intent, kind", [
+    ("สวัสดีครับ!!", "greeting", "exact"),
+    ("สวัสดีทุกคน", "greeting", "prefix"),
+    ("บอทชื่ออะไร", "bot_name", "keyword"),
+    ("ช่วยอะไรได้บ้าง", "help", "keyword"),
+    ("Thank you!", "thanks", "regex"),
+    ("โกลเด้น", "breed_lookup", "breed"),
+    ("สุนัขพันธุ์โกลเด้นคืออะไรครับ", "breed_lookup", "breed"),
+    ("golden retriever", "breed_lookup", "breed"),
+])
+def test_route(router, text, intent, kind):
+    match = router.route(text)
+    assert (match.intent, match.kind) == (intent, kind)
+
+
+def test_breed_reply_uses_the_template(router):
+    assert router.route("โกลเด้น").reply == "golden retriever: ขนยาวสีทอง"
+    assert "notaclass" not in router.breed_replies
+
+
+def test_longest_prefix_wins(router):
+    # Longest prefix beats file order for prefixes (unlike keywords)
+    assert router.route("สวัสดีตอนเช้าครับทุกคน").intent == "good_morning"
+
+
+def test_earliest_intent_wins_among_keywords(router):
+    # Both bot_name and help keywords occur; bot_name comes first in the file
+    assert router.route("ช่วยบอกหน่อยชื่ออะไร").intent == "bot_name"
+
+
+def test_max_length_lets_long_messages_reach_the_llm(router):
+    assert router.route("สวัสดีครับ แล้วโกลเด้นกินอะไรได้บ้างครับ อยากรู้มาก") is None
+    # help has no max_length
+    assert router.route("ช่วยบอกหน่อยว่าโกลเด้นกินอะไรได้บ้างครับ อยากรู้มาก").intent == "help"
+
+
+def test_unmatched_and_empty_messages_fall_through(router):
+    assert router.route("โกลเด้นกินองุ่นได้ไหม") is None
+    assert router.route("!!! 🐶") is None
+
+
+def test_shipped_intents_load(monkeypatch):
+    monkeypatch.setenv("INTENTS_CONFIG", DEFAULT_CONFIG)
+    router = create_intent_router_from_env(class_names=["golden_retriever"])
+    assert router.route("สวัสดี").intent == "greeting"
+
+
+def test_missing_config_falls_back_to_quick_replies(monkeypatch, tmp_path):
+    monkeypatch.setenv("INTENTS_CONFIG", str(tmp_path / "missing.json"))
+    router = create_intent_router_from_env(class_names=[])
+    assert router.route("ชื่ออะไร").intent == "bot_name"
@@ -0,0 +1,99 @@
+"""Unit tests for model_registry.ModelRegistry: swap, draining and the file watcher."""
+
+import os
+import time
+
+import pytest
+
+from model_registry import ModelRegistry
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    # Distinct mtimes even on coarse filesystem clocks
+    stamp = time.time() + len(text)
+    os.utime(path, (stamp, stamp))
+
+
+def loader(path):
+    with open(path) as f:
+        model = f.read()
+    if model.startswith("bad"):
+        raise ValueError("corrupt model")
+    return model
+
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    path = str(tmp_path / "model.pth")
+    write(path, "v1")
+    return path
+
+
+def test_old_version_drains_after_swap(model_path):
+    registry = ModelRegistry(model_path, loader)
+    with registry.acquire() as model:
+        write(model_path, "v2")
+        assert registry.reload()
+        assert model == "v1" and registry.current == "v2"
+        assert registry.describe()["draining"] == [{"version": 1, "in_flight": 1}]
+    assert registry.describe()["draining"] == []
+
+
+def test_rejected_model_keeps_serving_the_current_one(model_path):
+    registry = ModelRegistry(model_path, loader, warm=lambda model: None)
+    write(model_path, "bad")
+    assert not registry.reload()
+    assert registry.current == "v1" and registry.version == 1
+    assert "corrupt model" in registry.describe()["last_error"]
+
+
+def test_watcher_skips_a_rejected_file_until_it_changes(model_path):
+    calls = []
+    registry = ModelRegistry(model_path, lambda path: calls.append(path) or loader(path))
+    calls.clear()
+    registry.watch(0.02)
+    try:
+        write(model_path, "bad 1")
+        assert wait_for(lambda: registry.last_error is not None)
+        time.sleep(0.2)
+        # Not retried while unchanged, and still reported
+        assert len(calls) == 1
+        assert "corrupt model" in registry.describe()["last_error"]
+
+        write(model_path, "bad 22")
+        assert wait_for(lambda: len(calls) == 2)
+        write(model_path, "v2 fixed")
+        assert wait_for(lambda: registry.current == "v2 fixed")
+        assert registry.version == 2 and registry.last_error is None
+    finally:
+        registry.close()
+
+
+def test_watcher_leaves_the_serving_model_alone_after_a_rollback(model_path, tmp_path):
+    calls = []
+    registry = ModelRegistry(model_path, lambda path: calls.append(path) or loader(path))
+    os.replace(model_path, str(tmp_path / "backup.pth"))
+    write(model_path, "bad")
+    # Rejected by an explicit reload: the watcher does not try the same file again
+    assert not registry.reload()
+    registry.watch(0.02)
+    try:
+        time.sleep(0.2)
+        assert len(calls) == 2
+        # Rolling back restores the serving file's signature: nothing to reload
+        os.replace(str(tmp_path / "backup.pth"), model_path)
+        time.sleep(0.2)
+        assert len(calls) == 2 and registry.version == 1
+    finally:
+        registry.close()
@@ -0,0 +1,56 @@
+"""Unit tests for shm_ring.SlotRing."""
+
+import queue
+
+import numpy as np
+import pytest
+
+from shm_ring import SlotHandle, SlotRing
+
+
+@pytest.fixture
+def ring():
+    ring = SlotRing(num_slots=2, max_batch=4, input_shape=(3, 8, 8), num_classes=5)
+    yield ring
+    ring.close()
+
+
+def test_write_input_and_read_output_roundtrip(ring):
+    slot = ring.acquire()
+    batch = np.random.default_rng(0).standard_normal((3, 3, 8, 8), dtype=np.float32)
+    handle = ring.write_input(slot, batch)
+    assert handle == SlotHandle(slot, 3)
+    np.testing.assert_array_equal(ring.input_view(handle), batch)
+
+    ring.output_view(handle)[:] = np.arange(15, dtype=np.float32).reshape(3, 5)
+    logits = ring.read_output(handle)
+    ring.output_view(handle)[:] = 0
+    # read_output copies, so the slot can be reused without touching the result
+    assert logits[2, 4] == 14
+
+
+def test_attached_ring_shares_memory(ring):
+    other = SlotRing.attach(ring.spec())
+    try:
+        slot = ring.acquire()
+        handle = ring.write_input(slot, np.ones((2, 3, 8, 8), dtype=np.float32))
+        other.output_view(handle)[:] = 7
+        assert (ring.read_output(handle) == 7).all()
+        # Only the creating process hands out slots
+        assert other.free_slots() == 0
+    finally:
+        other.close()
+
+
+def test_batch_larger_than_slot_is_rejected(ring):
+    with pytest.raises(ValueError):
+        ring.write_input(ring.acquire(), np.zeros((5, 3, 8, 8), dtype=np.float32))
+
+
+def test_acquire_times_out_when_all_slots_are_taken(ring):
+    first, second = ring.acquire(), ring.acquire()
+    assert {first, second} == {0, 1}
+    with pytest.raises(queue.Empty):
+        ring.acquire(timeout=0.05)
+    ring.release(first)
+    assert ring.acquire(timeout=0.05) == first
@@ -0,0 +1,130 @@
+"""Unit tests for singleflight.SingleFlight and AsyncSingleFlight."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import AsyncSingleFlight, SingleFlight, request_key
+
+
+def test_request_key_ignores_unrelated_fields_and_key_order():
+    payload = {"model": "m", "messages": [{"role": "user", "content": "สวัสดี"}], "max_tokens": 10}
+    same = {"max_tokens": 10, "stream": False, "messages": payload["messages"], "model": "m"}
+    assert request_key(payload) == request_key(same)
+    assert request_key(payload) != request_key({**payload, "max_tokens": 11})
+
+
+def test_concurrent_callers_share_one_call():
+    flights = SingleFlight("test")
+    calls, started, release = [], threading.Event(), threading.Event()
+
+    def upstream():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "answer"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("k", upstream)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flights.do("k", upstream))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    # Give the followers time to join the flight before the leader finishes
+    time.sleep(0.1)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+    assert results == ["answer"] * 4
+    assert len(calls) == 1
+    assert flights.in_flight() == 0
+
+
+def test_leader_error_is_shared_and_not_remembered():
+    flights = SingleFlight("test")
+    with pytest.raises(RuntimeError):
+        flights.do("k", lambda: (_ for _ in ()).throw(RuntimeError("down")))
+    # Nothing is cached: the next call goes upstream again
+    assert flights.do("k", lambda: "ok") == "ok"
+
+
+def test_async_callers_share_one_call():
+    flights = AsyncSingleFlight("test")
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*(flights.do("k", upstream) for _ in range(4)))
+
+    assert asyncio.run(main()) == ["answer"] * 4
+    assert len(calls) == 1
+    assert flights.in_flight() == 0
+
+
+def test_async_leader_cancellation_does_not_cancel_followers():
+    flights = AsyncSingleFlight("test")
+
+    async def upstream():
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        leader = asyncio.ensure_future(flights.do("k", upstream))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.do("k", upstream))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "answer"
+
+
+def test_async_upstream_is_cancelled_when_every_caller_is():
+    flights = AsyncSingleFlight("test")
+    cancelled = []
+
+    async def upstream():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def main():
+        callers = [asyncio.ensure_future(flights.do("k", upstream)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        # One caller is still waiting: the upstream call keeps running
+        assert not cancelled
+        callers[1].cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert cancelled == [1]
+    assert flights.in_flight() == 0
+
+
+def test_async_error_reaches_every_caller():
+    flights = AsyncSingleFlight("test")
+
+    async def upstream():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("down")
+
+    async def main():
+        return await asyncio.gather(*(flights.do("k", upstream) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flights.in_flight() == 0
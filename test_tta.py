@@ -0,0 +1,62 @@
+"""Unit tests for tta: the augmented-views batch and skipping confident first passes."""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import dog_model
+import tta
+from tta import augmented_views
+
+
+def photo():
+    pixels = np.random.default_rng(0).integers(0, 255, (120, 160, 3), dtype=np.uint8)
+    return Image.fromarray(pixels, "RGB")
+
+
+def test_corners_add_four_views():
+    batch = augmented_views(photo(), views=("flip", "corners"))
+    assert batch.shape == (5, 3, 224, 224) and batch.dtype == np.float32
+    assert batch.flags["C_CONTIGUOUS"]
+    assert tta.TestTimeAugmentation(None, views=("flip", "corners")).batch_size == 5
+
+
+def test_flip_mirrors_the_first_pass_array():
+    image = photo()
+    original = dog_model.preprocess_image(image)
+    batch = augmented_views(image, views=("flip",), first_pass=original)
+    assert np.array_equal(batch, original[..., ::-1])
+
+
+def test_unknown_view_is_an_error():
+    with pytest.raises(ValueError):
+        tta.TestTimeAugmentation(None, views=("rotate",))
+
+
+def logits(probs, rows=1):
+    return np.log(np.tile(np.asarray(probs, dtype=np.float32), (rows, 1)))
+
+
+def test_confident_first_pass_skips_the_views():
+    calls = []
+
+    def forward(batch):
+        calls.append(len(batch))
+        return logits([0.9, 0.1], len(batch))
+
+    probs = tta.TestTimeAugmentation(forward, min_confidence=0.5).predict_probs(photo())
+    # Only the first pass ran
+    assert calls == [1]
+    assert np.allclose(probs, [0.9, 0.1])
+
+
+def test_unsure_first_pass_averages_one_batch_of_views():
+    calls = []
+
+    def forward(batch):
+        calls.append(len(batch))
+        return logits([0.4, 0.6] if len(batch) == 1 else [0.8, 0.2], len(batch))
+
+    probs = tta.TestTimeAugmentation(forward, min_confidence=0.7).predict_probs(photo())
+    assert calls == [1, 3]
+    assert np.allclose(probs, [(0.4 + 3 * 0.8) / 4, (0.6 + 3 * 0.2) / 4])
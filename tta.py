@@ -0,0 +1,120 @@
+"""
+Test-time augmentation (TTA) for low-confidence predictions
+Averaging the model over a few flipped / cropped views of a photo fixes some of the
+close calls, but running every view on every photo would multiply inference time.
+With TTA=1 predict_pil runs the normal single-image pass first; only when its top-1
+confidence is below TTA_MIN_CONFIDENCE are the augmented views built and run as ONE
+batched forward pass, and the final probabilities are the mean over all views
+(including the first pass). Confident photos - the majority - cost nothing extra.
+
+Views (TTA_VIEWS, comma separated):
+    flip        horizontal mirror of the whole photo (no resampling: flipped array)
+    crop        centre crop of TTA_CROP (default 85%) of the photo
+    crop_flip   mirrored centre crop
+    corners     the four corner crops of TTA_CROP (adds 4 views)
+
+Configuration (environment variables):
+    TTA=0                       # set to 1 to enable
+    TTA_MIN_CONFIDENCE=0.5      # augment only below this top-1 confidence
+    TTA_VIEWS=flip,crop,crop_flip
+    TTA_CROP=0.85
+"""
+
+import os
+import time
+
+import numpy as np
+
+import dog_model
+import metrics
+
+VIEWS = ("flip", "crop", "crop_flip", "corners")
+
+
+def _crop(image, fraction, anchor):
+    """Crop `fraction` of the width and height; anchor is (x, y) in 0..1 (0.5, 0.5 = centre)."""
+    width, height = image.size
+    crop_width, crop_height = int(width * fraction), int(height * fraction)
+    left = int((width - crop_width) * anchor[0])
+    top = int((height - crop_height) * anchor[1])
+    return image.crop((left, top, left + crop_width, top + crop_height))
+
+
+def augmented_views(image, views=("flip", "crop", "crop_flip"), crop=0.85, first_pass=None):
+    """
+    Preprocessed augmented views of one RGB PIL image as a (N, 3, 224, 224) batch.
+
+    Args:
+        first_pass: the already preprocessed (1, 3, 224, 224) original, reused for "flip"
+    """
+    arrays = []
+    for view in views:
+        if view == "flip":
+            original = first_pass if first_pass is not None else dog_model.preprocess_image(image)
+            arrays.append(original[..., ::-1])
+        elif view in ("crop", "crop_flip"):
+            center = dog_model.preprocess_image(_crop(image, crop, (0.5, 0.5)))
+            arrays.append(center[..., ::-1] if view == "crop_flip" else center)
+        elif view == "corners":
+            for anchor in ((0, 0), (1, 0), (0, 1), (1, 1)):
+                arrays.append(dog_model.preprocess_image(_crop(image, crop, anchor)))
+    return np.ascontiguousarray(np.concatenate(arrays), dtype=np.float32)
+
+
+class TestTimeAugmentation:
+    """First pass on the original; one batched pass over augmented views when it is unsure."""
+
+    def __init__(self, forward, first_pass=None, views=("flip", "crop", "crop_flip"), crop=0.85,
+                 min_confidence=0.5):
+        unknown = set(views) - set(VIEWS)
+        if unknown:
+            raise ValueError(f"Unknown TTA view(s) {', '.join(sorted(unknown))} (expected {', '.join(VIEWS)})")
+        self.forward = forward
+        # first_pass(batch) -> probabilities, e.g. the cascade; defaults to softmax(forward)
+        self.first_pass = first_pass or (lambda batch: dog_model.softmax(forward(batch)))
+        self.views = tuple(views)
+        self.crop = crop
+        self.min_confidence = min_confidence
+
+    @property
+    def batch_size(self):
+        """Rows in the augmented-views batch."""
+        return sum(4 if view == "corners" else 1 for view in self.views)
+
+    def predict_probs(self, image):
+        """(num_classes,) probabilities for one RGB PIL image."""
+        original = dog_model.preprocess_image(image)
+        probs = self.first_pass(original)[0]
+        if probs.max() >= self.min_confidence:
+            metrics.TTA.inc(outcome="skipped")
+            return probs
+
+        start = time.perf_counter()
+        batch = augmented_views(image, self.views, self.crop, first_pass=original)
+        view_probs = dog_model.softmax(self.forward(batch))
+        averaged = (probs + view_probs.sum(axis=0)) / (1 + len(view_probs))
+        metrics.TTA_LATENCY.observe(time.perf_counter() - start)
+        metrics.TTA.inc(outcome="changed" if averaged.argmax() != probs.argmax() else "applied")
+        return averaged
+
+    def predict_pil(self, image, k=3):
+        """Same contract as predict_pil in the entry points: [(breed_name, confidence), ...]."""
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return dog_model.top_k(self.predict_probs(image), k)
+
+
+def create_tta_from_env(forward, first_pass=None):
+    """TestTimeAugmentation around forward(batch) -> logits when TTA=1, otherwise None."""
+    if os.getenv("TTA", "0") != "1":
+        return None
+    views = [view.strip() for view in os.getenv("TTA_VIEWS", "flip,crop,crop_flip").split(",") if view.strip()]
+    tta = TestTimeAugmentation(
+        forward,
+        first_pass=first_pass,
+        views=views,
+        crop=float(os.getenv("TTA_CROP", "0.85")),
+        min_confidence=float(os.getenv("TTA_MIN_CONFIDENCE", "0.5")),
+    )
+    print(f"TTA: {', '.join(tta.views)} ({tta.batch_size} views in one batch) below {tta.min_confidence:.0%} confidence")
+    return tta
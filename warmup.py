@@ -0,0 +1,160 @@
+"""
+Model warm-up at startup and the /ready endpoint
+After "Dog breed model loaded successfully!" the first real image still paid for memory
+allocation, kernel selection and (ONNX Runtime) lazy initialization, so the first user
+after a deploy or worker respawn got the slowest reply of the day. The entry points now
+run warm-up before serving:
+
+- `rounds` dummy batches of every size in WARMUP_BATCH_SIZES through the backend's
+  forward(batch) (plus the sizes the entry point knows it serves, e.g. the TTA batch)
+- `rounds` full predict_pil calls on a synthetic photo, which also warms PIL decoding,
+  resizing and whatever predict_pil routes through (cascade, TTA, inference pool)
+
+Inference pool workers warm their own model before reporting ready (see inference_pool.py).
+
+GET /ready answers 503 {"state": "warming"} until warm-up is done (or "failed" if a dummy
+prediction raised) and 200 afterwards, for load-balancer / orchestrator readiness probes. With WARMUP=sync (default) warm-up
+finishes while the module is imported, i.e. before waitress-serve opens the port; with
+WARMUP=background the port opens at once and /ready tells when to send traffic.
+
+Configuration (environment variables):
+    WARMUP=sync              # sync, background or off
+    WARMUP_ROUNDS=3          # dummy runs per batch size
+    WARMUP_BATCH_SIZES=1     # comma separated, e.g. 1,4,8
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+import metrics
+
+WARMUP_MODES = ("sync", "background", "off")
+
+
+def batch_sizes_from_env(*extra):
+    """WARMUP_BATCH_SIZES plus `extra` sizes, sorted and without duplicates."""
+    sizes = {int(size) for size in os.getenv("WARMUP_BATCH_SIZES", "1").split(",") if size.strip()}
+    sizes.update(size for size in extra if size)
+    return sorted(sizes)
+
+
+def dummy_batch(size, seed=0):
+    """Deterministic float32 (size, 3, 224, 224) batch, roughly normalized like a real photo."""
+    return np.random.default_rng(seed).standard_normal((size, 3, 224, 224), dtype=np.float32)
+
+
+def dummy_image(width=640, height=480):
+    """Deterministic photo-sized RGB image."""
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), "RGB")
+
+
+def _timed(fn, rounds):
+    """Milliseconds of the first and the last of `rounds` calls."""
+    timings = []
+    for _ in range(max(1, rounds)):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"first_ms": round(timings[0], 1), "last_ms": round(timings[-1], 1)}
+
+
+def warm_forward(forward, batch_sizes=(1,), rounds=3):
+    """Run `rounds` dummy batches of each size through forward(batch); timings per size."""
+    timings = {}
+    for size in batch_sizes:
+        batch = dummy_batch(size)
+        timings[f"batch_{size}"] = _timed(lambda: forward(batch), rounds)
+    return timings
+
+
+def warm_rounds():
+    return int(os.getenv("WARMUP_ROUNDS", "3"))
+
+
+def warm_up(predict_pil=None, forward=None, batch_sizes=(1,), rounds=3):
+    """Warm forward(batch) for every batch size, then predict_pil end to end; timings per step."""
+    timings = {}
+    if forward is not None:
+        timings.update(warm_forward(forward, batch_sizes, rounds))
+    if predict_pil is not None:
+        image = dummy_image()
+        timings["predict_pil"] = _timed(lambda: predict_pil(image), rounds)
+    return timings
+
+
+class Readiness:
+    """Warm-up state reported by /ready."""
+
+    def __init__(self):
+        self.state = "starting"
+        self.error = None
+        self.timings = {}
+        self.seconds = None
+        metrics.READY.set_function(lambda: 1 if self.ready else 0)
+
+    @property
+    def ready(self):
+        return self.state in ("ready", "skipped")
+
+    def run(self, warm):
+        """
+        Run warm() -> timings and record the outcome. A failing dummy prediction means
+        real ones would fail too, so the state becomes "failed" and /ready stays 503.
+        """
+        self.state = "warming"
+        start = time.perf_counter()
+        try:
+            self.timings = warm()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.state = "failed"
+            print(f"⚠️  Warm-up failed, /ready will report not ready: {self.error}")
+            return
+        finally:
+            self.seconds = round(time.perf_counter() - start, 2)
+            metrics.WARMUP_SECONDS.set(self.seconds)
+        self.state = "ready"
+        print(f"Warm-up done in {self.seconds:.1f}s: " + ", ".join(
+            f"{step} {t['first_ms']:.0f} -> {t['last_ms']:.0f} ms" for step, t in self.timings.items()))
+
+    def describe(self):
+        return {"state": self.state, "ready": self.ready, "warmup_seconds": self.seconds,
+                "timings": self.timings, "error": self.error}
+
+
+def start_warmup_from_env(predict_pil, forward=None, extra_batch_sizes=()):
+    """
+    Warm up according to WARMUP and return the Readiness for /ready.
+
+    Args:
+        predict_pil: the entry point's predict_pil(image)
+        forward: forward(batch) -> logits of the serving backend, if the entry point has one
+        extra_batch_sizes: other batch sizes the entry point runs (e.g. TTA views)
+    """
+    mode = os.getenv("WARMUP", "sync")
+    if mode not in WARMUP_MODES:
+        raise ValueError(f"WARMUP must be one of {', '.join(WARMUP_MODES)}, got '{mode}'")
+    readiness = Readiness()
+    if mode == "off":
+        readiness.state = "skipped"
+        return readiness
+
+    batch_sizes = batch_sizes_from_env(*extra_batch_sizes)
+    rounds = warm_rounds()
+    print(f"Warming up ({mode}): {rounds} rounds of "
+          + (f"batch sizes {batch_sizes} and " if forward is not None else "") + "predict_pil")
+
+    def warm():
+        return warm_up(predict_pil, forward, batch_sizes, rounds)
+
+    if mode == "background":
+        readiness.state = "warming"
+        threading.Thread(target=readiness.run, args=(warm,), name="warmup", daemon=True).start()
+    else:
+        readiness.run(warm)
+    return readiness